@@ -3,17 +3,39 @@ Script for comparing the results of test cases with two different commit IDs.
 Purpose is to make sure that any new commits keep the results of the test cases the same,
 or only change the test cases it expects to (e.g. a bug fix will change the result).
 
+Each commit is compiled once for all of the test cases, and the (test case, commit) runs
+are done concurrently, as many at a time as fit in the core budget. The result of each run
+is recorded in its output directory, so a commit that has already been run with the same
+namelist and diag table is not run again. The comparison reports the maximum and RMS
+difference of every output variable, checked against configurable tolerances, and the
+difference in run time between the two commits.
+
 When you submit a new pull request, please run this test and report the results in the pull request.
 """
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import hashlib
+import json
+import time
+
 import numpy as np
-from isca import Experiment, IscaCodeBase, SocratesCodeBase, FailedRunError, GFDL_BASE, DiagTable
-from isca.util import exp_progress
+from isca import Experiment, IscaCodeBase, SocratesCodeBase, FailedRunError, GFDL_BASE, GFDL_ENV, DiagTable, get_env_file
+from isca.codebase import RepoMirror
 import xarray as xar
 import pdb
 import numpy as np
 import os
 import sys
 
+DEFAULT_REPO = 'git@github.com:execlim/Isca'
+
+RUN_DAYS = 3                           # only run for 3 days to keep things short
+RUN_RECORD = 'trip_test_run.json'      # written to the output directory of each completed run
+
+TripTestRun = namedtuple('TripTestRun', 'test_case commit datadir seconds cached completed')
+VariableDiff = namedtuple('VariableDiff', 'max_diff rms_diff tolerance passed note')
+
 def get_nml_diag(test_case_name):
     """Gets the appropriate namelist and input files from each of the test case scripts in the test_cases folder
     """
@@ -146,76 +168,245 @@ def process_ids(base_commit_in, later_commit_in):
 
     return base_commit_short, later_commit_short
 
-def conduct_comparison_on_test_case(base_commit, later_commit, test_case_name, repo_to_use='git@github.com:execlim/Isca', num_cores_to_use=4):
-    """Process here is to checkout each commit in turn, compiles it if necessary, uses the appropriate nml for the test
-    case under consideration, and runs the code with the two commits in turn. The output is then compared for all variables
-    in the diag file. If there are any differences in the output variables then the test classed as a failure."""
-
-    data_dir_dict = {}
-    nml_use, input_files_use  = get_nml_diag(test_case_name)
+def codebase_class(test_case_name):
+    """Returns the CodeBase class that the test case is compiled with."""
+    if 'socrates' in test_case_name or 'ape_aquaplanet' in test_case_name:
+        return SocratesCodeBase
+    return IscaCodeBase
+
+def experiment_name(test_case_name, commit):
+    return test_case_name+'_trip_test_21_'+commit[0:7]
+
+def parse_tolerances(tolerance_args):
+    """Turns a list of 'VALUE' or 'VARIABLE=VALUE' strings into a dict of absolute tolerances
+    on the maximum difference of each variable. A bare VALUE sets the 'default' for all variables."""
+    tolerances = {}
+    for arg in tolerance_args or []:
+        var, _, value = arg.rpartition('=')
+        tolerances[var or 'default'] = float(value)
+    return tolerances
+
+def compile_codebases(commits, test_case_names, repo_to_use=DEFAULT_REPO, max_workers=1):
+    """Checks out and compiles each commit once for every CodeBase class the test cases need,
+    up to `max_workers` at a time. Returns a dict of {(class, commit): codebase}, with None for
+    those that failed to compile."""
+    codebases = {}
+    for test_case_name in test_case_names:
+        for commit in commits:
+            key = (codebase_class(test_case_name), commit)
+            if key not in codebases:
+                codebases[key] = key[0](repo=repo_to_use, commit=commit)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(codebases)))) as executor:
+        futures = {key: executor.submit(cb.compile) for key, cb in codebases.items()}
+    for key, future in futures.items():
+        try:
+            future.result()
+        except Exception as e:
+            print('Compilation of commit '+key[1]+' with '+key[0].__name__+' failed: '+str(e))
+            codebases[key] = None
+    return codebases
+
+def file_digest(filename):
+    """Returns the sha1 hash of the contents of a file."""
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def run_key(exp, num_cores_to_use):
+    """Returns a hash of everything, apart from the commit, that the output of a trip test run depends on:
+    the namelist, diag table, contents of the input files, number of cores and the build environment."""
+    input_files = [(filename, file_digest(filename)) for filename in sorted(exp.inputfiles)]
+    env_file = get_env_file()
+    build = (GFDL_ENV, file_digest(env_file), exp.codebase.compile_flags)
+    settings = repr((exp.namelist, exp.diag_table.files, input_files, num_cores_to_use, build))
+    return hashlib.sha1(settings.encode('utf8')).hexdigest()
+
+def run_test_case(cb, test_case_name, commit, nml, input_files, diag, num_cores_to_use=4):
+    """Runs the test case with the compiled codebase `cb` of `commit` and returns a TripTestRun.
+    If the output directory already holds a completed run of the same commit with the same
+    namelist, diag table, input files and number of cores, that run is used instead."""
+    exp = Experiment(experiment_name(test_case_name, commit), codebase=cb)
+    exp.namelist = copy.deepcopy(nml)
+    exp.diag_table = diag.copy()
+    exp.inputfiles = list(input_files)
+    exp.update_namelist({
+    'main_nml': {
+    'days': RUN_DAYS,
+    }})
+
+    key = run_key(exp, num_cores_to_use)
+    record_file = os.path.join(exp.get_outputdir(1), RUN_RECORD)
+    try:
+        with open(record_file) as f:
+            record = json.load(f)
+    except (IOError, ValueError):
+        record = {}
+    if record.get('commit') == commit and record.get('key') == key:
+        exp.log.info('Using the existing trip test output of '+test_case_name+' for commit '+commit)
+        return TripTestRun(test_case_name, commit, exp.datadir, record['seconds'], True, True)
+
+    if os.path.isdir(exp.datadir):
+        # output from an older version of the test case or an unfinished run
+        exp.rm_datadir()
+
+    start = time.time()
+    try:
+        exp.run(1, use_restart=False, num_cores=num_cores_to_use)
+    except FailedRunError as e:
+        #If run fails then test automatically fails
+        return TripTestRun(test_case_name, commit, exp.datadir, time.time() - start, False, False)
+    seconds = time.time() - start
+
+    with open(record_file, 'w') as f:
+        json.dump({'commit': commit, 'key': key, 'seconds': seconds}, f)
+    return TripTestRun(test_case_name, commit, exp.datadir, seconds, False, True)
+
+def compare_datasets(base_file, later_file, tolerances=None):
+    """Compares every variable in two output files and returns a dict of {variable: VariableDiff}.
+    A variable passes if its maximum absolute difference is no more than its tolerance, from
+    `tolerances` by name or else `tolerances['default']`, which is 0 if not given. NaNs in the
+    same places in both files are not counted as differences."""
+    tolerances = tolerances or {}
+    diffs = {}
+    with xar.open_dataset(base_file, decode_times=False) as base, xar.open_dataset(later_file, decode_times=False) as later:
+        for var in sorted(set(base.data_vars) | set(later.data_vars)):
+            tolerance = tolerances.get(var, tolerances.get('default', 0.))
+            if var not in base.data_vars or var not in later.data_vars:
+                diffs[var] = VariableDiff(None, None, tolerance, False, 'only in one of the commits')
+                continue
+            base_values, later_values = base[var].values, later[var].values
+            if base_values.shape != later_values.shape:
+                diffs[var] = VariableDiff(None, None, tolerance, False, 'shape changed from %s to %s' % (base_values.shape, later_values.shape))
+                continue
+            if not (np.issubdtype(base_values.dtype, np.number) and np.issubdtype(later_values.dtype, np.number)):
+                diffs[var] = VariableDiff(None, None, tolerance, bool(np.array_equal(base_values, later_values)), 'not numeric')
+                continue
+
+            diff = later_values.astype(np.float64) - base_values.astype(np.float64)
+            diff[np.isnan(base_values) & np.isnan(later_values)] = 0.
+            max_diff = float(np.abs(diff).max()) if diff.size else 0.
+            rms_diff = float(np.sqrt(np.mean(diff**2))) if diff.size else 0.
+            # a NaN in only one of the files gives a NaN max_diff, which fails
+            diffs[var] = VariableDiff(max_diff, rms_diff, tolerance, bool(max_diff <= tolerance), '')
+    return diffs
+
+def compare_test_case(test_case_name, base_run, later_run, diag, tolerances=None):
+    """Returns the report of one test case, comparing the output files in `diag` of two TripTestRuns."""
+    result = {
+        'result': 'pass',
+        'seconds': {'base': base_run.seconds, 'later': later_run.seconds},
+        'timing_delta': None,
+        'cached': {'base': base_run.cached, 'later': later_run.cached},
+        'files': {},
+    }
+    if not (base_run.completed and later_run.completed):
+        result['result'] = 'crashed'
+        return result
+
+    result['timing_delta'] = later_run.seconds - base_run.seconds
+    for diag_file_entry in diag.files.keys():
+        diffs = compare_datasets(os.path.join(base_run.datadir, 'run0001', diag_file_entry+'.nc'),
+                                 os.path.join(later_run.datadir, 'run0001', diag_file_entry+'.nc'), tolerances)
+        result['files'][diag_file_entry] = dict((var, d._asdict()) for var, d in diffs.items())
+        if not all(d.passed for d in diffs.values()):
+            result['result'] = 'fail'
+    return result
+
+def run_trip_tests(base_commit, later_commit, exps_to_check, repo_to_use=DEFAULT_REPO, num_cores_to_use=4, total_cores=None, tolerances=None):
+    """Runs each test case with the two commits and returns a report of the comparison, as a dict
+    that can be written as json. Each run uses `num_cores_to_use` cores and as many runs are
+    done at once as fit in `total_cores`, by default all of the cores of this machine."""
+    total_cores = total_cores or os.cpu_count() or num_cores_to_use
+    parallel_runs = max(1, total_cores // num_cores_to_use)
+
+    #Resolve branches and tags to commit hashes, so a moving branch is never mistaken for a cached result
+    mirror = RepoMirror(repo_to_use)
+    commits = [mirror.commit_id(base_commit), mirror.commit_id(later_commit)]
+
+    #The test case scripts are imported here, rather than in the threads doing the runs
+    test_cases = dict((name, get_nml_diag(name)) for name in exps_to_check)
     diag_use = define_simple_diag_table()
-    test_pass = True
-    run_complete = True
-
-    #Do the run for each of the commits in turn
-    for s in [base_commit, later_commit]:
-        exp_name = test_case_name+'_trip_test_21_'+s
-        if 'socrates' in test_case_name or 'ape_aquaplanet' in test_case_name:
-            cb = SocratesCodeBase(repo=repo_to_use, commit=s)
-        else:
-            cb = IscaCodeBase(repo=repo_to_use, commit=s)
-        cb.compile()
-        exp = Experiment(exp_name, codebase=cb)
-        exp.namelist = nml_use.copy()
-        exp.diag_table = diag_use
-        exp.inputfiles = input_files_use
-
-        #Only run for 3 days to keep things short.
-        exp.update_namelist({
-        'main_nml': {
-        'days': 3,
-        }})
 
+    codebases = compile_codebases(commits, exps_to_check, repo_to_use, max_workers=total_cores)
+
+    with ThreadPoolExecutor(max_workers=parallel_runs) as executor:
+        futures = {}
+        for test_case_name, (nml_use, input_files_use) in test_cases.items():
+            for commit in commits:
+                cb = codebases[(codebase_class(test_case_name), commit)]
+                if cb is not None and (test_case_name, commit) not in futures:
+                    futures[(test_case_name, commit)] = executor.submit(run_test_case, cb, test_case_name, commit, nml_use,
+                                                                        input_files_use, diag_use, num_cores_to_use)
+    runs = {}
+    for (test_case_name, commit), future in futures.items():
         try:
-            # run with a progress bar
-            with exp_progress(exp, description=s) as pbar:
-                exp.run(1, use_restart=False, num_cores=num_cores_to_use)
-        except FailedRunError as e:
-            #If run fails then test automatically fails
-            run_complete = False
-            test_pass = False
+            runs[(test_case_name, commit)] = future.result()
+        except Exception as e:
+            print('Run of '+test_case_name+' with commit '+commit+' failed: '+str(e))
+
+    report = {
+        'base_commit': base_commit,
+        'later_commit': later_commit,
+        'base_hash': commits[0],
+        'later_hash': commits[1],
+        'repo': repo_to_use,
+        'num_cores': num_cores_to_use,
+        'tolerances': tolerances or {},
+        'test_cases': {},
+    }
+    for test_case_name in exps_to_check:
+        base_run, later_run = [runs.get((test_case_name, commit), TripTestRun(test_case_name, commit, None, None, False, False))
+                               for commit in commits]
+        report['test_cases'][test_case_name] = compare_test_case(test_case_name, base_run, later_run, diag_use, tolerances)
+    report['passed'] = all(r['result'] == 'pass' for r in report['test_cases'].values())
+    return report
+
+def conduct_comparison_on_test_case(base_commit, later_commit, test_case_name, repo_to_use=DEFAULT_REPO, num_cores_to_use=4, tolerances=None):
+    """Process here is to compile each commit, use the appropriate nml for the test case under consideration,
+    and run the code with the two commits at the same time. The output is then compared for all variables
+    in the diag file. If any output variable differs by more than its tolerance then the test classed as a failure."""
+
+    report = run_trip_tests(base_commit, later_commit, [test_case_name], repo_to_use=repo_to_use, num_cores_to_use=num_cores_to_use,
+                            total_cores=2*num_cores_to_use, tolerances=tolerances)
+    print_report(report, summary=False)
+    return report['test_cases'][test_case_name]['result']
+
+def print_report(report, summary=True):
+    """Prints the variables that failed and the run times of each test case, then optionally the summary."""
+    base_commit_short, later_commit_short = process_ids(report['base_hash'], report['later_hash'])
+    for test_case_name, result in report['test_cases'].items():
+        if result['result'] == 'crashed':
+            print('Test failed for '+test_case_name+' because the run crashed.')
             continue
-
-        data_dir_dict[s] = exp.datadir
-    if run_complete:
-        #For each of the diag files defined, compare the output
-        for diag_file_entry in diag_use.files.keys():
-            base_commit_dataset  = xar.open_dataset(data_dir_dict[base_commit] +'/run0001/'+diag_file_entry+'.nc', decode_times=False)
-            later_commit_dataset = xar.open_dataset(data_dir_dict[later_commit]+'/run0001/'+diag_file_entry+'.nc', decode_times=False)
-
-            diff = later_commit_dataset - base_commit_dataset
-
-            #Check each of the output variables for differences
-            for var in diff.data_vars.keys():
-                maxval = np.abs(diff[var]).max()
-                if maxval !=0.:
-                    print('Test failed for '+var+' max diff value = '+str(maxval.values))
-                    test_pass = False
-
-        if test_pass:
-            print('Test passed for '+test_case_name+'. Commit '+later_commit+' gives the same answer as commit '+base_commit)
-            return_test_result = 'pass'
+        for diag_file_entry, variables in result['files'].items():
+            for var, d in variables.items():
+                if not d['passed']:
+                    if d['note']:
+                        print('Test failed for '+var+' in '+diag_file_entry+': '+d['note'])
+                    else:
+                        print('Test failed for %s in %s max diff value = %g, rms diff = %g, tolerance = %g'
+                              % (var, diag_file_entry, d['max_diff'], d['rms_diff'], d['tolerance']))
+        seconds = result['seconds']
+        print('%s ran in %.0f s with %s and %.0f s with %s (%+.1f%%)%s' % (
+            test_case_name, seconds['base'], base_commit_short, seconds['later'], later_commit_short,
+            100. * result['timing_delta'] / seconds['base'] if seconds['base'] else 0.,
+            ' (cached)' if any(result['cached'].values()) else ''))
+        if result['result'] == 'pass':
+            print('Test passed for '+test_case_name+'. Commit '+report['later_commit']+' gives the same answer as commit '+report['base_commit'])
         else:
-            print('Test failed for '+test_case_name+'. Commit '+later_commit+' gives a different answer to commit '+base_commit)
-            return_test_result = 'fail'
-
-    else:
-        print('Test failed for '+test_case_name+' because the run crashed.')
-        return_test_result = 'fail'
+            print('Test failed for '+test_case_name+'. Commit '+report['later_commit']+' gives a different answer to commit '+report['base_commit'])
 
+    if summary:
+        output_results_function(dict((name, r['result']) for name, r in report['test_cases'].items()),
+                                report['base_hash'], report['later_hash'])
 
-    return return_test_result
-
+def write_report(report, filename):
+    """Writes the report of `run_trip_tests` to a json file."""
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
 
 def output_results_function(exp_outcome_dict, base_commit, later_commit):
 
@@ -237,12 +428,13 @@ def output_results_function(exp_outcome_dict, base_commit, later_commit):
     else:
         print('Nightmare, some tests have failed')
 
-def run_all_tests(base_commit, later_commit, exps_to_check, repo_to_use='git@github.com:execlim/Isca', num_cores_to_use=4):
-
-    exp_outcome_dict = {}
-
-    #Run the test on each test case in turn
-    for exp_name in exps_to_check:
-        exp_outcome_dict[exp_name] = conduct_comparison_on_test_case(base_commit, later_commit, exp_name, repo_to_use = repo_to_use, num_cores_to_use=num_cores_to_use)
+def run_all_tests(base_commit, later_commit, exps_to_check, repo_to_use=DEFAULT_REPO, num_cores_to_use=4, total_cores=None, tolerances=None, report_file=None):
+    """Runs and compares all of `exps_to_check` with `run_trip_tests`, prints the results and
+    optionally writes the report to `report_file`. Returns the report."""
 
-    output_results_function(exp_outcome_dict, base_commit, later_commit)
+    report = run_trip_tests(base_commit, later_commit, exps_to_check, repo_to_use=repo_to_use, num_cores_to_use=num_cores_to_use,
+                            total_cores=total_cores, tolerances=tolerances)
+    print_report(report)
+    if report_file:
+        write_report(report, report_file)
+    return report
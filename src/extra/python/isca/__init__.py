@@ -82,5 +82,5 @@ class EventEmitter(object):
         return handled
 
 
-from isca.experiment import Experiment, DiagTable, Namelist, FailedRunError
+from isca.experiment import Experiment, DiagTable, Namelist, FailedRunError, OutputBudgetError
 from isca.codebase import IscaCodeBase, SocratesCodeBase, DryCodeBase, GreyCodeBase #, ShallowCodeBase
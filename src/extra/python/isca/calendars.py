@@ -0,0 +1,172 @@
+"""Decode numeric time axes into dates without creating datetime objects.
+
+Dates are computed from the time values with integer arithmetic on whole
+arrays, so decoding a long 6-hourly time axis does not loop over millions
+of cftime objects:
+
+    >>> from isca.calendars import decode_times
+    >>> dates = decode_times([0.5, 30.25, 360.], 'days since 0001-01-01 00:00:00', '360_day')
+    >>> dates.month
+    array([1, 2, 1])
+
+Supported calendars are the ones Isca runs with: 360_day (thirty_day),
+noleap (365_day), all_leap (366_day), julian and proleptic_gregorian.
+The standard/gregorian calendar is supported for dates after the
+Gregorian reform of 1582-10-15, where it is the same as
+proleptic_gregorian.
+"""
+from collections import namedtuple
+import re
+
+import numpy as np
+
+DateFields = namedtuple('DateFields', 'year month day hour minute second dayofyear')
+
+# times are rounded to the nearest millisecond, well above the floating
+# point error of day numbers spanning thousands of years.
+MS_PER_SECOND = 1000
+MS_PER_DAY = 86400 * MS_PER_SECOND
+
+UNIT_SECONDS = {
+    'seconds': 1, 'second': 1, 'secs': 1, 'sec': 1, 's': 1,
+    'minutes': 60, 'minute': 60, 'mins': 60, 'min': 60,
+    'hours': 3600, 'hour': 3600, 'hrs': 3600, 'hr': 3600, 'h': 3600,
+    'days': 86400, 'day': 86400, 'd': 86400,
+}
+
+_UNITS_RE = re.compile(r'^\s*(\w+)\s+since\s+(-?\d+)-(\d+)-(\d+)'
+                       r'(?:[ T]+(\d+):(\d+)(?::(\d+(?:\.\d*)?))?)?\s*(?:[zZ]|UTC|utc)?\s*$')
+
+_CUMULATIVE_DAYS = np.array([0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334, 365])
+_CUMULATIVE_DAYS_LEAP = np.array([0, 31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335, 366])
+
+
+def parse_units(units):
+    """Return (seconds per unit, (year, month, day, hour, minute, second))
+    for a CF time units string such as 'days since 0001-01-01 00:00:00'."""
+    match = _UNITS_RE.match(units)
+    if match is None:
+        raise ValueError('Unable to parse time units %r' % units)
+    unit, year, month, day, hour, minute, second = match.groups()
+    try:
+        seconds_per_unit = UNIT_SECONDS[unit.lower()]
+    except KeyError:
+        raise ValueError('Unknown time unit %r in %r' % (unit, units))
+    reference = (int(year), int(month), int(day), int(hour or 0), int(minute or 0), float(second or 0.))
+    return seconds_per_unit, reference
+
+
+def _fixed_year_calendar(year_length, cumulative_days):
+    def to_ordinal(year, month, day):
+        return year * year_length + cumulative_days[month - 1] + day - 1
+
+    def from_ordinal(ordinal):
+        year, day0 = np.divmod(ordinal, year_length)
+        month = np.searchsorted(cumulative_days, day0, side='right')
+        return year, month, day0 - cumulative_days[month - 1] + 1, day0 + 1
+    return to_ordinal, from_ordinal
+
+
+def _360_to_ordinal(year, month, day):
+    return year * 360 + (month - 1) * 30 + day - 1
+
+
+def _360_from_ordinal(ordinal):
+    year, day0 = np.divmod(ordinal, 360)
+    return year, day0 // 30 + 1, day0 % 30 + 1, day0 + 1
+
+
+def _julian_to_ordinal(year, month, day):
+    leap = np.mod(year, 4) == 0
+    cumulative = np.where(leap, _CUMULATIVE_DAYS_LEAP[month - 1], _CUMULATIVE_DAYS[month - 1])
+    return 365 * year + (year + 3) // 4 + cumulative + day - 1
+
+
+def _julian_from_ordinal(ordinal):
+    # every 4 year cycle starts with a leap year of 366 days.
+    cycle, day_in_cycle = np.divmod(ordinal, 1461)
+    leap = day_in_cycle < 366
+    year_in_cycle = np.where(leap, 0, 1 + (day_in_cycle - 366) // 365)
+    day0 = np.where(leap, day_in_cycle, (day_in_cycle - 366) % 365)
+    return _split_year(4 * cycle + year_in_cycle, day0, leap)
+
+
+def _gregorian_to_ordinal(year, month, day):
+    # days since 0000-03-01, after H. Hinnant's days_from_civil.
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era
+
+
+def _gregorian_from_ordinal(ordinal):
+    era = ordinal // 146097
+    day_of_era = ordinal - era * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524 - day_of_era // 146096) // 365
+    day_from_march = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    month_from_march = (5 * day_from_march + 2) // 153
+    day = day_from_march - (153 * month_from_march + 2) // 5 + 1
+    month = month_from_march + np.where(month_from_march < 10, 3, -9)
+    year = year_of_era + era * 400 + (month <= 2)
+    return year, month, day, ordinal - _gregorian_to_ordinal(year, np.ones_like(month), np.ones_like(day)) + 1
+
+
+def _split_year(year, day0, leap):
+    cumulative = np.where(leap[..., np.newaxis], _CUMULATIVE_DAYS_LEAP, _CUMULATIVE_DAYS)
+    month = (cumulative <= day0[..., np.newaxis]).sum(axis=-1)
+    day = day0 - np.take_along_axis(cumulative, (month - 1)[..., np.newaxis], axis=-1)[..., 0] + 1
+    return year, month, day, day0 + 1
+
+
+_noleap = _fixed_year_calendar(365, _CUMULATIVE_DAYS)
+_all_leap = _fixed_year_calendar(366, _CUMULATIVE_DAYS_LEAP)
+
+CALENDARS = {
+    '360_day': (_360_to_ordinal, _360_from_ordinal),
+    'thirty_day': (_360_to_ordinal, _360_from_ordinal),
+    'noleap': _noleap,
+    'no_leap': _noleap,
+    '365_day': _noleap,
+    'all_leap': _all_leap,
+    '366_day': _all_leap,
+    'julian': (_julian_to_ordinal, _julian_from_ordinal),
+    'proleptic_gregorian': (_gregorian_to_ordinal, _gregorian_from_ordinal),
+    'standard': (_gregorian_to_ordinal, _gregorian_from_ordinal),
+    'gregorian': (_gregorian_to_ordinal, _gregorian_from_ordinal),
+}
+
+# the first day of the Gregorian calendar, 1582-10-15
+_GREGORIAN_REFORM = _gregorian_to_ordinal(1582, 10, 15)
+
+
+def decode_times(times, units='days since 0001-01-01 00:00:00', calendar='360_day'):
+    """Return the `DateFields` (year, month, day, hour, minute, second,
+    dayofyear) of numeric `times` in `units` and `calendar`, each as an
+    integer array with the same shape as `times`.
+
+    Times are rounded to the nearest millisecond.
+    Raises ValueError for calendars or units that can't be decoded
+    arithmetically."""
+    calendar = calendar.lower()
+    try:
+        to_ordinal, from_ordinal = CALENDARS[calendar]
+    except KeyError:
+        raise ValueError('Unsupported calendar %r. Choose from %r' % (calendar, sorted(CALENDARS)))
+    seconds_per_unit, (year, month, day, hour, minute, second) = parse_units(units)
+
+    times = np.asarray(times, dtype=np.float64)
+    offset_ms = int(round(((hour * 60 + minute) * 60 + second) * MS_PER_SECOND))
+    total_ms = np.round(times * (seconds_per_unit * MS_PER_SECOND)).astype(np.int64) + offset_ms
+    days, ms_of_day = np.divmod(total_ms, MS_PER_DAY)
+    ordinal = to_ordinal(year, month, day) + days
+
+    if calendar in ('standard', 'gregorian') and ordinal.size and ordinal.min() < _GREGORIAN_REFORM:
+        raise ValueError('Dates before 1582-10-15 in the %s calendar are not supported' % calendar)
+
+    years, months, days_of_month, dayofyear = from_ordinal(ordinal)
+    seconds_of_day = ms_of_day // MS_PER_SECOND
+    return DateFields(year=np.asarray(years), month=np.asarray(months), day=np.asarray(days_of_month),
+                      hour=seconds_of_day // 3600, minute=(seconds_of_day // 60) % 60,
+                      second=seconds_of_day % 60, dayofyear=np.asarray(dayofyear))
@@ -1,6 +1,10 @@
 from contextlib import contextmanager
+import fcntl
 import os
+import re
+import shutil
 import socket
+import tempfile
 
 from jinja2 import Environment, FileSystemLoader
 import sh
@@ -10,6 +14,99 @@ from .loghandler import Logger
 from .helpers import url_to_folder, destructive, useworkdir, mkdir, cd, git, P, git_run_in_directory
 
 
+def _git_dir(directory):
+    # the git directory of a checkout: its .git directory, or for a
+    # worktree the directory named in its .git file.
+    git_path = P(directory, '.git')
+    if os.path.isfile(git_path):
+        with open(git_path) as f:
+            line = f.read().strip()
+        if line.startswith('gitdir:'):
+            return P(directory, line[len('gitdir:'):].strip())
+    return git_path
+
+
+class RepoMirror(Logger):
+    """A bare mirror of the git repository `repo`, kept in `storedir`, which
+    all the CodeBases of that repository share.
+
+    Each commit is checked out as a `git worktree` of the mirror, so a
+    checkout shares its objects with the mirror rather than being a full
+    clone.  The remote is only fetched from when a commit isn't already in
+    the mirror, or to update a branch name, so a mirror of a local path or
+    of commits already fetched works offline."""
+    def __init__(self, repo, storedir=P(GFDL_WORK, 'codebase')):
+        if os.path.isdir(repo):
+            repo = os.path.abspath(repo)
+        self.repo = repo
+        self.path = P(storedir, 'mirrors', url_to_folder(repo) + '.git')
+        self.git = git.bake('--git-dir=' + self.path)
+
+    @contextmanager
+    def lock(self):
+        """Hold an exclusive lock on the mirror, so that processes sharing
+        it don't update it at the same time."""
+        mkdir(os.path.dirname(self.path))
+        with open(self.path + '.lock', 'w') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def resolve(self, commit):
+        """Return the full hash of `commit`, a hash, tag or branch name, or
+        None if it isn't in the mirror."""
+        if not os.path.isdir(self.path):
+            return None
+        try:
+            return self.git('rev-parse', '--verify', '--quiet', commit + '^{commit}').stdout.decode('utf8').strip()
+        except sh.ErrorReturnCode:
+            return None
+
+    def fetch(self):
+        """Create the mirror, or fetch any new objects and refs into it."""
+        if not os.path.isdir(self.path):
+            self.log.info('Creating a mirror of %r at %r' % (self.repo, self.path))
+            git.clone('--mirror', self.repo, self.path)
+        else:
+            self.log.info('Fetching %r into %r' % (self.repo, self.path))
+            self.git.fetch('--prune', 'origin')
+
+    def commit_id(self, commit):
+        """Return the full hash of `commit`, fetching from the remote only if
+        it isn't a commit hash or tag already in the mirror.  If the fetch
+        fails, e.g. offline, a branch already in the mirror is used as it is."""
+        with self.lock():
+            sha = self.resolve(commit)
+            is_hash = re.match(r'^[0-9a-f]{4,40}$', commit) and sha is not None and sha.startswith(commit)
+            is_tag = sha is not None and self.resolve('refs/tags/' + commit) is not None
+            if is_hash or is_tag:
+                return sha
+            try:
+                self.fetch()
+            except sh.ErrorReturnCode as e:
+                if sha is None:
+                    self.log.error('Unable to fetch %r from %r' % (commit, self.repo))
+                    raise e
+                self.log.warning('Unable to fetch from %r, using %r as it is in the mirror' % (self.repo, commit))
+                return sha
+            sha = self.resolve(commit)
+            if sha is None:
+                raise ValueError('Commit %r not found in repository %r' % (commit, self.repo))
+            return sha
+
+    def add_worktree(self, directory, commit):
+        """Check out `commit` into `directory` as a worktree of the mirror.
+        Returns the full hash of the commit."""
+        sha = self.commit_id(commit)
+        with self.lock():
+            # forget the worktrees of any checkouts that have been deleted
+            self.git.worktree('prune')
+            self.git.worktree('add', '--detach', directory, sha)
+        return sha
+
+
 class CodeBase(Logger):
     """The CodeBase.
 
@@ -45,6 +142,9 @@ class CodeBase(Logger):
 
             cb = gfdl.CodeBase(repo='git@github.com:execlim/GFDLmoistModel', commit='mytag0.2')
 
+        The CodeBases of a repository share one bare mirror of it in `storedir`,
+        see `RepoMirror`, and each commit is a lightweight worktree of the mirror.
+
         Each directory or repo-commit can be compiled separately, allowing for multiple
         executables and prevent overwriting of known good states.
         The typical use of a CodeBase is to easily compile a model on a specfic
@@ -80,6 +180,7 @@ class CodeBase(Logger):
         self.builddir = P(self.workdir, 'build', self.executable_name.split('.')[0])
         self.templatedir = P(_module_directory, 'templates')  # templates are stored with the python isca module
         self.executable_fullpath = P(self.builddir, self.executable_name)
+        self.source_control_status_file = P(self.builddir, 'git_hash_used.txt')
 
         # alias a version of git acting from within the code directory
         self.git = git_run_in_directory(GFDL_BASE, self.codedir)
@@ -128,35 +229,85 @@ class CodeBase(Logger):
         # self.commit_id = commit_id
 
     def write_source_control_status(self, outfile):
-        """Write the current state of the source code to a file."""
+        """Write the state of the source code the executable was compiled
+        from to a file.
+
+        The git provenance is found once per compile and kept next to the
+        executable, then copied to `outfile`, so runs don't call git.  If
+        it can't be kept there, e.g. the build directory is shared or
+        read-only, it is written straight to `outfile`."""
+        try:
+            status_file = self.update_source_control_status()
+        except OSError as e:
+            self.log.warning('Unable to store the source control status in %s: %s' % (self.builddir, e))
+            with open(outfile, 'w') as file:
+                self._write_source_control_status(file)
+            return
+        shutil.copyfile(status_file, outfile)
+
+    def _source_control_stamp(self):
+        # the latest change to the executable or to either of the checkouts
+        # recorded in the file: recompiling, committing, staging or checking
+        # out another commit.
+        paths = [self.executable_fullpath]
+        for directory in (self.codedir, GFDL_BASE):
+            git_dir = _git_dir(directory)
+            paths.extend(P(git_dir, f) for f in ('HEAD', 'index', P('logs', 'HEAD')))
+        return max([os.stat(p).st_mtime for p in paths if os.path.exists(p)] or [0.])
+
+    def update_source_control_status(self, refresh=False):
+        """Find the state of the source code with git and store it in
+        `source_control_status_file`, unless it is already newer than the
+        executable and the git checkout, or `refresh` is True.
+        Returns the path of the file."""
+        status_file = self.source_control_status_file
+        if not refresh and os.path.exists(status_file) and \
+                os.stat(status_file).st_mtime >= self._source_control_stamp():
+            return status_file
 
+        mkdir(self.builddir)
+        # write to a temporary file and rename, so that experiments running
+        # at the same time never copy a partially written file.
+        fd, tmp_file = tempfile.mkstemp(dir=self.builddir, suffix='.txt')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                self._write_source_control_status(file)
+            os.chmod(tmp_file, 0o644)
+            os.replace(tmp_file, status_file)
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+        self.log.debug('Source control status written to %s' % status_file)
+        return status_file
+
+    def _write_source_control_status(self, file):
         gfdl_git = git_run_in_directory(GFDL_BASE, GFDL_BASE)
 
-        with open(outfile, 'w') as file:
-            # write out the git commit id of the compiled source code
-            file.write("*---commit hash used for fortran code in workdir---*:\n")
-            file.write(self.git_commit)
-
-            # write out the git commit id of GFDL_BASE
-            file.write("\n\n*---commit hash used for code in GFDL_BASE, including this python module---*:\n")
-            file.write(gfdl_git.log('-1', '--format="%H"').stdout.decode('utf8'))
-
-            # if there are any uncommited changes in the working directory,
-            # add those to the file too
-            source_status = self.git.status("-b", "--porcelain").stdout.decode('utf8')
-            # filter the source status for changes in specific files
-            filetypes = ('.f90', '.inc', '.c')
-            source_status = [line for line in source_status.split('\n')
-                    if any([suffix in line.lower() for suffix in filetypes])]
-
-            # write the status and diff only when something is modified
-            if source_status:
-                file.write("\n#### Code compiled from dirty commit ####\n")
-                file.write("*---git status output (only f90 and inc files)---*:\n")
-                file.write('\n'.join(source_status))
-                file.write('\n\n*---git diff output---*\n')
-                source_diff = self.git.diff('--no-color').stdout.decode('utf8')
-                file.write(source_diff)
+        # write out the git commit id of the compiled source code
+        file.write("*---commit hash used for fortran code in workdir---*:\n")
+        file.write(self.git_commit)
+
+        # write out the git commit id of GFDL_BASE
+        file.write("\n\n*---commit hash used for code in GFDL_BASE, including this python module---*:\n")
+        file.write(gfdl_git.log('-1', '--format="%H"').stdout.decode('utf8'))
+
+        # if there are any uncommited changes in the working directory,
+        # add those to the file too
+        source_status = self.git.status("-b", "--porcelain").stdout.decode('utf8')
+        # filter the source status for changes in specific files
+        filetypes = ('.f90', '.inc', '.c')
+        source_status = [line for line in source_status.split('\n')
+                if any([suffix in line.lower() for suffix in filetypes])]
+
+        # write the status and diff only when something is modified
+        if source_status:
+            file.write("\n#### Code compiled from dirty commit ####\n")
+            file.write("*---git status output (only f90 and inc files)---*:\n")
+            file.write('\n'.join(source_status))
+            file.write('\n\n*---git diff output---*\n')
+            source_diff = self.git.diff('--no-color').stdout.decode('utf8')
+            file.write(source_diff)
 
     def read_path_names(self, path_names_file):
         with open(path_names_file) as pn:
@@ -188,17 +339,17 @@ class CodeBase(Logger):
             self.log.warn('Cannot checkout a directory.  Use a CodeBase(repo="...") object instead.')
             return None
 
-        try:
-            self.git.status()
-        except Exception as e:
-            self.log.info('Repository not found at %r. Cloning.' % self.codedir)
-            # self.log.debug(e.message)
+        if not os.path.exists(P(self.codedir, '.git')):
+            self.log.info('Repository not found at %r. Adding a worktree of the mirror.' % self.codedir)
             try:
-                git.clone(self.repo, self.codedir)
+                sha = RepoMirror(self.repo, self.storedir).add_worktree(self.codedir, self.commit)
             except Exception as e:
-                self.log.error('Unable to clone repository %r' % self.repo)
+                self.log.error('Unable to check out %r from repository %r' % (self.commit, self.repo))
                 raise e
+            self.log.info('Checked out commit %s' % sha)
+            return
 
+        # an existing checkout, which may be a full clone made before mirrors were used
         if self.commit is not None:
             try:
                 self.log.info('Checking out commit %r' % self.commit)
@@ -257,6 +408,7 @@ class CodeBase(Logger):
             self._log_line(line)
 
         self.log.info('Compilation complete.')
+        self.update_source_control_status(refresh=True)
 
 
 
@@ -1,15 +1,11 @@
+from collections import namedtuple
 import copy
+import re
 from jinja2 import Template
 
 _TEMPLATE = Template("""
-{%- macro fortrantrue(t) -%}
-{%- if t -%}
-.true.
-{%- else -%}
-.false.
-{%- endif -%}
-{%- endmacro -%}
-"FMS Model results"
+{#- a diag_table in the FMS format -#}
+"{{ title }}"
 {% if calendar -%}
 0001 1 1 0 0 0
 {%- else -%}
@@ -18,39 +14,203 @@ _TEMPLATE = Template("""
 # = output files =
 # file_name, output_freq, output_units, format, time_units, long_name
 {% for file in outputfiles %}
-"{{ file.name }}", {{ file.freq }}, "{{ file.units }}", 1, "{{ file.time_units }}", "time",
+{{ format_file(file) }}
 {% endfor %}
 # = diagnostic field entries =
 # module_name, field_name, output_name, file_name, time_sampling, time_avg, other_opts, precision
 
 {% for file in outputfiles %}
 {% for field in file.fields -%}
-"{{ field.module}}", "{{ field.name }}", "{{ field.name }}", "{{ file.name }}", "all", {{ fortrantrue(field.time_avg) }}, "none", 2,
+{{ format_field(field, file.name) }}
 {% endfor %}
 {% endfor %}
 """)
 
+VolumeEstimate = namedtuple('VolumeEstimate', 'total files')
+
+# the length of months and years depends on the calendar, see `output_frequency_hours`
+HOURS_PER_UNIT = {'seconds': 1/3600., 'minutes': 1/60., 'hours': 1., 'days': 24.}
+
+# the packing values of the precision column of a diag_table, by name, and
+# the bytes each value takes in the output.  Values packed into 16 or 8
+# bits are stored with a scale_factor and add_offset.
+PACKING = {'double': 1, 'float': 2, 'int16': 4, 'int8': 8}
+BYTES_PER_VALUE = {1: 8, 2: 4, 4: 2, 8: 1}
+
+# the shape of each diagnostic, by (module, field name):
+#   'scalar': a single value or a column of a few values, e.g. pk.
+#   '2d':     one lat-lon level.
+#   '3d':     every full model level.
+#   'phalf':  every half level, one more than the full levels.
+# fields not registered here are counted as '3d', so estimates err on the large side.
+FIELD_SHAPES = {}
+
+# the shape of fields of a module that aren't registered individually
+MODULE_SHAPES = {'mixed_layer': '2d', 'surface_flux': '2d'}
+
+
+def register_field_shape(module, names, shape):
+    """Register the shape, one of 'scalar', '2d', '3d' or 'phalf', of the
+    diagnostic fields `names` of `module`, for `DiagTable.estimate_volume`."""
+    if shape not in ('scalar', '2d', '3d', 'phalf'):
+        raise ValueError('Unknown field shape %r' % shape)
+    if isinstance(names, str):
+        names = [names]
+    for name in names:
+        FIELD_SHAPES[(module, name)] = shape
+
+
+register_field_shape('dynamics', ['pk', 'bk', 'vort_norm', 'EKE'], 'scalar')
+register_field_shape('dynamics', ['ps', 'slp', 'zsurf'], '2d')
+register_field_shape('dynamics', ['pres_half', 'height_half'], 'phalf')
+register_field_shape('atmosphere', ['condensation_rain', 'convection_rain', 'precipitation', 'cape', 'cin',
+                                    'flux_u', 'flux_v', 'bucket_depth', 'bucket_depth_conv', 'bucket_depth_cond',
+                                    'bucket_depth_lh', 'temp_2m', 'u_10m', 'v_10m', 'sphum_2m', 'rh_2m'], '2d')
+register_field_shape('two_stream', ['olr', 'swdn_sfc', 'swdn_toa', 'lwup_sfc', 'lwdn_sfc', 'net_lw_surf',
+                                    'coszen', 'fracsun'], '2d')
+register_field_shape('two_stream', ['flux_rad', 'flux_lw', 'flux_sw'], 'phalf')
+register_field_shape('two_stream', 'co2', 'scalar')
+
+
+def parse_region(other_opts):
+    """Return the region (lon_min, lon_max, lat_min, lat_max, z_min, z_max)
+    given in the other_opts column of a field, or None if it has none."""
+    try:
+        bounds = tuple(float(x) for x in str(other_opts).split())
+    except ValueError:
+        return None
+    return bounds if len(bounds) == 6 else None
+
+
+def format_region(region):
+    """Return the other_opts string of a region given as (lon_min, lon_max,
+    lat_min, lat_max) in degrees, optionally followed by (z_min, z_max);
+    -1 -1 for z selects every level."""
+    region = tuple(region)
+    if len(region) == 4:
+        region += (-1, -1)
+    if len(region) != 6:
+        raise ValueError('A region needs 4 or 6 bounds, got %r' % (region,))
+    lon_min, lon_max, lat_min, lat_max = region[:4]
+    if not (lon_min <= lon_max and -90 <= lat_min <= lat_max <= 90):
+        raise ValueError('Invalid region %r' % (region,))
+    return ' '.join('%g' % x for x in region)
+
+
+def field_points(module, name, lat_max, lon_max, num_levels, region=None):
+    """Return the number of values in one output of a diagnostic field,
+    within `region`, as returned by `parse_region`, if given.  Vertical
+    bounds of a region are ignored, so every level is counted."""
+    shape = FIELD_SHAPES.get((module, name), MODULE_SHAPES.get(module, '3d'))
+    if region is not None and shape != 'scalar':
+        lon_fraction = min((region[1] - region[0]) / 360., 1.)
+        lat_fraction = min((region[3] - region[2]) / 180., 1.)
+        lon_max = max(int(round(lon_max * lon_fraction)), 1)
+        lat_max = max(int(round(lat_max * lat_fraction)), 1)
+    return {'scalar': 1,
+            '2d': lat_max * lon_max,
+            '3d': lat_max * lon_max * num_levels,
+            'phalf': lat_max * lon_max * (num_levels + 1)}[shape]
+
+
+def output_frequency_hours(diag_file, year_length=360):
+    """Return the output interval, in hours, of a file in a DiagTable: 0 for
+    output every timestep and infinity for output only at the end of a run.
+    A year is `year_length` days, and a month a twelfth of that."""
+    if diag_file['freq'] < 0:
+        return float('inf')
+    units = diag_file['units'].lower().rstrip('s') + 's'
+    if units == 'years':
+        hours = year_length * 24.
+    elif units == 'months':
+        hours = year_length * 24. / 12.
+    else:
+        hours = HOURS_PER_UNIT.get(units, 1.)
+    return diag_file['freq'] * hours
+
+
+def _grid_size(resolution):
+    if isinstance(resolution, tuple):
+        return resolution
+    from isca.grid import grid_shape
+    return grid_shape(resolution)
+
+
 def numorstr(x):
     """Try to parse a string into an int or float."""
     x = x.strip()
-    if x.startswith('"'):
-        return x.strip('"')
+    if x[:1] in ('"', "'"):
+        return x[1:-1]
+    try:
+        return int(x)
+    except ValueError: pass
     try:
-        ix = int(x)
-        fx = float(x)
-        return ix if ix == fx else fx
-    except: pass
+        return float(x)
+    except ValueError: pass
     if x.lower() == '.true.': return True
     if x.lower() == '.false.': return False
     return x
 
+
+# a quoted string, an unquoted value, or the start of a comment
+_TOKEN = re.compile(r'"[^"]*"|\'[^\']*\'|#|[^\s,"\'#][^,"\'#]*')
+
+
+def tokenize(line):
+    """Return the values of a line of a diag_table, split at commas that
+    aren't inside quotes, up to any comment."""
+    values = []
+    for match in _TOKEN.finditer(line):
+        token = match.group(0)
+        if token == '#':
+            break
+        values.append(numorstr(token))
+    return values
+
+
+def _format_value(x):
+    if isinstance(x, bool):
+        return '.true.' if x else '.false.'
+    if isinstance(x, str):
+        return '"%s"' % x
+    return str(x)
+
+
+def format_file(f):
+    """Return the diag_table line of the output file `f`."""
+    values = [f['name'], f['freq'], f['units'], f['format'], f['time_units'], f['time_name']] + list(f['extra'])
+    return ', '.join(_format_value(v) for v in values) + ','
+
+
+def format_field(field, file_name):
+    """Return the diag_table line of `field` in the output file `file_name`."""
+    values = [field['module'], field['name'], field['output_name'], file_name, field['time_sampling'],
+              field['time_avg'], field['other_opts'], field['precision']]
+    return ', '.join(_format_value(v) for v in values) + ','
+
+
+def _values(entry):
+    return {k: v for k, v in entry.items() if k != 'fields'}
+
+
+def _has_base_date(values):
+    return any(float(x) for x in str(values[0]).split())
+
+
+def _ending(line):
+    return line[len(line.rstrip('\r\n')):]
+
 class DiagTable(object):
     def __init__(self):
         super(DiagTable, self).__init__()
         self.files = {}
         self.calendar = None
+        self.title = 'FMS Model results'
+        # for a table read from a file, its lines in order, so it can be
+        # written back unchanged.  See `from_file`.
+        self._layout = None
 
-    def add_file(self, name, freq, units="hours", time_units=None):
+    def add_file(self, name, freq, units="hours", time_units=None, file_format=1, time_name='time', extra=()):
         if time_units is None:
             time_units = units
         self.files[name] = {
@@ -58,23 +218,49 @@ class DiagTable(object):
             'freq': freq,
             'units': units,
             'time_units': time_units,
+            'format': file_format,
+            'time_name': time_name,
+            'extra': list(extra),
             'fields': []
         }
 
-    def add_field(self, module, name, time_avg=False, files=None):
+    def add_field(self, module, name, time_avg=False, files=None, output_name=None, precision=2, region=None):
+        """Add the diagnostic `name` of `module` to the output `files`, by
+        default all of them.
+
+            time_avg:    True to average over each output interval, or a
+                         reduction method, e.g. 'min' or 'max'.
+            output_name: the name of the variable in the output file, by
+                         default `name`.  Use an alias to write the same
+                         field twice to a file, e.g. once for a region.
+            precision:   the packing, 1 for 64-bit, 2 for 32-bit, 4 for
+                         16-bit or 8 for 8-bit, or a name in `PACKING`.
+            region:      write only (lon_min, lon_max, lat_min, lat_max) in
+                         degrees, optionally followed by (z_min, z_max).
+        """
         if files is None:
             files = self.files.keys()
+        precision = PACKING.get(precision, precision)
+        if precision not in BYTES_PER_VALUE:
+            raise ValueError('precision must be one of 1, 2, 4, 8 or %s, got %r' % (', '.join(PACKING), precision))
+        other_opts = format_region(region) if region is not None else 'none'
 
         for fname in files:
             self.files[fname]['fields'].append({
                 'module': module,
                 'name': name,
-                'time_avg': time_avg
+                'output_name': output_name or name,
+                'time_sampling': 'all',
+                'time_avg': time_avg if isinstance(time_avg, str) else bool(time_avg),
+                'other_opts': other_opts,
+                'precision': precision,
                 })
 
     def copy(self):
         d = DiagTable()
-        d.files = copy.deepcopy(self.files)
+        d.files, d._layout = copy.deepcopy((self.files, self._layout))
+        d.calendar = self.calendar
+        d.title = self.title
         return d
 
     def has_calendar(self):
@@ -84,39 +270,129 @@ class DiagTable(object):
             return True
 
     def write(self, filename):
-        vars = {'calendar': self.has_calendar(), 'outputfiles': self.files.values()}
+        if self._layout is not None:
+            with open(filename, 'w', newline='') as f:
+                f.writelines(self._layout_lines())
+            return
+        vars = {'calendar': self.has_calendar(), 'outputfiles': self.files.values(), 'title': self.title,
+                'format_file': format_file, 'format_field': format_field}
         _TEMPLATE.stream(**vars).dump(filename)
 
+    def _layout_lines(self):
+        # the lines of the file that was read, with any entries that have
+        # changed rewritten and any that have been removed left out.  New
+        # files and fields go after the last file and field entry.
+        kinds = [entry[0] for entry in self._layout]
+        last_file = max([i for i, k in enumerate(kinds) if k in ('file', 'date')] or [-1])
+        last_field = max([i for i, k in enumerate(kinds) if k == 'field'] or [len(kinds) - 1])
+        newline = (_ending(self._layout[0][1]) if self._layout else '') or '\n'
+        written = set()
+        lines = []
+
+        def add(line):
+            if lines and not lines[-1].endswith('\n'):
+                lines[-1] += newline
+            lines.append(line)
+
+        def add_new_entries(kind):
+            for f in self.files.values():
+                if kind == 'file' and id(f) not in written:
+                    add(format_file(f) + newline)
+                    written.add(id(f))
+                elif kind == 'field':
+                    for field in f['fields']:
+                        if id(field) not in written:
+                            add(format_field(field, f['name']) + newline)
+                            written.add(id(field))
+
+        for i, entry in enumerate(self._layout):
+            kind, line = entry[0], entry[1]
+            if kind == 'text':
+                add(line)
+            elif kind == 'title':
+                add(line if str(tokenize(line)[0]) == self.title else '"%s"%s' % (self.title, _ending(line)))
+            elif kind == 'date':
+                add(line if _has_base_date(tokenize(line)) == self.has_calendar() else
+                    ('0001 1 1 0 0 0' if self.has_calendar() else '0 0 0 0 0 0') + _ending(line))
+            elif kind == 'file':
+                f, parsed = entry[2], entry[3]
+                if self.files.get(f['name']) is f:
+                    add(line if _values(f) == parsed else format_file(f) + _ending(line))
+                    written.add(id(f))
+            elif kind == 'field':
+                f, field, parsed = entry[2], entry[3], entry[4]
+                if self.files.get(f['name']) is f and any(x is field for x in f['fields']):
+                    add(line if field == parsed else format_field(field, f['name']) + _ending(line))
+                    written.add(id(field))
+            if i == last_file:
+                add_new_entries('file')
+            if i == last_field:
+                add_new_entries('field')
+        return lines
+
+    def estimate_volume(self, resolution, num_levels, run_length, dt_atmos=None, year_length=360):
+        """Return a `VolumeEstimate` of the bytes of diagnostic output written
+        in a run of `run_length` days: (the total, a dict of the bytes of each file).
+
+        `resolution` is a truncation, e.g. 'T42', or a tuple (lat_max,
+        lon_max).  The shape of each field comes from `FIELD_SHAPES`, and
+        its size from its precision and region.  Files
+        written every timestep need the timestep `dt_atmos` in seconds;
+        without it they are counted as hourly.  Output intervals in months
+        or years are for a calendar of `year_length` days.  Compression and
+        the netCDF headers are ignored."""
+        lat_max, lon_max = _grid_size(resolution)
+        run_hours = run_length * 24.
+        files = {}
+        for name, f in self.files.items():
+            freq = output_frequency_hours(f, year_length) or (dt_atmos / 3600. if dt_atmos else 1.)
+            outputs = max(int(run_hours // freq), 1) if freq != float('inf') else 1
+            field_bytes = sum(field_points(field['module'], field['name'], lat_max, lon_max, num_levels,
+                                            parse_region(field['other_opts']))
+                               * BYTES_PER_VALUE.get(field['precision'], 4) for field in f['fields'])
+            files[name] = outputs * field_bytes
+        return VolumeEstimate(sum(files.values()), files)
+
     def is_valid(self):
         return len(self.files) > 0
 
     @classmethod
     def from_file(cls, filename):
-        lines = [l.strip() for l in open(filename)]
-        lines = [l.split(',') for l in lines if not l.startswith("#")]
+        """Read a diag_table in the FMS format.  Every column of each entry is
+        kept, and unless it is changed the table is written back by `write`
+        exactly as it was read, including comments and spacing."""
         dt = cls()
-        dt.calendar = False
-        #dt.files = [l[0] for l in lines if len(l)==7]
-        with open(filename, 'r') as file:
-            for line in file:
-                lx = line.strip()
-                if lx.startswith('#'):
-                    continue
-                if lx == '0001 1 1 0 0 0': 
+        dt.calendar = 'no_calendar'
+        dt._layout = layout = []
+        with open(filename, 'r', newline='') as file:
+            text = file.read()
+        for lineno, line in enumerate(text.splitlines(True), 1):
+            values = tokenize(line)
+            if not values:
+                layout.append(('text', line))
+            elif not any(entry[0] == 'title' for entry in layout):
+                dt.title = str(values[0])
+                layout.append(('title', line))
+            elif not any(entry[0] == 'date' for entry in layout):
+                if _has_base_date(values):
                     dt.calendar = 'undefined'
-                    continue
-                ls = lx.split(',')
-                vals = [numorstr(x) for x in ls]
-                if len(ls) == 7:
-                    dt.add_file(
-                        name=vals[0],
-                        freq=vals[1], 
-                        units=vals[2], 
-                        time_units=vals[4])
-                elif len(ls) == 9:
-                    dt.add_field(
-                        module=vals[0], 
-                        name=vals[1], 
-                        time_avg=vals[5], 
-                        files=[vals[3]])
-        return dt
\ No newline at end of file
+                layout.append(('date', line))
+            elif len(values) > 1 and isinstance(values[1], (int, float)) and not isinstance(values[1], bool):
+                if len(values) < 6:
+                    raise ValueError('%s line %d: a file entry needs at least 6 values' % (filename, lineno))
+                name = values[0]
+                dt.add_file(name=name, freq=values[1], units=values[2], time_units=values[4],
+                            file_format=values[3], time_name=values[5], extra=values[6:])
+                layout.append(('file', line, dt.files[name], copy.deepcopy(_values(dt.files[name]))))
+            else:
+                if len(values) < 8:
+                    raise ValueError('%s line %d: a field entry needs 8 values' % (filename, lineno))
+                if values[3] not in dt.files:
+                    raise ValueError('%s line %d: field %s is in file %s, which isn\'t defined'
+                                     % (filename, lineno, values[1], values[3]))
+                f = dt.files[values[3]]
+                field = dict(zip(('module', 'name', 'output_name'), values[:3]))
+                field.update(zip(('time_sampling', 'time_avg', 'other_opts', 'precision'), values[4:8]))
+                f['fields'].append(field)
+                layout.append(('field', line, f, field, dict(field)))
+        return dt
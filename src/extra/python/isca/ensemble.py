@@ -0,0 +1,156 @@
+"""Initial-condition ensembles from a single restart.
+
+Each member is a directory of restart files in which one or more fields
+have had random noise added, with a different random seed per member:
+
+    >>> from isca.ensemble import derive_ensemble
+    >>> members = derive_ensemble(exp, exp.get_restart_file(10), seeds=range(20),
+    ...                           perturbations={'vors_real': 1e-7, 't_surf': 0.1})
+    >>> for member_exp, restart in members:
+    ...     member_exp.run(1, restart_file=restart)
+
+The restart is extracted, or copied if it is a directory, once into
+outdir/shared.  Files without a perturbed variable are made read-only
+there and hardlinked into every member rather than copied, unless the
+members are on another filesystem, and the members are written in
+parallel, one process per member.  A hardlinked file is the same file in
+every member, so writing to it in one member changes them all: edit a
+member with `isca.restart`, which replaces a hardlinked file with a copy
+of its own before writing to it.  The model itself only reads its input
+restart files, which are copied into the run directory.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+import shutil
+import tarfile
+
+from netCDF4 import Dataset
+import numpy as np
+
+from isca.loghandler import log
+from isca.spectral import triangle_mask
+
+P = os.path.join
+
+MEMBER_FMT = 'member%03d'
+
+
+def perturbation_noise(shape, amplitude, seed):
+    """Return Gaussian noise with standard deviation `amplitude`."""
+    return amplitude * np.random.default_rng(seed).standard_normal(shape)
+
+
+def _is_spectral(name, shape):
+    return name.endswith(('_real', '_imag')) and len(shape) >= 2 and shape[-2] == shape[-1] + 1
+
+
+def perturb_variable(var, amplitude, seed):
+    """Add noise with standard deviation `amplitude` to the netCDF
+    variable `var`, opened for writing, in place.
+
+    The same noise is added at every time level, so the leapfrog time
+    levels of a restart stay consistent.  Spectral coefficients are only
+    perturbed inside the triangular truncation, and the imaginary parts at
+    m=0, which are zero for real fields, aren't perturbed."""
+    shape = var.shape[1:] if var.dimensions and var.dimensions[0].lower() == 'time' else var.shape
+    noise = perturbation_noise(shape, amplitude, seed)
+    if _is_spectral(var.name, var.shape):
+        num_n, num_m = var.shape[-2:]
+        noise = noise * triangle_mask(num_n, num_m, num_m - 1)
+        if var.name.endswith('_imag'):
+            noise[..., 0] = 0.
+    var[...] = var[...] + noise.astype(var.dtype)
+
+
+def find_variables(restart_dir, names):
+    """Return a dict of {filename: [variable names]} giving the netCDF file
+    in `restart_dir` that contains each of the variables `names`.
+    Raises KeyError if any of the variables isn't found."""
+    found = {}
+    remaining = set(names)
+    for f in sorted(os.listdir(restart_dir)):
+        if not f.endswith('.nc') or not remaining:
+            continue
+        with Dataset(P(restart_dir, f), 'r') as dataset:
+            here = remaining.intersection(dataset.variables)
+        if here:
+            found[f] = sorted(here)
+            remaining -= here
+    if remaining:
+        raise KeyError('Variables %s not found in the restart files in %s' % (', '.join(sorted(remaining)), restart_dir))
+    return found
+
+
+def _make_member(shared_dir, member_dir, seed, files_to_perturb, perturbations):
+    if not os.path.isdir(member_dir):
+        os.makedirs(member_dir)
+    for f in os.listdir(shared_dir):
+        src, dst = P(shared_dir, f), P(member_dir, f)
+        if os.path.lexists(dst):
+            os.remove(dst)
+        if f in files_to_perturb:
+            shutil.copyfile(src, dst)
+        else:
+            try:
+                os.link(src, dst)
+            except OSError:
+                # e.g. the members are on a different filesystem
+                shutil.copyfile(src, dst)
+
+    for i, (f, variables) in enumerate(sorted(files_to_perturb.items())):
+        with Dataset(P(member_dir, f), 'r+') as dataset:
+            dataset.set_auto_maskandscale(False)
+            for j, name in enumerate(variables):
+                # a separate, reproducible stream of noise for each variable of each member
+                perturb_variable(dataset.variables[name], perturbations[name], [seed, i, j])
+    return member_dir
+
+
+def make_ensemble(restart, outdir, seeds, perturbations, processes=None):
+    """Write one perturbed copy of `restart`, a restart archive or
+    directory, for each of `seeds`, as the directories outdir/member000,
+    outdir/member001, ...
+
+    `perturbations` is a dict of {variable name: amplitude}, e.g.
+    {'vors_real': 1e-7}, and each named variable has Gaussian noise with
+    standard deviation `amplitude` added.  `processes` is the number of
+    members written at once, by default one per CPU.  Files that aren't
+    perturbed are read-only hardlinks to those in outdir/shared.
+    Returns the list of member directories."""
+    seeds = list(seeds)
+    shared_dir = P(outdir, 'shared')
+    if os.path.isdir(shared_dir):
+        shutil.rmtree(shared_dir)
+    # never link to the user's own files, which they may edit later
+    if os.path.isdir(restart):
+        shutil.copytree(restart, shared_dir)
+    else:
+        with tarfile.open(restart, 'r:gz') as tar:
+            tar.extractall(path=shared_dir)
+    files_to_perturb = find_variables(shared_dir, perturbations)
+    for f in os.listdir(shared_dir):
+        if f not in files_to_perturb and os.path.isfile(P(shared_dir, f)):
+            os.chmod(P(shared_dir, f), 0o444)
+
+    member_dirs = [P(outdir, MEMBER_FMT % n) for n in range(len(seeds))]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(_make_member, shared_dir, member_dir, seed, files_to_perturb, perturbations)
+                   for member_dir, seed in zip(member_dirs, seeds)]
+        for future in futures:
+            future.result()
+    log.info('Wrote %d perturbed restarts of %s to %s, perturbing %s' % (len(seeds), restart, outdir,
+             ', '.join('%s by %g' % kv for kv in sorted(perturbations.items()))))
+    return member_dirs
+
+
+def derive_ensemble(exp, restart, seeds, perturbations, outdir=None, name_fmt='%s_ens%03d', processes=None):
+    """Make an ensemble of perturbed restarts with `make_ensemble`, and
+    derive an Experiment from `exp` for each member.
+
+    By default the restarts are written to the directory 'ensemble' in
+    `exp`'s data directory.  Returns a list of (Experiment, restart
+    directory) pairs, ready for `member_exp.run(i, restart_file=restart)`."""
+    if outdir is None:
+        outdir = P(exp.datadir, 'ensemble')
+    member_dirs = make_ensemble(restart, outdir, seeds, perturbations, processes=processes)
+    return [(exp.derive(name_fmt % (exp.name, n)), member_dir) for n, member_dir in enumerate(member_dirs)]
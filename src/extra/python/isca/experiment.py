@@ -6,7 +6,10 @@ from jinja2 import Environment, FileSystemLoader
 import glob
 import sh   
 import pdb
+import shutil
 import tarfile
+import threading
+import time
 
 # from gfdl import create_alert
 # import getpass
@@ -15,6 +18,7 @@ from isca import GFDL_WORK, GFDL_DATA, GFDL_BASE, _module_directory, get_env_fil
 from isca.diagtable import DiagTable
 from isca.loghandler import Logger, clean_log_debug
 from isca.helpers import destructive, useworkdir, mkdir
+from isca.retention import _year_length, apply_retention_policy, format_bytes, remove_files, run_length_days
 
 P = os.path.join
 
@@ -23,6 +27,8 @@ class CompilationError(Exception):
 
 class FailedRunError(Exception): pass
 
+class OutputBudgetError(Exception): pass
+
 class Experiment(Logger, EventEmitter):
     """A basic GFDL experiment"""
 
@@ -84,6 +90,16 @@ class Experiment(Logger, EventEmitter):
 
         self.namelist = Namelist()
 
+        # an isca.retention.RetentionPolicy, applied after every run
+        self.restart_policy = None
+        self._pruning = None
+
+        # the most bytes of diagnostic output a run should write, or None for no limit,
+        # and whether to 'warn' or 'refuse' to run when the diag table will write more.
+        self.output_budget = None
+        self.output_budget_action = 'warn'
+        self._last_run_seconds = None
+
     @destructive
     def rm_workdir(self):
         try:
@@ -178,9 +194,65 @@ class Experiment(Logger, EventEmitter):
 
     def delete_restart(self, run):
         resfile = self.get_restart_file(run)
-        if os.path.isfile(resfile):
-            sh.rm(resfile)
-            self.log.info('Deleted restart file %s' % resfile)
+        freed = remove_files([resfile])
+        if freed:
+            self.log.info('Deleted restart file %s, freeing %s' % (resfile, format_bytes(freed)))
+
+    def prune_restarts(self, policy=None, background=False, current=None):
+        """Delete the restart files not kept by the RetentionPolicy `policy`,
+        by default `self.restart_policy`, always keeping the restart of run
+        `current`.  If `background` is True the files are deleted in a
+        separate thread; see `wait_for_pruning`.  The interpreter waits for
+        the thread to finish before exiting."""
+        policy = policy or self.restart_policy
+        if policy is None:
+            return
+        self.wait_for_pruning()
+        if background:
+            self._pruning = threading.Thread(target=apply_retention_policy, args=(self, policy),
+                                             kwargs={'current': current}, name='prune-%s' % self.name)
+            self._pruning.start()
+        else:
+            apply_retention_policy(self, policy, current=current)
+
+    def wait_for_pruning(self):
+        """Wait for any restart pruning running in the background to finish."""
+        if self._pruning is not None:
+            self._pruning.join()
+            self._pruning = None
+
+    def estimate_output_volume(self):
+        """Return the `VolumeEstimate` of the diagnostic output of one run,
+        from the diag table and the resolution and run length in the namelist."""
+        nml = self.namelist.get('spectral_dynamics_nml', {})
+        resolution = (nml.get('lat_max', 64), nml.get('lon_max', 128))
+        dt_atmos = self.namelist.get('main_nml', {}).get('dt_atmos')
+        return self.diag_table.estimate_volume(resolution, nml.get('num_levels', 18), run_length_days(self), dt_atmos,
+                                               year_length=_year_length(self))
+
+    def check_output_volume(self, i):
+        """Log the expected diagnostic output of run `i`, and the write
+        bandwidth it needs if the previous run took as long, at debug level
+        unless `output_budget` is set.  If it is more
+        than `output_budget` warn, or raise OutputBudgetError if
+        `output_budget_action` is 'refuse'.  Returns the `VolumeEstimate`."""
+        estimate = self.estimate_output_volume()
+        message = 'Run %d will write about %s of diagnostics (%s)' % (i, format_bytes(estimate.total),
+            ', '.join('%s: %s' % (f, format_bytes(b)) for f, b in sorted(estimate.files.items())))
+        if self._last_run_seconds:
+            message += ', %s/s at the speed of the last run' % format_bytes(estimate.total / self._last_run_seconds)
+        if self.output_budget is None:
+            self.log.debug(message)
+        else:
+            self.log.info(message)
+        if self.output_budget is not None and estimate.total > self.output_budget:
+            message = 'Run %d will write about %s of diagnostics, more than the budget of %s' % (
+                i, format_bytes(estimate.total), format_bytes(self.output_budget))
+            if self.output_budget_action == 'refuse':
+                self.log.error(message)
+                raise OutputBudgetError(message)
+            self.log.warning(message)
+        return estimate
 
     def get_calendar(self):
         """Get the value of 'main_nml/calendar.
@@ -199,7 +271,8 @@ class Experiment(Logger, EventEmitter):
     def run(self, i, restart_file=None, use_restart=True, multi_node=False, num_cores=8, overwrite_data=False, save_run=False, run_idb=False, nice_score=0, mpirun_opts=''):
         """Run the model.0
             `num_cores`: Number of mpi cores to distribute over.
-            `restart_file` (optional): A path to a valid restart archive.  If None and `use_restart=True`,
+            `restart_file` (optional): A path to a valid restart archive, or a directory of restart files.
+                                       If None and `use_restart=True`,
                                        restart file (i-1) will be used.
             `save_run`:  If True, copy the entire working directory over to GFDL_DATA
                          so that the run can rerun without the python script.
@@ -228,6 +301,7 @@ class Experiment(Logger, EventEmitter):
         self.write_namelist(self.rundir)
         self.write_field_table(self.rundir)
         self.write_diag_table(self.rundir)
+        estimate = self.check_output_volume(i)
 
         for filename in self.inputfiles:
             sh.cp([filename, P(indir, os.path.split(filename)[1])])
@@ -244,7 +318,7 @@ class Experiment(Logger, EventEmitter):
             if not restart_file:
                 # get the restart from previous iteration
                 restart_file = self.get_restart_file(i - 1)
-            if not os.path.isfile(restart_file):
+            if not os.path.exists(restart_file):
                 self.log.error('Restart file not found, expecting file %r' % restart_file)
                 raise IOError('Restart file not found, expecting file %r' % restart_file)
             else:
@@ -278,6 +352,7 @@ class Experiment(Logger, EventEmitter):
 
         self.emit('run:ready', self, i)
         self.log.info("Beginning run %d" % i)
+        started = time.time()
         try:
             #for line in sh.bash(P(self.rundir, 'run.sh'), _iter=True, _err_to_out=True):
             proc = sh.bash(P(self.rundir, 'run.sh'), _bg=True, _out=_outhandler, _err_to_out=True)
@@ -298,8 +373,10 @@ class Experiment(Logger, EventEmitter):
             self.emit('run:failed', self)
             raise FailedRunError()
 
+        self._last_run_seconds = time.time() - started
         self.emit('run:complete', self, i)
-        self.log.info('Run %d complete' % i)
+        self.log.info('Run %d complete in %.0f s, writing diagnostics at about %s/s' % (
+            i, self._last_run_seconds, format_bytes(estimate.total / max(self._last_run_seconds, 1.))))
         mkdir(outdir)
 
         if num_cores > 1:
@@ -337,6 +414,7 @@ class Experiment(Logger, EventEmitter):
         # make the restart archive and delete the restart files
         self.make_restart_archive(self.get_restart_file(i), resdir)
         sh.rm('-r', resdir)
+        self.prune_restarts(background=True, current=i)
 
         if save_run:
             # copy the complete run directory to GFDL_DATA so that the run can
@@ -360,8 +438,14 @@ class Experiment(Logger, EventEmitter):
         self.log.info("Restart archive created at %s" % archive_file)
 
     def extract_restart_archive(self, archive_file, input_directory):
-        with tarfile.open(archive_file, 'r:gz') as tar:
-            tar.extractall(path=input_directory)
+        """Unpack a restart archive into `input_directory`.  `archive_file`
+        can also be a directory of restart files, which are copied."""
+        if os.path.isdir(archive_file):
+            for f in os.listdir(archive_file):
+                shutil.copy2(P(archive_file, f), P(input_directory, f))
+        else:
+            with tarfile.open(archive_file, 'r:gz') as tar:
+                tar.extractall(path=input_directory)
         self.log.info("Restart %s extracted to %s" % (archive_file, input_directory))
 
     def derive(self, new_experiment_name):
@@ -370,6 +454,9 @@ class Experiment(Logger, EventEmitter):
         new_exp.namelist = self.namelist.copy()
         new_exp.diag_table = self.diag_table.copy()
         new_exp.inputfiles = self.inputfiles[:]
+        new_exp.restart_policy = self.restart_policy
+        new_exp.output_budget = self.output_budget
+        new_exp.output_budget_action = self.output_budget_action
 
         return new_exp
 
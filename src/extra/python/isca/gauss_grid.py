@@ -0,0 +1,166 @@
+"""Gaussian quadrature latitudes, bounds and weights for any grid size.
+
+Originally copied from ajdawson on github on 24/05/17.  The roots of the
+Legendre polynomial are now found by Newton iteration from an asymptotic
+first guess, which takes milliseconds even for T170 and larger grids:
+
+    >>> from isca.gauss_grid import gaussian_quadrature
+    >>> lats, bounds, weights = gaussian_quadrature(32)    # 64 latitudes, T42
+
+Results are memoized in memory and stored as .npz files in
+`GAUSS_CACHE_DIR`, so short-lived worker processes load them rather than
+solving for them again.
+"""
+from collections import namedtuple
+import functools
+import os
+import tempfile
+
+import numpy as np
+
+from isca import GFDL_WORK
+from isca.loghandler import log
+
+P = os.path.join
+
+GAUSS_CACHE_DIR = P(GFDL_WORK, 'grid_cache')
+
+# part of the cache file names, as `isca.grid.GRID_CACHE_VERSION`
+GAUSS_CACHE_VERSION = 2
+
+GaussianQuadrature = namedtuple('GaussianQuadrature', 'latitudes bounds weights')
+
+
+def _legendre(nlat, x):
+    # P_nlat(x) and its derivative by the three-term recurrence, for an array of x.
+    p0, p1 = np.ones_like(x), x
+    for k in range(2, nlat + 1):
+        p0, p1 = p1, ((2 * k - 1) * x * p1 - (k - 1) * p0) / k
+    dp = nlat * (x * p1 - p0) / (x**2 - 1.)
+    return p1, dp
+
+
+def legendre_roots(nlat, tol=1e-15, max_iterations=20):
+    """Return (the roots of the Legendre polynomial of degree `nlat`, in
+    increasing order, and the Gaussian weights, which sum to 2).
+
+    Starts from the asymptotic approximation to each root and refines all
+    of them at once by Newton iteration.  Only the roots in (0, 1) are
+    solved for; the rest follow by symmetry."""
+    nlat = int(nlat)
+    if nlat < 1:
+        raise ValueError('nlat must be a positive integer, got %r' % nlat)
+    k = np.arange(1, nlat // 2 + 1)
+    x = (1. - 1. / (8. * nlat**2) + 1. / (8. * nlat**3)) * np.cos(np.pi * (4 * k - 1) / (4 * nlat + 2))
+    for _ in range(max_iterations):
+        p, dp = _legendre(nlat, x)
+        dx = p / dp
+        x -= dx
+        if np.abs(dx).max(initial=0.) <= tol:
+            break
+    else:
+        log.warning('Gaussian latitudes for nlat=%d did not converge to %g' % (nlat, tol))
+    dp = _legendre(nlat, x)[1]
+    w = 2. / ((1. - x**2) * dp**2)
+
+    # x and w run from the north pole to the equator
+    if nlat % 2:
+        # an odd degree also has a root at the equator
+        w0 = 2. / _legendre(nlat, np.zeros(1))[1]**2
+        roots = np.concatenate([-x, np.zeros(1), x[::-1]])
+        weights = np.concatenate([w, w0, w[::-1]])
+    else:
+        roots = np.concatenate([-x, x[::-1]])
+        weights = np.concatenate([w, w[::-1]])
+    return roots, weights
+
+
+def _solve(n):
+    nlat = 2 * n
+    roots, weights = legendre_roots(nlat)
+    # the bounds of each latitude enclose its weight of the interval [-1, 1]
+    bounds1d = np.empty([nlat + 1])
+    bounds1d[0] = -1.
+    bounds1d[1:-1] = np.clip(-1. + weights[:-1].cumsum(), -1., 1.)
+    bounds1d[-1] = 1.
+    bounds1d = np.rad2deg(np.arcsin(bounds1d))
+    bounds2d = np.column_stack([bounds1d[:-1], bounds1d[1:]])
+    latitudes = np.rad2deg(np.arcsin(roots))
+    return GaussianQuadrature(latitudes, bounds2d, weights)
+
+
+def gaussian_quadrature(n, cache_dir=GAUSS_CACHE_DIR):
+    """Return the `GaussianQuadrature` (latitudes, bounds, weights) of the
+    Gaussian grid with 2*`n` latitudes, from south to north.
+
+    latitudes: length 2*n array of latitudes in degrees.
+    bounds:    (2*n, 2) array of the latitude bounds of each cell in degrees.
+    weights:   length 2*n array of the quadrature weights, which sum to 2.
+
+    Set `cache_dir=None` to skip the on-disk cache.  The returned arrays
+    are read-only; copy them before modifying."""
+    if abs(int(n)) != n:
+        raise ValueError('n must be a non-negative integer')
+    return _gaussian_quadrature(int(n), cache_dir)
+
+
+@functools.lru_cache(maxsize=64)
+def _gaussian_quadrature(n, cache_dir):
+    cache_file = None
+    quad = None
+    if cache_dir is not None:
+        cache_file = P(cache_dir, 'gaussian_quadrature_v%d_%d.npz' % (GAUSS_CACHE_VERSION, n))
+        try:
+            with np.load(cache_file) as cached:
+                quad = GaussianQuadrature(*[cached[name] for name in GaussianQuadrature._fields])
+        except (IOError, OSError, KeyError, ValueError):
+            quad = None
+    if quad is None:
+        quad = _solve(n)
+        if cache_file is not None:
+            write_npz_cache(cache_file, quad._asdict())
+    for arr in quad:
+        arr.setflags(write=False)
+    return quad
+
+
+def write_npz_cache(cache_file, arrays):
+    """Save the dict `arrays` to the .npz file `cache_file`, logging rather
+    than raising if it can't be written."""
+    # write to a temporary file and rename, so that concurrent processes
+    # never see a partially written cache file.
+    cache_dir = os.path.dirname(cache_file)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(dir=cache_dir, suffix='.npz')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            # mkstemp makes the file private; the cache is shared like the file it replaces
+            os.chmod(tmp_file, 0o644)
+            os.replace(tmp_file, cache_file)
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+    except (IOError, OSError) as e:
+        log.warning('Unable to write cache %s: %s' % (cache_file, e))
+
+
+def gaussian_latitudes(n):
+    """Construct latitudes and latitude bounds for a Gaussian grid.
+
+    Args:
+
+    * n:
+        The Gaussian grid number (half the number of latitudes in the
+        grid.
+
+    Returns:
+        A 2-tuple where the first element is a length `n` array of
+        latitudes (in degrees) and the second element is an `(n, 2)`
+        array of bounds.
+
+    """
+    quad = gaussian_quadrature(n)
+    return quad.latitudes, quad.bounds
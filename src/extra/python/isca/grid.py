@@ -0,0 +1,146 @@
+"""Horizontal grid geometry for the Gaussian grids used by Isca's spectral core.
+
+Grids for any triangular truncation are built directly from the Gaussian
+latitudes, so no model run or pre-generated grid file is needed:
+
+    >>> from isca.grid import gaussian_grid, grid_metrics
+    >>> lon, lat, lonb, latb = gaussian_grid('T85')
+    >>> grid_metrics('T85').area.shape
+    (128, 256)
+
+Grids are cached in memory and on disk in `GRID_CACHE_DIR`.  Areas, spacings
+and weights are computed with array broadcasting and cached per
+(resolution, radius), so repeated area averages don't recompute them.
+"""
+from collections import namedtuple
+import functools
+import os
+
+import numpy as np
+
+from isca.gauss_grid import GAUSS_CACHE_DIR, gaussian_latitudes, write_npz_cache
+
+P = os.path.join
+
+EARTH_RADIUS = 6376.0e3
+
+GRID_CACHE_DIR = GAUSS_CACHE_DIR
+
+# part of the cache file names: change it when the way grids are computed
+# changes, so that grids cached by an older version aren't used.
+GRID_CACHE_VERSION = 2
+
+Grid = namedtuple('Grid', 'lon lat lonb latb')
+GridMetrics = namedtuple('GridMetrics', 'lon lat lonb latb area xsize ysize weights')
+
+
+def truncation(resolution):
+    """Return the integer triangular truncation of `resolution`,
+    given either as a string, e.g. 'T42', or as an integer, e.g. 42."""
+    if isinstance(resolution, str):
+        resolution = resolution.upper().lstrip('T')
+    num_fourier = int(resolution)
+    if num_fourier <= 0:
+        raise ValueError('Resolution must be a positive truncation, got %r' % resolution)
+    return num_fourier
+
+
+def grid_shape(resolution):
+    """Return (lat_max, lon_max) of the physical grid for a truncation.
+
+    Uses the same anti-aliasing rule as `scripts/resolutions.py`: lat_max
+    is a multiple of 4 with 2*lat_max >= 3*T+1, and lon_max is the
+    smallest power of two with lon_max >= 3*T+1.  This reproduces the
+    standard grids in `Experiment.RESOLUTIONS`, e.g. T42 -> (64, 128)."""
+    num_fourier = truncation(resolution)
+    min_points = 3 * num_fourier + 1
+    lat_max = 4 * int(np.ceil(min_points / 8.))
+    lon_max = 2 ** int(np.ceil(np.log2(min_points)))
+    return lat_max, lon_max
+
+
+def lon_lat_bounds(lat_max, lon_max):
+    """Return (lon, lat, lonb, latb) for a Gaussian grid of the given size,
+    with the same conventions as the model output: longitudes start at 0
+    and the bounds are half a grid box either side."""
+    if lat_max % 2:
+        raise ValueError('lat_max must be even for a Gaussian grid, got %d' % lat_max)
+    lats, bounds = gaussian_latitudes(lat_max // 2)
+    latb = np.append(bounds[:, 0], bounds[-1, 1])
+    dlon = 360. / lon_max
+    lons = np.arange(lon_max) * dlon
+    lonb = np.arange(lon_max + 1) * dlon - 0.5 * dlon
+    return lons, lats, lonb, latb
+
+
+def gaussian_grid(resolution, cache_dir=GRID_CACHE_DIR):
+    """Return the `Grid` (lon, lat, lonb, latb) in degrees of the Gaussian
+    grid at `resolution`, e.g. 'T85' or 85.
+
+    Grids are memoized in memory and stored as .npz files in `cache_dir`,
+    so other processes can load them rather than solve for the Gaussian
+    latitudes again.  Set `cache_dir=None` to skip the on-disk cache.
+    The returned arrays are read-only; copy them before modifying."""
+    return _gaussian_grid(grid_shape(resolution), cache_dir)
+
+
+def gaussian_grid_from_shape(lat_max, lon_max, cache_dir=GRID_CACHE_DIR):
+    """Return the `Grid` of the Gaussian grid with `lat_max` latitudes and
+    `lon_max` longitudes, for grids that aren't a standard truncation.
+    Cached in the same way as `gaussian_grid`."""
+    return _gaussian_grid((int(lat_max), int(lon_max)), cache_dir)
+
+
+@functools.lru_cache(maxsize=None)
+def _gaussian_grid(shape, cache_dir):
+    lat_max, lon_max = shape
+    cache_file = None
+    grid = None
+    if cache_dir is not None:
+        cache_file = P(cache_dir, 'gaussian_grid_v%d_%dx%d.npz' % (GRID_CACHE_VERSION, lat_max, lon_max))
+        try:
+            with np.load(cache_file) as cached:
+                grid = Grid(*[cached[name] for name in Grid._fields])
+        except (IOError, OSError, KeyError, ValueError):
+            grid = None
+    if grid is None:
+        grid = Grid(*lon_lat_bounds(lat_max, lon_max))
+        if cache_file is not None:
+            write_npz_cache(cache_file, grid._asdict())
+    for arr in grid:
+        arr.setflags(write=False)
+    return grid
+
+
+def cell_metrics(lons, lats, lonb, latb, radius=EARTH_RADIUS):
+    """Return (area, xsize, ysize) in metres of every grid cell as
+    (lat, lon) arrays, for cell centres and bounds given in degrees."""
+    dlon = np.abs(np.radians(np.diff(np.asarray(lonb, dtype=float))))
+    latb_rad = np.radians(np.asarray(latb, dtype=float))
+    dlat = np.abs(np.diff(latb_rad))
+    dsinlat = np.abs(np.diff(np.sin(latb_rad)))
+    coslat = np.cos(np.radians(np.asarray(lats, dtype=float)))
+    area = radius**2 * dsinlat[:, np.newaxis] * dlon[np.newaxis, :]
+    xsize = radius * np.abs(coslat[:, np.newaxis] * dlon[np.newaxis, :])
+    ysize = np.repeat(radius * dlat[:, np.newaxis], len(lons), axis=1)
+    return area, xsize, ysize
+
+
+def grid_metrics(resolution, radius=EARTH_RADIUS):
+    """Return the `GridMetrics` of the Gaussian grid at `resolution`.
+
+    Results are memoized per (resolution, radius) and the returned arrays
+    are read-only; copy them before modifying.  `weights` are the cell areas
+    normalised to sum to one."""
+    return _grid_metrics(truncation(resolution), float(radius))
+
+
+@functools.lru_cache(maxsize=None)
+def _grid_metrics(num_fourier, radius):
+    lons, lats, lonb, latb = gaussian_grid(num_fourier)
+    area, xsize, ysize = cell_metrics(lons, lats, lonb, latb, radius)
+    weights = area / area.sum()
+    metrics = GridMetrics(lons, lats, lonb, latb, area, xsize, ysize, weights)
+    for arr in metrics:
+        arr.setflags(write=False)
+    return metrics
@@ -1,5 +1,6 @@
 import os
-from functools import wraps
+import re
+from functools import lru_cache, wraps
 
 import sh
 
@@ -58,19 +59,22 @@ def git_diff(directory):
     git_diff_output = str(git_diff_output).split("\n")
     return git_diff_output
 
+@lru_cache(maxsize=None)
+def git_supports_directory_option():
+    """Returns True if the installed git understands `git -C <dir>`, which
+    was added in git 1.8.5.  Checked once per process."""
+    try:
+        version = str(git('--version'))
+    except Exception:
+        return False
+    match = re.search(r'(\d+)\.(\d+)(?:\.(\d+))?', version)
+    return match is not None and tuple(int(x or 0) for x in match.groups()) >= (1, 8, 5)
+
 def git_run_in_directory(GFDL_BASE_DIR, dir_in):
     """Function that bakes in git command to run in a specified directory.
-       `Try except` is to catch different versions of this command
-       in versions of git >1.8 (`git -C`) and older versions for which
-       `git -C` is not a recognized command. """
-       
-    try:
-        codedir_git = git.bake('-C', GFDL_BASE_DIR)        
-        git_test = codedir_git.log('-1', '--format="%H"').stdout
-        baked_git_fn = git.bake('-C', dir_in)
-    except:
-        codedir_git = git.bake('--git-dir='+GFDL_BASE_DIR+'/.git', '--work-tree='+GFDL_BASE_DIR)
-        git_test = codedir_git.log('-1', '--format="%H"').stdout
-        baked_git_fn = git.bake('--git-dir='+dir_in+'/.git', '--work-tree='+dir_in)        
-        
-    return baked_git_fn        
\ No newline at end of file
+       Uses `git -C` with versions of git >=1.8.5, and `--git-dir` and
+       `--work-tree` with older versions for which `git -C` is not a
+       recognized command.  `GFDL_BASE_DIR` is no longer used."""
+    if git_supports_directory_option():
+        return git.bake('-C', dir_in)
+    return git.bake('--git-dir='+dir_in+'/.git', '--work-tree='+dir_in)        
\ No newline at end of file
@@ -19,49 +19,51 @@
 #'sauliere2012' Choose mountains from Sauliere 2012 configuration using mountains keyword. Default is 'all', alternatively only 'rockys' or 'tibet' may be specified
 #'gaussian' Use parameters specified in topo_gauss keyword to set up a Gaussian mountain. topo_gauss should be a list in the form: [central_lat,central_lon,radius_degrees,std_dev,height]
 
+# Resolution:
+# resolution keyword sets the triangular truncation of the grid, e.g. 'T42' or 'T85'. If it is not given, the grid of the
+# Experiment's namelist is used: lat_max by lon_max if both are set, otherwise the standard grid for num_fourier, or T42.
+# Alternatively, pass any grid as grid=(lons, lats).
+# Continent masks and mountain shapes are calculated once per grid and cached, so generating many configurations is cheap.
+
+# Output:
+# If exp is an Experiment, land.nc is written to its working directory and added to its inputfiles. If exp is a string,
+# the file is written to GFDL_BASE/exp/<exp>/input/land.nc as before. Alternatively, give the path with the filename keyword.
+# Nothing is plotted unless plot=True, which shows the configuration on screen, or plot is a filename to save the figure to,
+# so land files can be generated on headless compute nodes.
+
 # Topography boundary options:
 # If waterworld keyword is set to False (default), then topography can only be non-zero on continents - important as topography has a Gaussian structure and tends exponentially to zero.
 # If waterworld keyword is set to True, aquamountains are possible - extra work needed here to deal with exponential issues!
 
+import functools
+import os
+
 import numpy as np
 from netCDF4 import Dataset
-import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
-import os
 
-def write_land(exp,land_mode='square',boundaries=[20.,60.,20.,60.],continents=['all'],topo_mode='none',mountains=['all'],topo_gauss=[40.,40.,20.,10.,3500.],waterworld=False):
-
-# Common features of set-ups
-    # specify resolution
-    t_res = 42
-    #read in grid from approriate file
-    GFDL_BASE = os.environ['GFDL_BASE']
-    resolution_file = Dataset(GFDL_BASE + 'src/extra/python/scripts/gfdl_grid_files/t'+str(t_res)+'.nc', 'r', format='NETCDF3_CLASSIC')
-    lons = resolution_file.variables['lon'][:]
-    lats = resolution_file.variables['lat'][:]
-    lonb = resolution_file.variables['lonb'][:]
-    latb = resolution_file.variables['latb'][:]
-    nlon=lons.shape[0]
-    nlat=lats.shape[0]
-    topo_array = np.zeros((nlat,nlon))
-    land_array = np.zeros((nlat,nlon))
+from isca.grid import gaussian_grid, gaussian_grid_from_shape
+from isca.loghandler import log
 
+P = os.path.join
+
+#create dictionary for continents
+CONTINENTS = {'NA':0, 'SA':1, 'EA':2, 'AF':3, 'OZ':4, 'IN':5, 'SEA':6}
+
+MOUNTAINS = ('rockys', 'tibet')
+
+
+def _grid_arrays(lons_bytes, lats_bytes):
+    lons = np.frombuffer(lons_bytes, dtype=np.float64)
+    lats = np.frombuffer(lats_bytes, dtype=np.float64)
     #make 2d arrays of latitude and longitude
-    lon_array, lat_array = np.meshgrid(lons,lats)
-    lonb_array, latb_array = np.meshgrid(lonb,latb)
-    
-    #create dictionary for continents
-    cont_dic = {'NA':0, 'SA':1, 'EA':2, 'AF':3, 'OZ':4, 'IN':5, 'SEA':6}
+    return np.meshgrid(lons, lats)
 
-# Firstly determine the land set-up to be used    
-    # 1) Set-up in which a square of land is included
-    if land_mode=='square':
-        idx = (boundaries[0] <= lat_array) & (lat_array < boundaries[1]) & (boundaries[2] < lon_array) & (boundaries[3] > lon_array)
-        land_array[idx] = 1.0
-    
-    # 2) Set-up in which some or all of 'original' continents are included
-    elif land_mode=='continents_old':  #Older configuration of continents: Addition of India and SE Asia required some restructuring. This may be removed once obsolete.
-        idx_c = np.zeros((4,nlat,nlon), dtype=bool)
+
+@functools.lru_cache(maxsize=32)
+def _continent_masks(lons_bytes, lats_bytes, land_mode):
+    lon_array, lat_array = _grid_arrays(lons_bytes, lats_bytes)
+    if land_mode == 'continents_old':  #Older configuration of continents: Addition of India and SE Asia required some restructuring. This may be removed once obsolete.
+        idx_c = np.zeros((4,)+lon_array.shape, dtype=bool)
         idx_c[0,:,:] = (103.-43./40.*(lon_array-180) < lat_array) & ((lon_array-180)*43./50. -51.8 < lat_array) &( lat_array < 60.)   #North America
         idx_c[1,:,:] = (737.-7.2*(lon_array-180) < lat_array) & ((lon_array-180)*10./7. + -212.1 < lat_array) &( lat_array < -22./45*(lon_array-180) +65.9)   #South America
         eurasia_pos = (17. <= lat_array) & (lat_array < 60.) & (-5. < lon_array) & ( 43./40.*lon_array -101.25 < lat_array)
@@ -70,19 +72,8 @@ def write_land(exp,land_mode='square',boundaries=[20.,60.,20.,60.],continents=['
         africa_pos = (lat_array < 17.) & (-52./27.*lon_array + 7.37 < lat_array) & (52./38.*lon_array -65.1 < lat_array) 
         africa_neg = (lat_array < 17.) & (-52./27.*(lon_array-360) + 7.37 < lat_array)
         idx_c[3,:,:] = africa_pos + africa_neg   #Africa
-        
-        if 'all' in continents:
-            idx = idx_c[0,:,:] + idx_c[1,:,:] + idx_c[2,:,:] + idx_c[3,:,:] 
-            land_array[idx] = 1.            
-        else:
-            idx = np.zeros((nlat,nlon), dtype=bool)
-            for cont in continents:
-                idx = idx + idx_c[cont_dic[cont],:,:]
-                land_array[idx] = 1.0
-                
-    # 2) Set-up in which some or all of 'new' continents are included
-    elif land_mode=='continents':  
-        idx_c = np.zeros((7,nlat,nlon), dtype=bool)
+    elif land_mode == 'continents':
+        idx_c = np.zeros((7,)+lon_array.shape, dtype=bool)
         idx_c[0,:,:] = (103.-43./40.*(lon_array-180) < lat_array) & ((lon_array-180)*43./50. -51.8 < lat_array) &( lat_array < 60.)   #North America
         idx_c[1,:,:] = (737.-7.2*(lon_array-180) < lat_array) & ((lon_array-180)*10./7. + -212.1 < lat_array) &( lat_array < -22./45*(lon_array-180) +65.9)   #South America
         eurasia_pos = (23. <= lat_array) & (lat_array < 60.) & (-8. < lon_array) & ( 43./40.*lon_array -101.25 < lat_array) 
@@ -94,63 +85,99 @@ def write_land(exp,land_mode='square',boundaries=[20.,60.,20.,60.],continents=['
         idx_c[4,:,:] = (lat_array > - 35.) & (lat_array < -17.) & (lon_array > 115.) & (lon_array < 150.) #Australia
         idx_c[5,:,:] = (lat_array < 23.) & (-15./8.*lon_array + 152 < lat_array) & (15./13.*lon_array - 81 < lat_array) #India
         idx_c[6,:,:] = (lat_array < 23.) & ( 43./40.*lon_array -101.25 < lat_array) & (-14./13.*lon_array +120 < lat_array)      #South East Asia
+    else:
+        raise ValueError('Unknown continent set-up %r' % land_mode)
+    idx_c.setflags(write=False)
+    return idx_c
+
+
+@functools.lru_cache(maxsize=32)
+def _sauliere2012_mountains(lons_bytes, lats_bytes):
+    lon_array, lat_array = _grid_arrays(lons_bytes, lats_bytes)
+
+    # Rockys from Sauliere 2012
+    h_0 = 2670.
+    central_lon = 247.5
+    central_lat = 40.
+    L_1 = 7.5
+    L_2 = 20.
+    gamma_1 = 42.
+    gamma_2 = 42.
+    delta_1 = ((lon_array - central_lon)*np.cos(np.radians(gamma_1)) + (lat_array - central_lat)*np.sin(np.radians(gamma_1)))/L_1
+    delta_2 = (-(lon_array - central_lon)*np.sin(np.radians(gamma_2)) + (lat_array - central_lat)*np.cos(np.radians(gamma_2)))/L_2
+    h_arr_rockys = h_0 * np.exp(-(delta_1**2. + delta_2**2.))
+    idx_rockys = (h_arr_rockys / h_0 > 0.05) #s make sure exponentials are cut at some point - use the value from p70 of Brayshaw's thesis. 
+
+    #Tibet from Sauliere 2012
+    h_0 = 5700.
+    central_lon = 82.5
+    central_lat = 28
+    L_1 = 12.5
+    L_2 = 12.5
+    gamma_1 = -49.5
+    gamma_2 = -18.
+    delta_1 = ((lon_array - central_lon)*np.cos(np.radians(gamma_1)) + (lat_array - central_lat)*np.sin(np.radians(gamma_1)))/L_1
+    delta_2 = (-(lon_array - central_lon)*np.sin(np.radians(gamma_2)) + (lat_array - central_lat)*np.cos(np.radians(gamma_2)))/L_2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        h_arr_tibet_no_amp = np.exp(-(delta_1**2.))*(1./delta_2)*np.exp(-0.5*(np.log(delta_2))**2.)
+    maxval = np.nanmax(h_arr_tibet_no_amp) #For some reason my maximum value of h_arr_tibet_no_amp > 1. Renormalise so h_0 sets amplitude. 
+    h_arr_tibet = (h_arr_tibet_no_amp/maxval)*h_0
+    with np.errstate(invalid='ignore'):
+        idx_tibet = (h_arr_tibet / h_0 > 0.05)
+
+    mountains = {'rockys': np.where(idx_rockys, h_arr_rockys, 0.), 'tibet': np.where(idx_tibet, h_arr_tibet, 0.)}
+    for arr in mountains.values():
+        arr.setflags(write=False)
+    return mountains
+
+
+def land_arrays(lons, lats, land_mode='square', boundaries=[20.,60.,20.,60.], continents=['all'], topo_mode='none', mountains=['all'], topo_gauss=[40.,40.,20.,10.,3500.], waterworld=False):
+    """Return the (lat, lon) land mask and topography arrays on the grid with 1D coordinates lons, lats.
+    See the top of this file for the options."""
+    lons = np.ascontiguousarray(lons, dtype=np.float64)
+    lats = np.ascontiguousarray(lats, dtype=np.float64)
+    key = (lons.tobytes(), lats.tobytes())
+    nlon=lons.shape[0]
+    nlat=lats.shape[0]
+    topo_array = np.zeros((nlat,nlon))
+    land_array = np.zeros((nlat,nlon))
+
+# Firstly determine the land set-up to be used    
+    # 1) Set-up in which a square of land is included
+    if land_mode=='square':
+        lon_array, lat_array = np.meshgrid(lons, lats)
+        idx = (boundaries[0] <= lat_array) & (lat_array < boundaries[1]) & (boundaries[2] < lon_array) & (boundaries[3] > lon_array)
+        land_array[idx] = 1.0
+
+    # 2) Set-up in which some or all of the 'original' or 'new' continents are included
+    elif land_mode in ('continents_old', 'continents'):
+        idx_c = _continent_masks(key[0], key[1], land_mode)
         if 'all' in continents:
-            idx = idx_c[0,:,:] + idx_c[1,:,:] + idx_c[2,:,:] + idx_c[3,:,:] + idx_c[4,:,:] + idx_c[5,:,:] + idx_c[6,:,:] 
-            land_array[idx] = 1.
+            idx = idx_c.any(axis=0)
         else:
-            idx = np.zeros((nlat,nlon), dtype=bool)
-            for cont in continents:
-                idx = idx + idx_c[cont_dic[cont],:,:]
-                land_array[idx] = 1.
-                
+            idx = idx_c[[CONTINENTS[cont] for cont in continents]].any(axis=0)
+        land_array[idx] = 1.
+
     elif land_mode=='none':  
         land_array = np.zeros((nlat,nlon))
-        
-    
+
+    else:
+        raise ValueError('Invalid land option %r' % land_mode)
+
 # Next produce a topography array
     if topo_mode == 'none':
         topo_array = np.zeros((nlat,nlon))
-        
-    elif topo_mode == 'sauliere2012':
-        # Rockys from Sauliere 2012
-        h_0 = 2670.
-        central_lon = 247.5
-        central_lat = 40.
-        L_1 = 7.5
-        L_2 = 20.
-        gamma_1 = 42.
-        gamma_2 = 42.
-        delta_1 = ((lon_array - central_lon)*np.cos(np.radians(gamma_1)) + (lat_array - central_lat)*np.sin(np.radians(gamma_1)))/L_1
-        delta_2 = (-(lon_array - central_lon)*np.sin(np.radians(gamma_2)) + (lat_array - central_lat)*np.cos(np.radians(gamma_2)))/L_2
-        h_arr_rockys = h_0 * np.exp(-(delta_1**2. + delta_2**2.))
-        idx_rockys = (h_arr_rockys / h_0 > 0.05) #s make sure exponentials are cut at some point - use the value from p70 of Brayshaw's thesis. 
-
-        #Tibet from Sauliere 2012
-        h_0 = 5700.
-        central_lon = 82.5
-        central_lat = 28
-        L_1 = 12.5
-        L_2 = 12.5
-        gamma_1 = -49.5
-        gamma_2 = -18.
-        delta_1 = ((lon_array - central_lon)*np.cos(np.radians(gamma_1)) + (lat_array - central_lat)*np.sin(np.radians(gamma_1)))/L_1
-        delta_2 = (-(lon_array - central_lon)*np.sin(np.radians(gamma_2)) + (lat_array - central_lat)*np.cos(np.radians(gamma_2)))/L_2
-        h_arr_tibet_no_amp = np.exp(-(delta_1**2.))*(1./delta_2)*np.exp(-0.5*(np.log(delta_2))**2.)
-        maxval = np.nanmax(h_arr_tibet_no_amp) #For some reason my maximum value of h_arr_tibet_no_amp > 1. Renormalise so h_0 sets amplitude. 
-        h_arr_tibet = (h_arr_tibet_no_amp/maxval)*h_0
-        idx_tibet = (h_arr_tibet / h_0 > 0.05)
 
-        if 'all' in mountains:
-            topo_array[idx_rockys] = h_arr_rockys[idx_rockys]
-            topo_array[idx_tibet] =  h_arr_tibet[idx_tibet]
-        elif 'rockys' in mountains:
-            topo_array[idx_rockys] = h_arr_rockys[idx_rockys]
-        elif 'tibet' in mountains:
-            topo_array[idx_tibet] =  h_arr_tibet[idx_tibet]
-        else:
-            print('No valid mountain options detected for Sauliere 2012 topography')
+    elif topo_mode == 'sauliere2012':
+        heights = _sauliere2012_mountains(key[0], key[1])
+        # only the first matching option is used, as before
+        chosen = list(MOUNTAINS) if 'all' in mountains else [m for m in MOUNTAINS if m in mountains][:1]
+        if not chosen:
+            log.warning('No valid mountain options detected for Sauliere 2012 topography')
+        for mountain in chosen:
+            idx = heights[mountain] != 0.
+            topo_array[idx] = heights[mountain][idx]
 
-            
     elif topo_mode == 'gaussian':
         #Options to define simple Gaussian Mountain
         central_lat = topo_gauss[0]
@@ -158,7 +185,7 @@ def write_land(exp,land_mode='square',boundaries=[20.,60.,20.,60.],continents=['
         radius_degrees = topo_gauss[2]
         std_dev = topo_gauss[3]
         height = topo_gauss[4]
-        rsqd_array = np.sqrt((lon_array - central_lon)**2.+(lat_array - central_lat)**2.)
+        rsqd_array = np.sqrt((lons[np.newaxis,:] - central_lon)**2.+(lats[:,np.newaxis] - central_lat)**2.)
         #generalise to ellipse - needs checking but may be useful later (RG)
         #ax_rot = 1. #gradient of new x axis
         #ax_rat = 2. #axis ratio a**2/b**2
@@ -166,51 +193,102 @@ def write_land(exp,land_mode='square',boundaries=[20.,60.,20.,60.],continents=['
         #divide by factor of cos(atan(m)) to account for change in coords
         idx = (rsqd_array < radius_degrees) 
         topo_array[idx] = height* np.exp(-(rsqd_array[idx]**2.)/(2.*std_dev**2.))
-        
+
     else:
-        print('Invalid topography option given')
-        
+        log.warning('Invalid topography option given')
 
     if waterworld != True:      #Leave flexibility to allow aquamountains!
         idx = (land_array == 0.) & (topo_array != 0.)
         topo_array[idx] = 0. 
 
+    return land_array, topo_array
 
-    #Write land and topography arrays to file
-    topo_filename = GFDL_BASE + 'exp/' + exp + '/input/land.nc'
-    topo_file = Dataset(topo_filename, 'w', format='NETCDF3_CLASSIC')
-    lat = topo_file.createDimension('lat', nlat)
-    lon = topo_file.createDimension('lon', nlon)
-    latitudes = topo_file.createVariable('lat','f4',('lat',))
-    longitudes = topo_file.createVariable('lon','f4',('lon',))
-    topo_array_netcdf = topo_file.createVariable('zsurf','f4',('lat','lon',))
-    land_array_netcdf = topo_file.createVariable('land_mask','f4',('lat','lon',))
-    latitudes[:] = lats
-    longitudes[:] = lons
-    topo_array_netcdf[:] = topo_array
-    land_array_netcdf[:] = land_array
-    topo_file.close()
-    print('Output written to: ' + topo_filename)
-
-
-    #Show configuration on screen to allow checking
-    lon_0 = lons.mean()
-    lat_0 = lats.mean()
-    m = Basemap(lat_0=lat_0,lon_0=lon_0)
-    xi, yi = m(lon_array, lat_array)
-    plt.figure()
-    if land_mode != 'none':
-        m.contour(xi,yi,land_array)
-    if topo_mode != 'none':
-        cs = m.contourf(xi,yi,topo_array, cmap=plt.get_cmap('RdBu_r'))
+
+def write_land_file(filename, lons, lats, land_array, topo_array):
+    """Write land and topography arrays to a netcdf file in the format the model reads."""
+    dirname = os.path.dirname(os.path.abspath(filename))
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with Dataset(filename, 'w', format='NETCDF3_CLASSIC') as topo_file:
+        topo_file.createDimension('lat', len(lats))
+        topo_file.createDimension('lon', len(lons))
+        latitudes = topo_file.createVariable('lat','f4',('lat',))
+        longitudes = topo_file.createVariable('lon','f4',('lon',))
+        topo_array_netcdf = topo_file.createVariable('zsurf','f4',('lat','lon',))
+        land_array_netcdf = topo_file.createVariable('land_mask','f4',('lat','lon',))
+        latitudes[:] = lats
+        longitudes[:] = lons
+        topo_array_netcdf[:] = topo_array
+        land_array_netcdf[:] = land_array
+    log.info('Land output written to: %s' % filename)
+
+
+def plot_land(lons, lats, land_array, topo_array, filename=None):
+    """Plot the land mask and topography to check the configuration, saving to filename if given,
+    otherwise showing it on screen. matplotlib is only imported when plotting."""
+    import matplotlib
+    if filename is not None:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure()
+    if land_array.any():
+        plt.contour(lons, lats, land_array, levels=[0.5], colors='k')
+    if topo_array.any():
+        cs = plt.contourf(lons, lats, topo_array, cmap=plt.get_cmap('RdBu_r'))
         cb = plt.colorbar(cs, shrink=0.5, extend='both')
     plt.xticks(np.linspace(0,360,13))
     plt.yticks(np.linspace(-90,90,7))
-    plt.show()
+    if filename is not None:
+        fig.savefig(filename)
+        plt.close(fig)
+    else:
+        plt.show()
 
 
+def _experiment_grid(exp):
+    # the namelist's lat_max and lon_max take precedence over the standard grid for its num_fourier,
+    # e.g. T213 is run with lon_max=640 rather than 1024
+    nml = getattr(exp, 'namelist', {}).get('spectral_dynamics_nml', {})
+    if nml.get('lat_max') and nml.get('lon_max'):
+        return gaussian_grid_from_shape(nml['lat_max'], nml['lon_max'])
+    return gaussian_grid(nml.get('num_fourier') or 'T42')
 
-if __name__ == "__main__":
 
-    write_land('test',land_mode='continents')
+def write_land(exp,land_mode='square',boundaries=[20.,60.,20.,60.],continents=['all'],topo_mode='none',mountains=['all'],topo_gauss=[40.,40.,20.,10.,3500.],waterworld=False,resolution=None,grid=None,filename=None,plot=False):
+    """Generate land and topography for an Experiment, or an experiment name, and write it to land.nc.
+    Returns the path of the file written. See the top of this file for the options."""
+    if grid is not None:
+        lons, lats = grid[0], grid[1]
+    elif resolution is not None:
+        # generate the Gaussian grid for the requested resolution
+        lons, lats = gaussian_grid(resolution)[:2]
+    else:
+        lons, lats = _experiment_grid(exp)[:2]
+
+    land_array, topo_array = land_arrays(lons, lats, land_mode=land_mode, boundaries=boundaries, continents=continents,
+                                         topo_mode=topo_mode, mountains=mountains, topo_gauss=topo_gauss, waterworld=waterworld)
+
+    is_experiment = not isinstance(exp, str)
+    if filename is None:
+        if is_experiment:
+            filename = P(exp.workdir, 'input', 'land.nc')
+        else:
+            filename = P(os.environ['GFDL_BASE'], 'exp', exp, 'input', 'land.nc')
+
+    #Write land and topography arrays to file
+    write_land_file(filename, lons, lats, land_array, topo_array)
+    if is_experiment and filename not in exp.inputfiles:
+        exp.inputfiles.append(filename)
+
+    #Show configuration to allow checking
+    if plot:
+        plot_land(lons, lats, land_array, topo_array, filename=None if plot is True else plot)
+
+    return filename
+
+
+
+if __name__ == "__main__":
 
+    write_land('test',land_mode='continents',plot=True)
@@ -0,0 +1,256 @@
+"""Watch the disk space and throughput of an experiment as it runs.
+
+A `RunMonitor` learns how much data each run writes, from the runs already
+in the experiment's data directory and from each new run, and how long
+each run takes.  Before the data directory fills up it sends a warning,
+then, if asked to, thins the diagnostics, and finally stops the experiment
+before a run that would not fit, either there or in the working directory:
+
+    >>> from isca.monitor import RunMonitor, LogSink, FileSink, SMTPSink
+    >>> monitor = RunMonitor(exp, sinks=[LogSink(), SMTPSink('me@example.com')])
+    >>> for i in range(1, 1201):
+    ...     exp.run(i)
+
+Notifications go to any number of sinks; a sink is any object with a
+`notify(level, message)` method, where level is a `logging` level.
+"""
+from collections import namedtuple
+import datetime
+import logging
+import os
+import smtplib
+import socket
+import time
+from email.mime.text import MIMEText
+
+from isca.check_disk_space import disk_usage
+from isca.diagtable import output_frequency_hours
+from isca.loghandler import log
+from isca.retention import _year_length, format_bytes
+
+P = os.path.join
+
+DiskPrediction = namedtuple('DiskPrediction', 'path free bytes_per_run runs_left seconds_left')
+
+
+class DiskSpaceError(IOError):
+    """Raised before a run that is predicted to fill up the disk."""
+    pass
+
+
+class LogSink(object):
+    """Send notifications to a logger, by default the isca log."""
+    def __init__(self, logger=log):
+        self.logger = logger
+
+    def notify(self, level, message):
+        self.logger.log(level, message)
+
+
+class FileSink(object):
+    """Append notifications, with the time and level, to a text file."""
+    def __init__(self, filename, level=logging.WARNING):
+        self.filename = filename
+        self.level = level
+
+    def notify(self, level, message):
+        if level < self.level:
+            return
+        with open(self.filename, 'a') as f:
+            f.write('%s %s %s\n' % (datetime.datetime.now().isoformat(), logging.getLevelName(level), message))
+
+
+class SMTPSink(object):
+    """Email notifications of at least `level` through an SMTP server,
+    by default one running on the local machine.  A failure to send is
+    logged rather than raised, so a mail problem can't stop a run."""
+    def __init__(self, to_address, from_address=None, host='localhost', port=25, level=logging.WARNING):
+        self.to_address = to_address
+        self.from_address = from_address or 'isca@%s' % socket.gethostname()
+        self.host = host
+        self.port = port
+        self.level = level
+
+    def notify(self, level, message):
+        if level < self.level:
+            return
+        msg = MIMEText('This is an automated message.\n' + message)
+        msg['From'] = self.from_address
+        msg['To'] = self.to_address
+        msg['Subject'] = '[Isca-alert] %s on %s' % (message, socket.gethostname())
+        try:
+            server = smtplib.SMTP(self.host, self.port)
+            try:
+                server.sendmail(self.from_address, [self.to_address], msg.as_string())
+            finally:
+                server.quit()
+        except (OSError, smtplib.SMTPException) as e:
+            log.error('Unable to send email alert to %s: %s' % (self.to_address, e))
+
+
+def directory_size(path):
+    """Return the total size in bytes of the files under `path`."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.lstat(P(root, f)).st_size for root, _, files in os.walk(path) for f in files)
+
+
+def drop_highest_frequency_file(exp):
+    """Remove the diagnostic file written most often from the diag table of
+    `exp`.  Returns its name, or None if there is only one file left."""
+    files = exp.diag_table.files
+    if len(files) < 2:
+        return None
+    year_length = _year_length(exp)
+    name = min(files, key=lambda f: output_frequency_hours(files[f], year_length))
+    del files[name]
+    return name
+
+
+class RunMonitor(object):
+    """Monitor the disk space and throughput of Experiment `exp`.
+
+    `paths` are the directories that fill up, by default the experiment's
+    data directory and working directory.  For each, the number of runs
+    that still fit is predicted from the free space and the bytes written
+    per run, and
+        warn_runs: below this many, a warning is sent.
+        thin_runs: below this many, `thin(exp)`, if given, is called to
+                   reduce the output of the next run, e.g.
+                   thin=drop_highest_frequency_file.
+        stop_runs: below this many, the next run is stopped with DiskSpaceError.
+    The working directory only ever holds the output of the run in
+    progress, so for it the only check is that one run fits: if not, the
+    next run is stopped, or with stop_runs=0 a warning is sent.
+    `warn_free` and `stop_free` are optional absolute limits of free bytes.
+
+    The monitor attaches itself to the experiment's run events; call
+    `detach` to remove it."""
+    def __init__(self, exp, sinks=None, paths=None, warn_runs=20, thin_runs=5, stop_runs=1,
+                 warn_free=None, stop_free=None, thin=None, history_runs=5):
+        self.exp = exp
+        self.sinks = sinks if sinks is not None else [LogSink(exp.log)]
+        self.paths = paths if paths is not None else [exp.datadir, exp.workdir]
+        self.warn_runs = warn_runs
+        self.thin_runs = thin_runs
+        self.stop_runs = stop_runs
+        self.warn_free = warn_free
+        self.stop_free = stop_free
+        self.thin = thin
+        self.history_runs = history_runs
+        self.bytes_written = {}
+        self.seconds = {}
+        self._started = None
+        self._learn_from_existing_output()
+        self.attach()
+
+    def attach(self):
+        self.exp.on('run:ready', self.before_run)
+        self.exp.on('run:finished', self.after_run)
+
+    def detach(self):
+        for event, fn in (('run:ready', self.before_run), ('run:finished', self.after_run)):
+            if fn in self.exp._events[event]:
+                self.exp._events[event].remove(fn)
+
+    def notify(self, level, message):
+        for sink in self.sinks:
+            sink.notify(level, message)
+
+    def _learn_from_existing_output(self):
+        runs = []
+        while os.path.isdir(self.exp.get_outputdir(len(runs) + 1)):
+            runs.append(len(runs) + 1)
+        for run in runs[-self.history_runs:]:
+            self.bytes_written[run] = self.run_size(run)
+
+    def run_size(self, run):
+        """Return the bytes on disk of the output and restart of `run`."""
+        size = directory_size(self.exp.get_outputdir(run))
+        restart = self.exp.get_restart_file(run)
+        if os.path.exists(restart):
+            size += directory_size(restart)
+        return size
+
+    def estimated_bytes_per_run(self):
+        """Return the expected bytes written by the next run: the largest of
+        the most recent runs, or if there are none an estimate from the
+        diag table with `Experiment.estimate_output_volume`."""
+        recent = [self.bytes_written[r] for r in sorted(self.bytes_written)[-self.history_runs:]]
+        if recent:
+            return max(recent)
+        return self.exp.estimate_output_volume().total
+
+    def estimated_seconds_per_run(self):
+        recent = [self.seconds[r] for r in sorted(self.seconds)[-self.history_runs:]]
+        return sum(recent) / len(recent) if recent else None
+
+    def _is_workdir(self, path):
+        return os.path.abspath(path) == os.path.abspath(self.exp.workdir)
+
+    def predict(self, path):
+        """Return a `DiskPrediction` for the directory `path`."""
+        existing = path
+        while not os.path.exists(existing) and os.path.dirname(existing) != existing:
+            existing = os.path.dirname(existing)
+        free = disk_usage(existing).free
+        bytes_per_run = self.estimated_bytes_per_run()
+        runs_left = free // bytes_per_run if bytes_per_run else None
+        seconds_per_run = self.estimated_seconds_per_run()
+        seconds_left = runs_left * seconds_per_run if runs_left is not None and seconds_per_run else None
+        return DiskPrediction(path, free, bytes_per_run, runs_left, seconds_left)
+
+    def check(self, run):
+        """Check every path before `run`.  Returns the predictions, and
+        raises DiskSpaceError if the run should not go ahead."""
+        predictions = [self.predict(path) for path in self.paths]
+        for p in predictions:
+            if self._is_workdir(p.path):
+                # only the run in progress is kept here, so all that matters is that it fits
+                fits = p.runs_left is None or p.runs_left >= 1
+                status = '%s has %s free for the %s written by a run' % (
+                    p.path, format_bytes(p.free), format_bytes(p.bytes_per_run))
+                stop = not fits and self.stop_runs > 0
+                warn = not fits
+            else:
+                when = ''
+                if p.seconds_left is not None:
+                    when = ', about %s of running' % datetime.timedelta(seconds=int(p.seconds_left))
+                status = '%s has %s free, enough for %s more runs of %s%s' % (
+                    p.path, format_bytes(p.free), p.runs_left, format_bytes(p.bytes_per_run), when)
+                stop = p.runs_left is not None and p.runs_left < self.stop_runs
+                warn = p.runs_left is not None and p.runs_left < self.warn_runs
+            if stop or (self.stop_free is not None and p.free < self.stop_free):
+                message = 'Stopping %s before run %d: %s' % (self.exp.name, run, status)
+                self.notify(logging.CRITICAL, message)
+                raise DiskSpaceError(message)
+            elif warn or (self.warn_free is not None and p.free < self.warn_free):
+                self.notify(logging.WARNING, 'Low disk space for %s before run %d: %s' % (self.exp.name, run, status))
+            else:
+                self.exp.log.debug(status)
+        return predictions
+
+    def before_run(self, exp, run):
+        self.check(run)
+        self._started = time.time()
+
+    def after_run(self, exp, run):
+        if self._started is not None:
+            self.seconds[run] = time.time() - self._started
+            self._started = None
+        self.bytes_written[run] = self.run_size(run)
+        seconds = self.seconds.get(run)
+        if seconds:
+            self.exp.log.info('Run %d wrote %s in %.0f s (%s/s, %.2f runs per hour)' % (
+                run, format_bytes(self.bytes_written[run]), seconds,
+                format_bytes(self.bytes_written[run] / seconds), 3600. / seconds))
+
+        # the diag table for a run is written before it starts, so thin it now, ready for the next run.
+        if not self.thin:
+            return
+        predictions = [self.predict(path) for path in self.paths if not self._is_workdir(path)]
+        if any(p.runs_left is not None and p.runs_left < self.thin_runs for p in predictions):
+            dropped = self.thin(self.exp)
+            if dropped:
+                self.notify(logging.WARNING, 'Low disk space for %s after run %d: dropped diagnostic output %s'
+                            % (self.exp.name, run, dropped))
@@ -0,0 +1,198 @@
+"""Warm-pool q-flux anomalies for sweeps over the position of a warm pool.
+
+A warm pool is an elliptical bump of ocean heat flux convergence, 1 - r**2
+times its amplitude inside the ellipse, balanced so that the global
+integral of the anomaly is zero.  All the anomalies of a sweep are
+computed together, as one (pool, lat, lon) array:
+
+    >>> from isca.qflux import warmpool_sweep, derive_warmpool_experiments
+    >>> pools = warmpool_sweep(lat_centres=[0., 10., 30.], lon_centres=[165., 180., 330.])
+    >>> exps = derive_warmpool_experiments(exp, 'input/ami_qflux_ctrl_ice_4320.nc', pools)
+
+Each anomaly is added to a base seasonal q-flux and written to its own
+file, in parallel, and each file becomes the time-varying q-flux input of
+a derived Experiment.
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import os
+
+from netCDF4 import Dataset
+import numpy as np
+
+from isca.loghandler import log
+from isca.regions import wrap_longitude
+
+P = os.path.join
+
+WarmPool = namedtuple('WarmPool', 'lat_centre lon_centre lat_width lon_width amplitude')
+
+QfluxGrid = namedtuple('QfluxGrid', 'lon lat lonb latb time')
+
+# months, counting from 0, in which the anomaly is applied
+SEASON_MONTHS = {
+    'always': list(range(12)),
+    'djf': [0, 1, 11], 'mam': [2, 3, 4], 'jja': [5, 6, 7], 'son': [8, 9, 10],
+    'djf_mid': [0], 'mam_mid': [3], 'jja_mid': [6], 'son_mid': [9],
+}
+
+
+def warmpool_sweep(lat_centres, lon_centres, lat_width=7.5, lon_width=7.5, amplitude=200.):
+    """Return a list of `WarmPool`s, one for every combination of
+    `lat_centres` and `lon_centres`."""
+    return [WarmPool(lat, lon, lat_width, lon_width, amplitude)
+            for lat, lon in itertools.product(lat_centres, lon_centres)]
+
+
+def warmpool_name(pool, prefix='qflux_', season='always'):
+    """Return the file and variable name of a warm pool anomaly, e.g.
+    'qflux_lon_330_lat_10_a_200', with the season appended if not 'always'."""
+    name = '%slon_%d_lat_%d_a_%d' % (prefix, pool.lon_centre, pool.lat_centre, pool.amplitude)
+    return name if season == 'always' else '%s_%s' % (name, season)
+
+
+def cell_weights(lats, lonb, latb):
+    """Return the (lat, lon) array of the area of each grid cell on the
+    unit sphere, as cos(lat)*dlat*dlon with `lats` the latitudes of the
+    cell centres, which is how the warm pool anomalies have always been
+    balanced."""
+    dlon = np.radians(np.diff(np.asarray(lonb, dtype=np.float64)))
+    dlat = np.radians(np.diff(np.asarray(latb, dtype=np.float64)))
+    coslat = np.cos(np.radians(np.asarray(lats, dtype=np.float64)))
+    return np.abs((coslat * dlat)[:, np.newaxis] * dlon[np.newaxis, :])
+
+
+def warmpool_anomalies(pools, lonb, latb, ocean=None, shielded=False, lats=None):
+    """Return the (pool, lat, lon) array of the q-flux anomalies of the
+    `WarmPool`s `pools` on the grid with cell bounds `lonb` and `latb`.
+
+    The warm pool is evaluated at the middle of each cell, and balanced to
+    a zero integral, weighted by `cell_weights`: if `shielded` is False by
+    uniform cooling over the rest of the ocean, given by the (lat, lon)
+    array `ocean` (1 for ocean, 0 for land or sea ice; by default all
+    ocean), or if `shielded` is True by a ring of cooling around the warm
+    pool.  `lats` are the latitudes of the cell centres used for the
+    weights, by default the middle of each cell."""
+    lonb, latb = np.asarray(lonb, dtype=np.float64), np.asarray(latb, dtype=np.float64)
+    lons, mid_lats = 0.5 * (lonb[1:] + lonb[:-1]), 0.5 * (latb[1:] + latb[:-1])
+    area = cell_weights(mid_lats if lats is None else lats, lonb, latb)
+    if ocean is None:
+        ocean = np.ones_like(area)
+
+    lat_centre, lon_centre, lat_width, lon_width, amplitude = [np.array(x, dtype=np.float64)[:, np.newaxis, np.newaxis]
+                                                               for x in zip(*pools)]
+    lat = (mid_lats[np.newaxis, :, np.newaxis] - lat_centre) / lat_width
+    lon = wrap_longitude(lons[np.newaxis, np.newaxis, :], lon_centre) / lon_width
+    r2 = lat**2 + lon**2
+    warm = np.where(r2 <= 1., (1. - r2) * amplitude, 0.)
+    integral = (warm * area).sum(axis=(1, 2))
+
+    if shielded:
+        shield = np.where((r2 > 1.) & (r2 <= 2.), 1. - (np.sqrt(r2) - 1.5)**2, 0.)
+        scaling = -integral / (shield * area).sum(axis=(1, 2))
+        return warm + shield * scaling[:, np.newaxis, np.newaxis]
+
+    cooling = (ocean == 1.)[np.newaxis] & (warm == 0.)
+    cooling_value = -integral / (cooling * area).sum(axis=(1, 2))
+    return np.where(cooling, cooling_value[:, np.newaxis, np.newaxis], warm)
+
+
+def add_anomalies(base_qflux, anomalies, season='always'):
+    """Return the (pool, time, lat, lon) array of the monthly (time, lat,
+    lon) `base_qflux` plus each of the (pool, lat, lon) `anomalies`, applied
+    only in the months of `season`, one of `SEASON_MONTHS`."""
+    active = np.zeros(base_qflux.shape[0])
+    active[SEASON_MONTHS[season]] = 1.
+    return base_qflux[np.newaxis] + active[np.newaxis, :, np.newaxis, np.newaxis] * anomalies[:, np.newaxis]
+
+
+def read_base_qflux(filename, var_name=None):
+    """Return (the base q-flux array, `QfluxGrid`) from a q-flux file.
+    By default the variable has the same name as the file."""
+    if var_name is None:
+        var_name = os.path.splitext(os.path.basename(filename))[0]
+    with Dataset(filename, 'r') as dataset:
+        grid = QfluxGrid(*[dataset.variables[name][:] for name in QfluxGrid._fields])
+        return dataset.variables[var_name][:], grid
+
+
+def write_qflux_file(filename, var_name, qflux, grid, ice_mask=None):
+    """Write a time-varying q-flux file in the format the mixed layer
+    model reads, with the variable named `var_name`."""
+    with Dataset(filename, 'w', format='NETCDF3_CLASSIC') as dataset:
+        for dim, values in zip(('lat', 'lon', 'latb', 'lonb'), (grid.lat, grid.lon, grid.latb, grid.lonb)):
+            dataset.createDimension(dim, len(values))
+        dataset.createDimension('time', 0)
+
+        for name, axis, long_name, edges in (('lat', 'Y', 'latitude', 'latb'), ('lon', 'X', 'longitude', 'lonb'),
+                                             ('latb', 'Y', 'latitude edges', None), ('lonb', 'X', 'longitude edges', None)):
+            var = dataset.createVariable(name, 'f4', (name,))
+            var.units = 'degrees_N' if axis == 'Y' else 'degrees_E'
+            var.cartesian_axis = axis
+            var.long_name = long_name
+            if edges:
+                var.edges = edges
+            var[:] = getattr(grid, name)
+
+        times = dataset.createVariable('time', 'd', ('time',))
+        times.units = 'days since 0000-01-01 00:00:00.0'
+        times.calendar = 'THIRTY_DAY_MONTHS'
+        times.calendar_type = 'THIRTY_DAY_MONTHS'
+        times.cartesian_axis = 'T'
+        times[:] = grid.time
+
+        dataset.createVariable(var_name, 'f4', ('time', 'lat', 'lon'))[:] = qflux
+        if ice_mask is not None:
+            dataset.createVariable('ice_mask', 'f4', ('lat', 'lon'))[:] = ice_mask
+
+
+def write_warmpool_files(base_qflux_file, pools, outdir, ocean=None, ice_mask=None, season='always',
+                         shielded=False, prefix='qflux_', processes=None):
+    """Add the anomaly of each of `pools` to the q-flux in `base_qflux_file`
+    and write each to a file in `outdir`, named by `warmpool_name`.
+
+    `ocean` is as for `warmpool_anomalies`; if `ice_mask` is given, sea ice
+    (ice_mask == 1) is also excluded from the cooling and the mask is
+    written to each file.  Returns the list of files written."""
+    base_qflux, grid = read_base_qflux(base_qflux_file)
+    if ocean is None:
+        ocean = np.ones((len(grid.lat), len(grid.lon)))
+    if ice_mask is not None:
+        ocean = ocean * (np.asarray(ice_mask) == 0.)
+    anomalies = warmpool_anomalies(pools, grid.lonb, grid.latb, ocean=ocean, shielded=shielded, lats=grid.lat)
+    totals = add_anomalies(np.asarray(base_qflux), anomalies, season)
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    names = [warmpool_name(pool, prefix, season) for pool in pools]
+    filenames = [P(outdir, name + '.nc') for name in names]
+    with ProcessPoolExecutor(max_workers=processes) as pool_executor:
+        futures = [pool_executor.submit(write_qflux_file, filename, name, total, grid, ice_mask)
+                   for filename, name, total in zip(filenames, names, totals)]
+        for future in futures:
+            future.result()
+    log.info('Wrote %d warm pool q-flux files to %s' % (len(filenames), outdir))
+    return filenames
+
+
+def derive_warmpool_experiments(exp, base_qflux_file, pools, outdir=None, name_fmt='%s_%s', **kwargs):
+    """Write the warm pool q-flux files of `pools` with `write_warmpool_files`,
+    by default to the directory 'qflux' in `exp`'s working directory, and
+    derive an Experiment from `exp` for each, named name_fmt % (exp.name,
+    file name), that reads the file as its time-varying q-flux.
+    Returns the list of derived Experiments."""
+    if outdir is None:
+        outdir = P(exp.workdir, 'qflux')
+    exps = []
+    for filename in write_warmpool_files(base_qflux_file, pools, outdir, **kwargs):
+        name = os.path.splitext(os.path.basename(filename))[0]
+        new_exp = exp.derive(name_fmt % (exp.name, name))
+        new_exp.inputfiles.append(filename)
+        new_exp.update_namelist({'mixed_layer_nml': {
+            'load_qflux': True,
+            'time_varying_qflux': True,
+            'qflux_file_name': name,
+        }})
+        exps.append(new_exp)
+    return exps
@@ -0,0 +1,213 @@
+"""Geographic regions and the masks they make on a lon-lat grid.
+
+Masks are built with array broadcasting rather than loops over grid points,
+and are cached per (region, grid), so asking for the same mask again, for
+example once per variable or per file, costs nothing.
+
+    >>> from isca.regions import Box, Ellipse
+    >>> europe = Box(lat_range=[35., 60.], lon_range=[-10., 40.])
+    >>> mask = europe.mask(lons, lats)        # (nlat, nlon) array of 0s and 1s
+
+Longitudes wrap around, so a box from -10 to 40 degrees works on a grid
+that runs from 0 to 360.  Regions can be serialised to and from dicts or
+JSON files with `to_dict`, `region_from_dict`, `save_regions` and
+`load_regions`.
+"""
+import functools
+import json
+
+import numpy as np
+
+
+def wrap_longitude(lon, centre=0.):
+    """Return the longitude difference `lon - centre` in the range [-180, 180)."""
+    return np.mod(np.asarray(lon) - centre + 180., 360.) - 180.
+
+
+class Region(object):
+    """A region on the sphere.  Subclasses implement `_mask`, which
+    returns the mask given 2D arrays of longitude and latitude."""
+    kind = None
+
+    def mask(self, lons, lats):
+        """Return a (lat, lon) array that is 1 inside the region and 0
+        outside, or the fractional weights for regions with a taper.
+
+        `lons` and `lats` are the 1D coordinates of the grid in degrees.
+        The result is cached per grid and is read-only."""
+        lons = np.ascontiguousarray(lons, dtype=np.float64)
+        lats = np.ascontiguousarray(lats, dtype=np.float64)
+        return _cached_mask(self._key(), lons.tobytes(), lats.tobytes())
+
+    def to_dict(self):
+        """Return a JSON-serialisable description of the region."""
+        d = {'type': self.kind}
+        d.update(self._params())
+        return d
+
+    def _params(self):
+        raise NotImplementedError
+
+    def _mask(self, lon_array, lat_array):
+        raise NotImplementedError
+
+    def _key(self):
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    def __eq__(self, other):
+        return isinstance(other, Region) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        params = ', '.join('%s=%r' % kv for kv in sorted(self._params().items()))
+        return '%s(%s)' % (self.__class__.__name__, params)
+
+
+class Box(Region):
+    """A lat-lon box, with lat_range[0] <= lat < lat_range[1] and
+    lon_range[0] < lon < lon_range[1].
+
+    Longitudes wrap around, so lon_range=[-5., 27.5] and lon_range=[355., 27.5]
+    describe the same box."""
+    kind = 'box'
+
+    def __init__(self, lat_range, lon_range):
+        self.lat_range = [float(x) for x in lat_range]
+        self.lon_range = [float(x) for x in lon_range]
+
+    def _params(self):
+        return {'lat_range': self.lat_range, 'lon_range': self.lon_range}
+
+    def _mask(self, lon_array, lat_array):
+        lat_min, lat_max = self.lat_range
+        lon_min, lon_max = self.lon_range
+        if lon_max < lon_min:
+            lon_max += 360.
+        in_lat = (lat_min <= lat_array) & (lat_array < lat_max)
+        in_lon = np.zeros_like(in_lat)
+        for shift in (-360., 0., 360.):
+            in_lon |= (lon_min < lon_array + shift) & (lon_array + shift < lon_max)
+        return (in_lat & in_lon).astype(np.float64)
+
+
+class Ellipse(Region):
+    """An ellipse in lat-lon space: the points where
+    ((lat - lat_centre)/lat_width)**2 + ((lon - lon_centre)/lon_width)**2 <= 1."""
+    kind = 'ellipse'
+
+    def __init__(self, centre, widths):
+        self.centre = [float(x) for x in centre]
+        self.widths = [float(x) for x in widths]
+
+    def _params(self):
+        return {'centre': self.centre, 'widths': self.widths}
+
+    def distance_squared(self, lons, lats):
+        """Return the normalised squared distance from the centre at every
+        point of the (lat, lon) grid: less than or equal to 1 inside."""
+        lat_centre, lon_centre = self.centre
+        lat_width, lon_width = self.widths
+        lat = (np.asarray(lats, dtype=np.float64)[:, np.newaxis] - lat_centre) / lat_width
+        lon = wrap_longitude(np.asarray(lons, dtype=np.float64)[np.newaxis, :], lon_centre) / lon_width
+        return lat**2. + lon**2.
+
+    def profile(self, lons, lats):
+        """Return 1 - distance_squared inside the ellipse and 0 outside,
+        a smooth bump with a maximum of 1 at the centre."""
+        r2 = self.distance_squared(lons, lats)
+        return np.where(r2 <= 1., 1. - r2, 0.)
+
+    def _mask(self, lon_array, lat_array):
+        return (self.distance_squared(lon_array[0, :], lat_array[:, 0]) <= 1.).astype(np.float64)
+
+
+class TaperedBox(Region):
+    """A lat-lon box, lat_range[0] < lat < lat_range[1] and
+    lon_range[0] < lon < lon_range[1], that tapers to zero over
+    `taper_length` degrees outside its edges as (1 - d/taper_length)**power,
+    where d is the distance to the nearest edge."""
+    kind = 'tapered_box'
+
+    def __init__(self, lat_range, lon_range, taper_length, power=5):
+        self.lat_range = [float(x) for x in lat_range]
+        self.lon_range = [float(x) for x in lon_range]
+        self.taper_length = float(taper_length)
+        self.power = power
+
+    def _params(self):
+        return {'lat_range': self.lat_range, 'lon_range': self.lon_range,
+                'taper_length': self.taper_length, 'power': self.power}
+
+    def _mask(self, lon_array, lat_array):
+        lat_min, lat_max = self.lat_range
+        width = np.abs(self.lon_range[1] - self.lon_range[0])
+        central_lon = (self.lon_range[1] + self.lon_range[0]) / 2.
+        half_width = width / 2.
+        taper = self.taper_length
+
+        # work in longitudes relative to the centre of the box, so the box
+        # can straddle the edge of the grid.
+        lon = wrap_longitude(lon_array, central_lon)
+        lat = lat_array
+
+        in_lat = (lat_min < lat) & (lat < lat_max)
+        in_lon = (-half_width < lon) & (lon < half_width)
+        near_lat = (lat_min - taper < lat) & (lat < lat_max + taper)
+        near_lon = (-half_width - taper < lon) & (lon < half_width + taper)
+
+        with np.errstate(invalid='ignore'):
+            lat_taper = (1. - np.minimum(np.abs(lat - lat_max), np.abs(lat - lat_min)) / taper)**self.power
+            lon_taper = (1. - np.minimum(np.abs(lon - half_width), np.abs(lon + half_width)) / taper)**self.power
+
+        return np.select(
+            [in_lat & in_lon,
+             near_lat & near_lon & ~in_lat,
+             near_lon & in_lat],
+            [1.,
+             lat_taper * np.where(in_lon, 1., lon_taper),
+             lon_taper],
+            default=0.)
+
+
+REGION_TYPES = {cls.kind: cls for cls in (Box, Ellipse, TaperedBox)}
+
+
+def region_from_dict(d):
+    """Create a Region from the output of `Region.to_dict`."""
+    params = dict(d)
+    kind = params.pop('type')
+    try:
+        cls = REGION_TYPES[kind]
+    except KeyError:
+        raise ValueError('Unknown region type %r. Choose from %r' % (kind, sorted(REGION_TYPES)))
+    return cls(**params)
+
+
+def region_masks(regions, lons, lats):
+    """Return a dict of {name: mask} for a dict of {name: Region}."""
+    return {name: region.mask(lons, lats) for name, region in regions.items()}
+
+
+def save_regions(regions, filename):
+    """Write a dict of {name: Region} to a JSON file."""
+    with open(filename, 'w') as f:
+        json.dump({name: region.to_dict() for name, region in regions.items()}, f, indent=2, sort_keys=True)
+
+
+def load_regions(filename):
+    """Read a dict of {name: Region} written by `save_regions`."""
+    with open(filename) as f:
+        return {name: region_from_dict(d) for name, d in json.load(f).items()}
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_mask(region_key, lons_bytes, lats_bytes):
+    region = region_from_dict(json.loads(region_key))
+    lons = np.frombuffer(lons_bytes, dtype=np.float64)
+    lats = np.frombuffer(lats_bytes, dtype=np.float64)
+    lon_array, lat_array = np.meshgrid(lons, lats)
+    mask = region._mask(lon_array, lat_array)
+    mask.setflags(write=False)
+    return mask
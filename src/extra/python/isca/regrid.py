@@ -0,0 +1,211 @@
+"""Change the horizontal resolution of model restart files.
+
+Physical-grid fields are bilinearly interpolated between Gaussian grids
+and spectral fields are truncated or padded with zeros, so that a
+restart from one resolution can start a run at another:
+
+    >>> from isca.regrid import regrid_experiment_restart
+    >>> exp_t85 = exp.derive('my_exp_t85')
+    >>> exp_t85.set_resolution('T85')
+    >>> res = regrid_experiment_restart(exp, 10, 'T85', outfile=exp_t85.get_restart_file(0))
+    >>> exp_t85.run(1, restart_file=res)
+
+Interpolation weights are computed once per pair of grids and applied
+to every time level and model level of every variable with two small
+matrix products, one along latitude and one along longitude.
+"""
+from collections import namedtuple
+import functools
+import os
+import shutil
+import tarfile
+import tempfile
+
+from netCDF4 import Dataset
+import numpy as np
+
+from isca.grid import gaussian_grid_from_shape, grid_shape, truncation
+from isca.loghandler import log
+from isca.spectral import resize_spectral, spectral_shape
+
+P = os.path.join
+
+RegridWeights = namedtuple('RegridWeights', 'lat lon')
+
+
+def linear_weights(x_in, x_out, period=None):
+    """Return the (len(x_out), len(x_in)) matrix that linearly interpolates
+    values at increasing points `x_in` onto the points `x_out`.
+
+    If `period` is given the axis is cyclic, e.g. period=360. for longitude,
+    otherwise points outside `x_in` take the nearest edge value."""
+    x_in = np.asarray(x_in, dtype=np.float64)
+    x_out = np.asarray(x_out, dtype=np.float64)
+    n_in = len(x_in)
+    if period is not None:
+        x_ext = np.append(x_in, x_in[0] + period)
+        x = np.mod(x_out - x_in[0], period) + x_in[0]
+        lower = np.clip(np.searchsorted(x_ext, x, side='right') - 1, 0, n_in - 1)
+        upper = np.mod(lower + 1, n_in)
+        frac = (x - x_ext[lower]) / (x_ext[lower + 1] - x_ext[lower])
+    else:
+        x = np.clip(x_out, x_in[0], x_in[-1])
+        lower = np.clip(np.searchsorted(x_in, x, side='right') - 1, 0, n_in - 2)
+        upper = lower + 1
+        frac = (x - x_in[lower]) / (x_in[upper] - x_in[lower])
+    weights = np.zeros((len(x_out), n_in))
+    rows = np.arange(len(x_out))
+    np.add.at(weights, (rows, lower), 1. - frac)
+    np.add.at(weights, (rows, upper), frac)
+    return weights
+
+
+def regrid_weights(shape_in, shape_out):
+    """Return the `RegridWeights` that bilinearly interpolate from the
+    Gaussian grid with shape_in = (lat_max, lon_max) to the one with
+    shape_out.  Memoized per pair of grids; the arrays are read-only."""
+    return _regrid_weights(tuple(int(x) for x in shape_in), tuple(int(x) for x in shape_out))
+
+
+@functools.lru_cache(maxsize=None)
+def _regrid_weights(shape_in, shape_out):
+    grid_in = gaussian_grid_from_shape(*shape_in)
+    grid_out = gaussian_grid_from_shape(*shape_out)
+    weights = RegridWeights(lat=linear_weights(grid_in.lat, grid_out.lat),
+                            lon=linear_weights(grid_in.lon, grid_out.lon, period=360.))
+    for arr in weights:
+        arr.setflags(write=False)
+    return weights
+
+
+def regrid_physical(data, weights):
+    """Interpolate `data`, with (lat, lon) as its last two dimensions and
+    any number of leading dimensions, using `RegridWeights`."""
+    return np.matmul(np.matmul(weights.lat, data), weights.lon.T)
+
+
+def restart_truncation(filename):
+    """Return the triangular truncation of the netCDF restart file
+    `filename` from the shape of its spectral fields, or None if it has
+    no spectral fields."""
+    with Dataset(filename, 'r') as dataset:
+        for name, var in dataset.variables.items():
+            if name.endswith('_real') and var.ndim >= 2:
+                num_n, num_m = var.shape[-2:]
+                if num_n == num_m + 1:
+                    return num_m - 1
+    return None
+
+
+def regrid_restart_file(infile, outfile, resolution_out, resolution_in=None):
+    """Write a copy of the netCDF restart file `infile` to `outfile` at
+    `resolution_out`, e.g. 'T85'.
+
+    Variables on the (lat, lon) grid of `resolution_in` are interpolated,
+    variables on its spectral (n, m) grid are truncated or zero-padded, and
+    any other variables are copied unchanged.  Dimensions and axis
+    variables are resized to match.  If `resolution_in` is not given it is
+    found from the spectral fields of `infile`."""
+    if resolution_in is None:
+        resolution_in = restart_truncation(infile)
+        if resolution_in is None:
+            raise ValueError('%s has no spectral fields, please give resolution_in' % infile)
+    num_fourier_in, num_fourier_out = truncation(resolution_in), truncation(resolution_out)
+    shape_in, shape_out = grid_shape(num_fourier_in), grid_shape(num_fourier_out)
+    spectral_in, spectral_out = spectral_shape(num_fourier_in), spectral_shape(num_fourier_out)
+    weights = regrid_weights(shape_in, shape_out)
+
+    with Dataset(infile, 'r') as src:
+        src.set_auto_mask(False)
+
+        # decide how each variable is transformed, and so the new size of each dimension
+        kinds = {}
+        new_sizes = {name: len(dim) for name, dim in src.dimensions.items()}
+        for name, var in src.variables.items():
+            last_two = var.shape[-2:]
+            if var.ndim >= 2 and last_two == shape_in:
+                kinds[name] = 'physical'
+                new_sizes.update(zip(var.dimensions[-2:], shape_out))
+            elif var.ndim >= 2 and last_two == spectral_in and name.endswith(('_real', '_imag')):
+                kinds[name] = 'spectral'
+                new_sizes.update(zip(var.dimensions[-2:], spectral_out))
+
+        with Dataset(outfile, 'w', format=src.data_model) as dst:
+            dst.setncatts({att: src.getncattr(att) for att in src.ncattrs()})
+            for name, dim in src.dimensions.items():
+                dst.createDimension(name, None if dim.isunlimited() else new_sizes[name])
+
+            for name, var in src.variables.items():
+                attrs = {att: var.getncattr(att) for att in var.ncattrs()}
+                fill_value = attrs.pop('_FillValue', None)
+                out = dst.createVariable(name, var.dtype, var.dimensions, fill_value=fill_value)
+                out.setncatts(attrs)
+
+                kind = kinds.get(name)
+                if kind == 'physical':
+                    out[:] = regrid_physical(var[:], weights).astype(var.dtype)
+                elif kind == 'spectral':
+                    resize_spectral(var, num_fourier_out, out=out)
+                elif var.dimensions == (name,) and new_sizes[name] != len(src.dimensions[name]):
+                    # FMS restart axes are just the indices 1, 2, ... n
+                    kind = 'axis'
+                    out[:] = np.arange(1, new_sizes[name] + 1, dtype=var.dtype)
+                else:
+                    out[:] = var[:]
+                log.debug('Regridded %s:%s (%s)' % (os.path.basename(infile), name, kind or 'copied'))
+
+
+def regrid_restart_archive(archive_in, archive_out, resolution_out, resolution_in=None):
+    """Regrid every netCDF restart file in the restart archive `archive_in`
+    to `resolution_out`, writing a new archive `archive_out`.  Other files
+    in the archive are copied unchanged.
+
+    If `resolution_in` is not given it is found from the spectral fields
+    of the restart files."""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        indir, outdir = P(tmpdir, 'in'), P(tmpdir, 'out')
+        with tarfile.open(archive_in, 'r:gz') as tar:
+            tar.extractall(path=indir)
+        os.makedirs(outdir)
+        files = sorted(os.listdir(indir))
+        netcdf_files = [f for f in files if f.endswith('.nc')]
+
+        if resolution_in is None:
+            for f in netcdf_files:
+                resolution_in = restart_truncation(P(indir, f))
+                if resolution_in is not None:
+                    break
+            else:
+                raise ValueError('Unable to find the resolution of %s, please give resolution_in' % archive_in)
+
+        for f in files:
+            if f in netcdf_files:
+                regrid_restart_file(P(indir, f), P(outdir, f), resolution_out, resolution_in)
+            else:
+                shutil.copy2(P(indir, f), P(outdir, f))
+
+        outdirname = os.path.dirname(os.path.abspath(archive_out))
+        if not os.path.isdir(outdirname):
+            os.makedirs(outdirname)
+        with tarfile.open(archive_out, 'w:gz') as tar:
+            tar.add(outdir, arcname='.')
+    finally:
+        shutil.rmtree(tmpdir)
+    log.info('Regridded restart %s from T%d to T%d: %s' % (archive_in, truncation(resolution_in),
+             truncation(resolution_out), archive_out))
+    return archive_out
+
+
+def regrid_experiment_restart(exp, run, resolution_out, outfile=None):
+    """Regrid the restart archive written at the end of `run` of the
+    Experiment `exp` to `resolution_out`, e.g. 'T85'.
+
+    The input resolution is taken from the experiment's namelist, or from
+    the restart files.  Returns the path of the new archive, which by default
+    is next to the original with the resolution in its name."""
+    archive = exp.get_restart_file(run)
+    if outfile is None:
+        outfile = archive.replace('.tar.gz', '_T%d.tar.gz' % truncation(resolution_out))
+    resolution_in = exp.namelist.get('spectral_dynamics_nml', {}).get('num_fourier')
+    return regrid_restart_archive(archive, outfile, resolution_out, resolution_in)
@@ -0,0 +1,304 @@
+"""Edit model restarts in place.
+
+A restart is either a tar.gz archive, as written by `Experiment.run`, or
+a directory of restart files.  `RestartArchive` gives the path of each
+file in it, extracting only the files that are asked for, and when saved
+rewrites only the files that have changed:
+
+    >>> from isca.restart import edit_restart
+    >>> with edit_restart(exp.get_restart_file(10), 'res_perturbed.tar.gz') as res:
+    ...     with res.open_dataset('spectral_dynamics.res.nc') as ds:
+    ...         ds['vors_real'][-1, 0, 1, 1] += 1e-6
+
+Variables are changed with in-place netCDF writes, so only the values
+written touch the disk.  Unchanged members of an archive are streamed
+straight from the original archive into the new one without being
+extracted; note that a gzipped archive still has to be recompressed as a
+whole, so for repeated edits of large restarts use a directory, which is
+edited with no copying at all.
+
+A file in a restart directory that is hardlinked elsewhere, such as the
+files shared between the members of an ensemble made by `isca.ensemble`,
+is replaced with a copy of its own before it is written to, so the edit
+doesn't show up in the other links.
+"""
+from collections.abc import Mapping
+from contextlib import contextmanager
+import os
+import shutil
+import tarfile
+import tempfile
+
+from netCDF4 import Dataset
+import numpy as np
+
+from isca.loghandler import log
+
+P = os.path.join
+
+
+def _file_state(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def _unshare(path):
+    """If the file `path` has other hardlinks, replace it with a writable
+    copy of its own, so that writing to it leaves the others alone."""
+    if os.stat(path).st_nlink < 2:
+        return
+    dirname, name = os.path.split(os.path.abspath(path))
+    fd, tmpfile = tempfile.mkstemp(prefix='.%s.' % name, dir=dirname)
+    os.close(fd)
+    try:
+        shutil.copyfile(path, tmpfile)
+        os.chmod(tmpfile, 0o644)
+        os.replace(tmpfile, path)
+    except BaseException:
+        os.remove(tmpfile)
+        raise
+    log.debug('Copied hardlinked file %s before writing to it' % path)
+
+
+class RestartArchive(Mapping):
+    """A restart archive or restart directory at `path`.
+
+    Behaves as a read-only dict of {filename: local path}.  For an archive,
+    each member is extracted to `tmp_dir` (by default a new temporary
+    directory) the first time its path is asked for; for a directory, the
+    paths are those of the files themselves, so edits are made in place;
+    a hardlinked file is first replaced with a copy by `open_dataset` or
+    `mark_modified`, so write to a directory's files through those.
+
+    A member counts as modified if its size or modification time has
+    changed since it was extracted, or if it has been opened for writing
+    with `open_dataset`."""
+    def __init__(self, path, tmp_dir=None):
+        self.path = path
+        self.is_directory = os.path.isdir(path)
+        self._extracted = {}
+        self._modified = set()
+        if self.is_directory:
+            self._tar = None
+            self._infos = {}
+            self.tmp_dir = path
+            self._names = sorted(f for f in os.listdir(path) if os.path.isfile(P(path, f)))
+            for name in self._names:
+                self._extracted[name] = _file_state(P(path, name))
+        else:
+            self._tar = tarfile.open(path, 'r:gz')
+            self._members = self._tar.getmembers()
+            self._infos = {os.path.basename(ti.name): ti for ti in self._members if ti.isfile()}
+            self._names = sorted(self._infos)
+            self._own_tmp_dir = tmp_dir is None
+            if tmp_dir is None:
+                self.tmp_dir = tempfile.mkdtemp(prefix='restart_')
+            else:
+                self.tmp_dir = tmp_dir
+                if not os.path.isdir(tmp_dir):
+                    os.makedirs(tmp_dir)
+
+    def __getitem__(self, name):
+        if name not in self._names:
+            raise KeyError(name)
+        path = P(self.tmp_dir, name)
+        if name not in self._extracted:
+            src = self._tar.extractfile(self._infos[name])
+            with open(path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.utime(path, (self._infos[name].mtime, self._infos[name].mtime))
+            self._extracted[name] = _file_state(path)
+            log.debug('Extracted %s from %s' % (name, self.path))
+        return path
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def open_dataset(self, name, mode='r+'):
+        """Open the netCDF member `name` as a netCDF4 Dataset.  With the
+        default mode 'r+', values assigned to its variables are written to
+        the file in place.  Automatic masking and scaling are off, so
+        variables read and write the raw values stored in the file."""
+        path = self[name]
+        if mode != 'r':
+            self.mark_modified(name)
+        dataset = Dataset(path, mode)
+        dataset.set_auto_maskandscale(False)
+        return dataset
+
+    def mark_modified(self, name):
+        """Mark the member `name` as changed, so it is written by `save`.
+        For a directory, call this before writing to the file yourself."""
+        path = self[name]    # extract it, so there is a file to write
+        if self.is_directory:
+            _unshare(path)
+        self._modified.add(name)
+
+    def modified(self):
+        """Return the sorted names of the members that have been changed."""
+        changed = set(self._modified)
+        for name, state in self._extracted.items():
+            if _file_state(P(self.tmp_dir, name)) != state:
+                changed.add(name)
+        return sorted(changed)
+
+    def save(self, outfile=None, compresslevel=6):
+        """Write the restart, with its changes, to `outfile`, or back to
+        `path` if `outfile` is None.  Returns the path written.
+
+        For an archive only the modified members are read from disk; the
+        others are copied from the original archive as they are.  If
+        nothing has changed the archive is copied, or left alone, without
+        being recompressed.  A directory is already up to date, and is
+        written as a new archive if `outfile` is given."""
+        modified = self.modified()
+        if outfile is None:
+            outfile = self.path
+        if self.is_directory:
+            if os.path.abspath(outfile) != os.path.abspath(self.path):
+                _make_dirs_for(outfile)
+                with tarfile.open(outfile, 'w:gz', compresslevel=compresslevel) as tar:
+                    tar.add(self.path, arcname='.')
+        elif not modified:
+            if os.path.abspath(outfile) != os.path.abspath(self.path):
+                _make_dirs_for(outfile)
+                shutil.copyfile(self.path, outfile)
+        else:
+            self._write_archive(outfile, modified, compresslevel)
+        self._modified.clear()
+        for name in self._extracted:
+            self._extracted[name] = _file_state(P(self.tmp_dir, name))
+        log.info('Saved restart %s with %d modified file(s): %s' % (outfile, len(modified), ', '.join(modified)))
+        return outfile
+
+    def _write_archive(self, outfile, modified, compresslevel):
+        _make_dirs_for(outfile)
+        # write next to the destination and swap, so `outfile` can be the archive being read.
+        fd, tmpfile = tempfile.mkstemp(suffix='.tar.gz', dir=os.path.dirname(os.path.abspath(outfile)))
+        os.close(fd)
+        try:
+            with tarfile.open(tmpfile, 'w:gz', compresslevel=compresslevel) as out:
+                for info in self._members:
+                    name = os.path.basename(info.name)
+                    if info.isfile() and name in modified:
+                        new_info = out.gettarinfo(P(self.tmp_dir, name), arcname=info.name)
+                        with open(P(self.tmp_dir, name), 'rb') as f:
+                            out.addfile(new_info, f)
+                    elif info.isfile():
+                        out.addfile(info, self._tar.extractfile(info))
+                    else:
+                        out.addfile(info)
+            os.replace(tmpfile, outfile)
+        except BaseException:
+            os.remove(tmpfile)
+            raise
+        if os.path.abspath(outfile) == os.path.abspath(self.path):
+            self._tar.close()
+            self._tar = tarfile.open(self.path, 'r:gz')
+            self._members = self._tar.getmembers()
+            self._infos = {os.path.basename(ti.name): ti for ti in self._members if ti.isfile()}
+
+    def close(self):
+        """Close the archive and remove any extracted files."""
+        if self.is_directory:
+            return
+        self._tar.close()
+        if self._own_tmp_dir:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        else:
+            for name in self._extracted:
+                os.remove(P(self.tmp_dir, name))
+            try:
+                os.removedirs(self.tmp_dir)
+            except OSError:
+                pass
+        self._extracted = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        return 'RestartArchive(%r)' % self.path
+
+
+def _make_dirs_for(filename):
+    dirname = os.path.dirname(os.path.abspath(filename))
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+
+@contextmanager
+def edit_restart(path, outfile=None, tmp_dir=None, compresslevel=6):
+    """Open the restart archive or directory at `path` as a `RestartArchive`,
+    and save it to `outfile` (by default back to `path`) if the block
+    finishes without an exception."""
+    archive = RestartArchive(path, tmp_dir=tmp_dir)
+    try:
+        yield archive
+        archive.save(outfile, compresslevel=compresslevel)
+    finally:
+        archive.close()
+
+
+def _same_structure(var, old):
+    return (var.dims == old.dims and var.shape == old.shape
+            and var.dtype == old.dtype and var.attrs == old.attrs)
+
+
+@contextmanager
+def edit_dataset(filename, variables=None):
+    """Open the netCDF file `filename` as an undecoded xarray Dataset for
+    editing, and on leaving the block write back only the variables whose
+    values have changed, in place.
+
+    Variables replaced in the Dataset are always checked for changes.
+    Values edited in place are only found in the variables named in
+    `variables`, or in every variable if `variables` is None, which means
+    reading the whole file again.
+
+    Changes to the structure of the file, such as new, removed or resized
+    variables or changed attributes, can't be written in place, so in that
+    case the whole file is rewritten.  Either way a file hardlinked
+    elsewhere is replaced rather than written through the link."""
+    import xarray as xr
+
+    ds = xr.open_dataset(filename, decode_cf=False)
+    original = dict(ds.variables)
+    original_attrs = dict(ds.attrs)
+    try:
+        yield ds
+    except BaseException:
+        ds.close()
+        raise
+
+    rewrite = set(ds.variables) != set(original) or ds.attrs != original_attrs
+    rewrite = rewrite or not all(_same_structure(var, original[name]) for name, var in ds.variables.items())
+    if rewrite:
+        # we can't write to the open file, so make a temporary one and swap them once written
+        ds.to_netcdf(filename+'.swp')
+        ds.close()
+        os.replace(filename+'.swp', filename)
+        log.debug('Rewrote %s' % filename)
+        return
+
+    edited = set(ds.variables) if variables is None else set(variables)
+    candidates = {name: var.values for name, var in ds.variables.items()
+                  if var is not original[name] or name in edited}
+    ds.close()
+    with Dataset(filename, 'r') as dataset:
+        dataset.set_auto_maskandscale(False)
+        changed = sorted(name for name, values in candidates.items()
+                         if not np.array_equal(dataset.variables[name][...], values))
+    if changed:
+        _unshare(filename)
+        with Dataset(filename, 'r+') as dataset:
+            dataset.set_auto_maskandscale(False)
+            for name in changed:
+                dataset.variables[name][...] = candidates[name]
+    log.debug('Updated %s in place: %s' % (filename, ', '.join(changed) or 'no changes'))
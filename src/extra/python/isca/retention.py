@@ -0,0 +1,161 @@
+"""Decide which restart archives of an experiment to keep.
+
+A `RetentionPolicy` says which runs' restarts to keep; everything else in
+the experiment's restart directory can be deleted:
+
+    >>> from isca.retention import RetentionPolicy
+    >>> exp.restart_policy = RetentionPolicy(every=12, last=2)
+
+With a policy set, `Experiment.run` prunes the restart directory in a
+background thread after every run, so the next run doesn't wait for it,
+and logs the disk space freed.  The restart of the run that has just
+finished is always kept, as the next run starts from it, even if a later
+run's restart already exists.
+"""
+import os
+import re
+import shutil
+
+from isca.loghandler import log
+
+P = os.path.join
+
+DAYS_PER_YEAR = {'360_day': 360, 'thirty_day': 360, 'noleap': 365, 'no_leap': 365, '365_day': 365,
+                 'all_leap': 366, '366_day': 366}
+
+
+class RetentionPolicy(object):
+    """Keep the restarts of runs that are any of:
+        every: a multiple of `every`, e.g. every=12 keeps runs 12, 24, 36...
+        last: among the `last` most recent runs.
+        years: at the end of one of the model `years`, e.g. years=[1, 10],
+               given `runs_per_year`.  If `runs_per_year` isn't given it is
+               found from the length of each run in the experiment's namelist.
+        keep: in the list of run numbers `keep`.
+
+    If `keep_latest` is True, the latest restart is kept whatever the rest
+    of the policy says."""
+    def __init__(self, every=None, last=None, years=None, keep=None, runs_per_year=None, keep_latest=True):
+        self.every = every
+        self.last = last
+        self.years = sorted(years) if years is not None else None
+        self.keep = sorted(keep) if keep is not None else None
+        self.runs_per_year = runs_per_year
+        self.keep_latest = keep_latest
+
+    def runs_to_keep(self, runs, runs_per_year=None):
+        """Return the set of the run numbers `runs` whose restarts are kept."""
+        runs = sorted(runs)
+        keep = set()
+        if self.every:
+            keep.update(r for r in runs if r % self.every == 0)
+        if self.last:
+            keep.update(runs[-self.last:])
+        if self.years:
+            runs_per_year = self.runs_per_year or runs_per_year
+            if not runs_per_year:
+                raise ValueError('RetentionPolicy with years needs runs_per_year')
+            year_ends = set(int(round(y * runs_per_year)) for y in self.years)
+            keep.update(r for r in runs if r in year_ends)
+        if self.keep:
+            keep.update(r for r in runs if r in self.keep)
+        if self.keep_latest and runs:
+            keep.add(runs[-1])
+        return keep
+
+    def runs_to_delete(self, runs, runs_per_year=None):
+        """Return the sorted run numbers of `runs` whose restarts are deleted."""
+        keep = self.runs_to_keep(runs, runs_per_year)
+        return sorted(r for r in runs if r not in keep)
+
+    def __repr__(self):
+        params = ('every', 'last', 'years', 'keep', 'runs_per_year', 'keep_latest')
+        return 'RetentionPolicy(%s)' % ', '.join('%s=%r' % (p, getattr(self, p)) for p in params
+                                                 if getattr(self, p) is not None)
+
+
+def _year_length(exp):
+    return DAYS_PER_YEAR.get((exp.get_calendar() or '360_day').lower(), 365.2425)
+
+
+def run_length_days(exp):
+    """Return the length in days of each run of Experiment `exp`, from the
+    run length and calendar in its namelist."""
+    main = exp.namelist.get('main_nml', {})
+    year_length = _year_length(exp)
+    return (main.get('seconds', 0) / 86400. + main.get('minutes', 0) / 1440. + main.get('hours', 0) / 24.
+            + main.get('days', 0) + main.get('months', 0) * year_length / 12. + main.get('years', 0) * year_length)
+
+
+def experiment_runs_per_year(exp):
+    """Return the number of runs per model year of Experiment `exp`, from
+    the run length and calendar in its namelist, or None if it can't be
+    worked out."""
+    days = run_length_days(exp)
+    if days <= 0:
+        return None
+    return _year_length(exp) / days
+
+
+def restart_files(exp):
+    """Return a dict of {run number: path} of the restart archives in the
+    restart directory of Experiment `exp`."""
+    pattern = re.compile('^' + re.sub(r'%0?(\d*)d', r'(\\d+)', re.escape(exp.restartfmt)) + '$')
+    restarts = {}
+    if os.path.isdir(exp.restartdir):
+        for f in os.listdir(exp.restartdir):
+            match = pattern.match(f)
+            if match:
+                restarts[int(match.group(1))] = P(exp.restartdir, f)
+    return restarts
+
+
+def _size(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        return sum(os.lstat(P(root, f)).st_size for root, _, files in os.walk(path) for f in files)
+    return os.lstat(path).st_size
+
+
+def remove_files(paths):
+    """Delete the files or directories `paths`, skipping any that don't
+    exist.  Returns the number of bytes freed."""
+    freed = 0
+    for path in paths:
+        try:
+            size = _size(path)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+        except FileNotFoundError:
+            continue
+        freed += size
+        log.debug('Deleted %s' % path)
+    return freed
+
+
+def format_bytes(num_bytes):
+    """Return a number of bytes as a readable string, e.g. '1.5 GB'."""
+    for unit in ('B', 'kB', 'MB', 'GB', 'TB'):
+        if abs(num_bytes) < 1024. or unit == 'TB':
+            return '%.1f %s' % (num_bytes, unit) if unit != 'B' else '%d B' % num_bytes
+        num_bytes /= 1024.
+
+
+def apply_retention_policy(exp, policy=None, runs=None, current=None):
+    """Delete the restart archives of Experiment `exp` not kept by `policy`,
+    by default `exp.restart_policy`.  If `runs` is given only the restarts
+    of those runs are considered.  The restart of run `current`, e.g. the
+    run that has just finished, is always kept.
+
+    Returns (the deleted run numbers, the number of bytes freed)."""
+    policy = policy or exp.restart_policy
+    restarts = restart_files(exp)
+    if runs is not None:
+        runs = set(runs)
+        restarts = {r: path for r, path in restarts.items() if r in runs}
+    to_delete = [r for r in policy.runs_to_delete(restarts, experiment_runs_per_year(exp)) if r != current]
+    freed = remove_files(restarts[r] for r in to_delete)
+    if to_delete:
+        exp.log.info('Deleted %d restart file(s) of %s, freeing %s' % (len(to_delete), exp.name, format_bytes(freed)))
+    return to_delete, freed
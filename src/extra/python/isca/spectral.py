@@ -0,0 +1,87 @@
+"""Spectral coefficients of the model's triangular truncation.
+
+The spectral core stores coefficients in Fortran arrays dimensioned
+(0:num_fourier, 0:num_spherical) with num_spherical = num_fourier + 1,
+indexed by zonal wavenumber m and spherical index n, where the total
+wavenumber is m + n.  Coefficients with m + n > num_fourier are outside
+the triangle and are zero.  In restart files and in Python the axes are
+reversed, so the last two dimensions of a spectral variable are (n, m):
+
+    >>> from isca.spectral import spectral_shape
+    >>> spectral_shape('T42')
+    (44, 43)
+
+As the total wavenumber of index (n, m) is the same at every truncation,
+changing truncation keeps the overlapping block of indices and zeroes
+everything outside the new triangle.  The functions here work one
+(n, m) slab at a time, so `data` and `out` can be memory-mapped arrays or
+netCDF variables and are never copied into memory whole.
+"""
+import numpy as np
+
+from isca.grid import truncation
+
+
+def spectral_shape(resolution):
+    """Return the (n, m) shape of spectral fields at `resolution`, e.g. 'T42'."""
+    num_fourier = truncation(resolution)
+    return num_fourier + 2, num_fourier + 1
+
+
+def total_wavenumber(num_n, num_m):
+    """Return the (num_n, num_m) array of total wavenumbers m + n."""
+    return np.add.outer(np.arange(num_n), np.arange(num_m))
+
+
+def triangle_mask(num_n, num_m, resolution):
+    """Return a (num_n, num_m) boolean array that is True for the
+    coefficients inside the triangular truncation `resolution`."""
+    return total_wavenumber(num_n, num_m) <= truncation(resolution)
+
+
+def _slab_indices(shape):
+    # one index for every (n, m) slab, e.g. every (time, level)
+    return np.ndindex(*shape[:-2])
+
+
+def resize_spectral(data, resolution_out, out=None):
+    """Map the spectral coefficients in `data`, with (n, m) as the last two
+    dimensions, to the triangular truncation `resolution_out`, truncating
+    or padding with zeros.  Works in either direction, and mapping up and
+    back down again returns the original coefficients.
+
+    If `out` is given, e.g. a netCDF variable opened for writing, the
+    result is written into it one slab at a time; otherwise a new array is
+    returned."""
+    num_n, num_m = data.shape[-2:]
+    shape_out = spectral_shape(resolution_out)
+    full_shape = tuple(data.shape[:-2]) + shape_out
+    if out is None:
+        out = np.zeros(full_shape, dtype=data.dtype)
+    elif tuple(out.shape) != full_shape:
+        raise ValueError('out has shape %r, expected %r' % (tuple(out.shape), full_shape))
+
+    n, m = min(num_n, shape_out[0]), min(num_m, shape_out[1])
+    keep = triangle_mask(n, m, resolution_out)
+    for idx in _slab_indices(data.shape):
+        block = np.asarray(data[idx + (slice(None, n), slice(None, m))])
+        slab = np.zeros(shape_out, dtype=block.dtype)
+        slab[:n, :m] = np.where(keep, block, 0)
+        out[idx] = slab
+    return out
+
+
+def truncate_in_place(data, resolution):
+    """Zero the coefficients of `data` outside the triangular truncation
+    `resolution`, without changing its shape.  `data` can be any writable
+    array, e.g. a memory-mapped array or a netCDF variable opened with
+    mode 'r+'; it is read and written back one slab at a time."""
+    num_n, num_m = data.shape[-2:]
+    outside = ~triangle_mask(num_n, num_m, resolution)
+    if not outside.any():
+        return data
+    for idx in _slab_indices(data.shape):
+        slab = np.array(data[idx])
+        slab[..., outside] = 0
+        data[idx] = slab
+    return data
@@ -4,7 +4,6 @@ import json
 import logging
 import os
 from os.path import join as P
-import tarfile
 import sys
 
 import numpy as np
@@ -13,8 +12,10 @@ import xarray as xr
 import sh
 
 from isca import GFDL_BASE
-from isca.create_alert import disk_space_alert
 from isca.loghandler import suppress_stdout
+from isca.monitor import LogSink, RunMonitor, SMTPSink
+from isca.restart import RestartArchive, edit_dataset
+from isca.retention import RetentionPolicy, apply_retention_policy
 
 @contextmanager
 def no_context(*args, **kwargs):
@@ -73,36 +74,23 @@ def email_alerts(exp, email_address, limit=2000, cutoff=5):
     with email_alerts(exp, 'myemail@example.com'):
         ...
         exp.run(...)
-    """
-    # add a handler to ready events
-    @exp.on('run:ready')
-    def check_disk_space(exp, month):
-        dir = exp.datadir
-        disk_space_alert(exp.datadir, exp.name, month, email_address, limit, cutoff)
-    yield
-
-    exp._events.remove(check_disk_space)
 
-def keep_only_certain_restart_files(exp, max_num_files, interval=12):
+    An email is sent when there is less than `limit` GB of disk space
+    free, or too little for the next few runs, and the experiment is
+    stopped when there is less than `cutoff` GB.  The diag table is never
+    thinned.  See `isca.monitor` for more control."""
+    monitor = RunMonitor(exp, sinks=[LogSink(exp.log), SMTPSink(email_address)],
+                         warn_free=limit*1e9, stop_free=cutoff*1e9, stop_runs=0)
     try:
-    #       sh.ls(sh.glob(P(exp.workdir,'restarts','res_*.cpio'))) #TODO get max_num_files calculated in line, rather than a variable to pass.
-
-            #First defines a list of ALL the restart file numbers
-        files_to_remove=range(0,max_num_files)
-
-            #Then defines a list of the ones we want to KEEP
-        files_to_keep  =range(0,max_num_files,interval)
-
-            #Then we remove the files we want to keep from the list of all files, giving a list of those we wish to remove
-        for x in files_to_keep:
-               files_to_remove.remove(x)
-
-            #Then we remove them.
-        for entry in files_to_remove:
-                sh.rm(P(exp.workdir,'restarts','res_'+str(entry)+'.cpio'))
+        yield monitor
+    finally:
+        monitor.detach()
 
-    except sh.ErrorReturnCode_1:
-        log.warning('Tried to remove some restart files, but the last one doesnt exist')
+def keep_only_certain_restart_files(exp, max_num_files, interval=12):
+    """Of the restarts of runs 0 to max_num_files-1, keep only every
+    `interval`th one.  See `isca.retention` to do this automatically."""
+    policy = RetentionPolicy(every=interval, keep_latest=False)
+    apply_retention_policy(exp, policy, runs=range(max_num_files))
 
 def clean_datadir(exp, run, keep_files=['input.nml', 'diag_table', 'field_table', 'git_hash_used.txt']):
     """Remove the `run` directory from output data, retaining only small
@@ -120,13 +108,8 @@ def delete_all_restarts(exp, exceptions=None):
     """Remove the restart files for a given experiment except those given.
 
     e.g. remove_restarts(exp, [3,6,9,12])"""
-    if exceptions:
-        exceptions = [exp.restartfmt % i for i in exceptions]
-    all_restarts = os.listdir(exp.restartdir)
-    restarts_to_remove = [file for file in all_restarts if file not in exceptions]
-    for file in restarts_to_remove:
-        sh.rm(P(exp.restartdir, file))
-        exp.log.info('Deleted restart file %s' % file)
+    policy = RetentionPolicy(keep=exceptions or [], keep_latest=False)
+    apply_retention_policy(exp, policy)
 
 
 
@@ -177,32 +160,28 @@ def interpolate_output(infile, outfile, all_fields=True, var_names=[], p_levs =
 
 @contextmanager
 def edit_restart_archive(restart_archive, outfile='./res_edit.tar.gz', tmp_dir='./restart_edit'):
-    with tarfile.open(restart_archive, 'r:gz') as tar:
-        tar.extractall(path=tmp_dir)
-        restart_files = [os.path.join(tmp_dir, x.split('/')[-1]) for x in  tar.getnames() if x != '.']
+    """Edit the files of a restart archive, or restart directory.
+
+    Yields a dict-like `RestartArchive` of {filename: path}; each file is
+    extracted to `tmp_dir` the first time its path is looked up.  Unless
+    `outfile` is None, the restart is then written to `outfile`, and only
+    the files that have changed are read back in.  See `isca.restart`."""
+    archive = RestartArchive(restart_archive, tmp_dir=tmp_dir)
     try:
-        yield {os.path.basename(f): f for f in restart_files}
+        yield archive
         if outfile is not None:
-            with tarfile.open(outfile, 'w:gz') as out:
-                for f in restart_files:
-                    out.add(f, arcname=os.path.basename(f))
+            archive.save(outfile)
     finally:
-        for f in restart_files:
-            os.remove(f)
-        os.removedirs(tmp_dir)
+        archive.close()
 
 
 @contextmanager
-def edit_restart_file(filename):
-    ds = xr.open_dataset(filename, decode_cf=False)
-    try:
+def edit_restart_file(filename, variables=None):
+    """Edit a netCDF restart file as an undecoded xarray Dataset.  Only the
+    variables that have changed are written back, in place; name the
+    variables edited in place in `variables` to avoid rereading the others."""
+    with edit_dataset(filename, variables) as ds:
         yield ds
-    finally:
-        # we can't write to the open file, so make a temporary one and
-        # swap them once written
-        ds.to_netcdf(filename+'.swp')
-        ds.close()
-        os.rename(filename+'.swp', filename)
 
 
 def save_log(exp, filename, log_level=logging.DEBUG):
@@ -0,0 +1,180 @@
+"""Vertical coordinates of Isca's spectral core.
+
+Computes the half-level coefficients pk and bk, with half-level pressures
+p_half = pk + bk * p_surf, exactly as `vert_coordinate_mod` does for each
+`vert_coord_option` of spectral_dynamics_nml, so pressures can be
+reconstructed without opening any model output:
+
+    >>> from isca.vertical import vert_coord_from_namelist, full_level_pressures
+    >>> coord = vert_coord_from_namelist(exp)
+    >>> p_full = full_level_pressures(coord, 1e5)
+
+Coordinates are memoized per (option, num_levels, parameters) and the
+returned arrays are read-only; copy them before modifying.  As in the model,
+the levels are ordered from the top of the atmosphere to the surface.
+"""
+from collections import namedtuple
+import functools
+
+import numpy as np
+
+VerticalCoordinate = namedtuple('VerticalCoordinate', 'pk bk')
+
+VERT_COORD_OPTIONS = ('input', 'even_sigma', 'uneven_sigma', 'hybrid', 'mcm', 'v197')
+
+# defaults of the vertical coordinate parameters in spectral_dynamics_nml
+VERT_COORD_DEFAULTS = {
+    'vert_coord_option': 'even_sigma',
+    'num_levels': 18,
+    'scale_heights': 4.,
+    'surf_res': .1,
+    'exponent': 2.5,
+    'p_press': .1,
+    'p_sigma': .3,
+    'reference_sea_level_press': 101325.,
+}
+
+MCM_SIGMA = (0.0, .03, .0707, .1311, .2102, .3036, .4062, .5138, .6226, .7284, .8255, .9066, .9640, .9933, 1.0)
+
+V197_SIGMA = (0.0, .0089163, .0342936, .0740741, .1262002, .1886145, .2592592, .3360768, .4170096, .5000000,
+              .5829904, .6639231, .7407407, .8113854, .8737997, .9259259, .9657064, .9910837, 1.0)
+
+
+def even_sigma(num_levels):
+    """Return the num_levels+1 half-level sigma values evenly spaced from 0 to 1."""
+    return np.arange(num_levels + 1) / float(num_levels)
+
+
+def uneven_sigma(num_levels, scale_heights, surf_res, exponent, zero_top=True):
+    """Return the num_levels+1 half-level sigma values of the uneven sigma
+    coordinate.  `surf_res` mixes levels evenly spaced in height (1) with
+    levels spaced as zeta**exponent (0), and `scale_heights` sets the
+    height of the top level.  If `zero_top` the top level is at sigma=0."""
+    zeta = 1. - np.arange(num_levels + 1) / float(num_levels)
+    z = surf_res * zeta + (1. - surf_res) * zeta**exponent
+    b = np.exp(-z * scale_heights)
+    b[-1] = 1.
+    if zero_top:
+        b[0] = 0.
+    return b
+
+
+def transition(p, p_sigma, p_press):
+    """Return the weight of sigma in the hybrid coordinate at `p`: 0 above
+    p_press, 1 below p_sigma and varying as sin**2 in between."""
+    p = np.asarray(p, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.sin(0.5 * np.pi * (p - p_press) / (p_sigma - p_press))**2
+    return np.where(p <= p_press, 0., np.where(p >= p_sigma, 1., t))
+
+
+def compute_vert_coord(vert_coord_option, num_levels, scale_heights=4., surf_res=.1, exponent=2.5,
+                       p_press=.1, p_sigma=.3, reference_press=101325., pk=None, bk=None):
+    """Return the `VerticalCoordinate` (pk in Pa, bk) of `num_levels` full
+    levels for `vert_coord_option`, one of `VERT_COORD_OPTIONS`.
+
+    For 'input', `pk` and `bk` are the num_levels+1 values given in
+    vert_coordinate_nml.  Raises ValueError for the parameters the model
+    rejects."""
+    if pk is not None:
+        pk = tuple(float(x) for x in pk)
+    if bk is not None:
+        bk = tuple(float(x) for x in bk)
+    return _compute_vert_coord(vert_coord_option.strip(), int(num_levels), float(scale_heights), float(surf_res),
+                               float(exponent), float(p_press), float(p_sigma), float(reference_press), pk, bk)
+
+
+@functools.lru_cache(maxsize=None)
+def _compute_vert_coord(option, num_levels, scale_heights, surf_res, exponent, p_press, p_sigma,
+                        reference_press, pk, bk):
+    if option not in VERT_COORD_OPTIONS:
+        raise ValueError('"%s" is not a valid value for vert_coord_option' % option)
+    if option in ('uneven_sigma', 'hybrid'):
+        if scale_heights == 0.:
+            raise ValueError('zero is an invalid value for scale_heights')
+        if exponent == 0.:
+            raise ValueError('zero is an invalid value for exponent')
+        if surf_res <= 0. or surf_res > 1.:
+            raise ValueError('surf_res must be in (0, 1], but surf_res=%g' % surf_res)
+    if option == 'hybrid' and p_sigma < p_press:
+        raise ValueError('p_sigma must be greater than p_press, but p_sigma=%g p_press=%g' % (p_sigma, p_press))
+
+    a = np.zeros(num_levels + 1)
+    if option == 'input':
+        a, b = _input_coord(num_levels, pk, bk)
+    elif option == 'even_sigma':
+        b = even_sigma(num_levels)
+    elif option == 'uneven_sigma':
+        b = uneven_sigma(num_levels, scale_heights, surf_res, exponent)
+    elif option == 'hybrid':
+        b_sigma = uneven_sigma(num_levels, scale_heights, surf_res, exponent, zero_top=False)
+        # the pressure part uses the same profile, as pk / reference_press
+        f = transition(b_sigma, p_sigma, p_press)
+        a = reference_press * b_sigma * (1. - f)
+        b = b_sigma * f
+    else:
+        sigma = MCM_SIGMA if option == 'mcm' else V197_SIGMA
+        if num_levels != len(sigma) - 1:
+            raise ValueError('vert_coord_option "%s" needs num_levels=%d, got %d' % (option, len(sigma) - 1, num_levels))
+        b = np.array(sigma)
+
+    coord = VerticalCoordinate(a, b)
+    for arr in coord:
+        arr.setflags(write=False)
+    return coord
+
+
+def _input_coord(num_levels, pk, bk):
+    # as read_namelist in vert_coordinate_mod: missing values are zero, and
+    # the number of levels given must match num_levels.
+    a, b = np.zeros(num_levels + 2), np.zeros(num_levels + 2)
+    pk, bk = pk or (), bk or ()
+    pk, bk = pk[:num_levels + 2], bk[:num_levels + 2]
+    a[:len(pk)], b[:len(bk)] = pk, bk
+    if num_levels < 1 or a[1] + b[1] == 0.:
+        raise ValueError('No levels specified in vert_coordinate_nml')
+    if a[num_levels] + b[num_levels] == 0.:
+        raise ValueError('Not enough levels specified in vert_coordinate_nml for num_levels=%d' % num_levels)
+    if a[num_levels + 1] + b[num_levels + 1] != 0.:
+        raise ValueError('Too many levels specified in vert_coordinate_nml for num_levels=%d' % num_levels)
+    return a[:-1], b[:-1]
+
+
+def vert_coord_from_namelist(namelist):
+    """Return the `VerticalCoordinate` of an Experiment or a namelist, from
+    the settings in its spectral_dynamics_nml and vert_coordinate_nml, with
+    the model's defaults for any that aren't set."""
+    namelist = getattr(namelist, 'namelist', namelist)
+    params = dict(VERT_COORD_DEFAULTS)
+    params.update((k, v) for k, v in namelist.get('spectral_dynamics_nml', {}).items() if k in params)
+    vert_nml = namelist.get('vert_coordinate_nml', {})
+    return compute_vert_coord(params['vert_coord_option'], params['num_levels'], params['scale_heights'],
+                              params['surf_res'], params['exponent'], params['p_press'], params['p_sigma'],
+                              params['reference_sea_level_press'], pk=vert_nml.get('pk'), bk=vert_nml.get('bk'))
+
+
+def half_level_pressures(coord, p_surf):
+    """Return the half-level pressures, pk + bk * p_surf, with the level as
+    the first axis followed by the shape of `p_surf`."""
+    p_surf = np.asarray(p_surf, dtype=np.float64)
+    shape = (-1,) + (1,) * p_surf.ndim
+    return np.reshape(coord.pk, shape) + np.reshape(coord.bk, shape) * p_surf
+
+
+def p_half_to_p_full(p_half):
+    """Return the full-level pressures between the half-level pressures
+    `p_half` (level first), as the model computes them with
+    vert_difference_option = 'simmons_and_burridge'.  A top half level at
+    zero pressure gives a top full level at 1/e of the level below it."""
+    p_half = np.asarray(p_half, dtype=np.float64)
+    p_k, p_k1 = p_half[:-1], p_half[1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        alpha = 1. - p_k * (np.log(p_k1) - np.log(p_k)) / (p_k1 - p_k)
+    alpha = np.where(p_k == 0., 1., alpha)
+    return p_k1 * np.exp(-alpha)
+
+
+def full_level_pressures(coord, p_surf):
+    """Return the full-level pressures of `coord` for the surface pressure
+    `p_surf`, with the level as the first axis."""
+    return p_half_to_p_full(half_level_pressures(coord, p_surf))
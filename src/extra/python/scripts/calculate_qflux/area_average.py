@@ -1,12 +1,13 @@
 import set_and_get_params as sagp
 import numpy as np
+import xarray as xar
+from isca.regions import Box, Ellipse, region_masks
 import pdb
 
 __author__='Stephen Thomson'
 
-def area_average(dataset, variable_name, model_params, land_ocean_all='all', level=None, axis_in='time', lat_range = None):
-
-    print('performing area average on ',variable_name, 'of type ', land_ocean_all)
+def data_to_average(dataset, variable_name, model_params, level=None):
+    """Returns the field to be averaged for variable_name, which can have the prefixes hc_scaled_ or sigma_sb_."""
 
     if (variable_name[0:9]=='hc_scaled'):
         variable_name_use=variable_name[10:]
@@ -28,167 +29,146 @@ def area_average(dataset, variable_name, model_params, land_ocean_all='all', lev
     else:
         data_to_average=data_input
 
+    return data_to_average
+
+def get_grid_area(dataset, model_params):
+
     try:
         grid_area=dataset['grid_cell_area']
     except KeyError:
         sagp.get_grid_sizes(dataset,model_params)
         grid_area=dataset['grid_cell_area']
 
+    return grid_area
 
-    if(land_ocean_all == 'land'):
-        scaled_grid_area=grid_area*(dataset['land'])
-
-        multiplied=scaled_grid_area*data_to_average
-        average=multiplied.sum(('lat','lon'))/scaled_grid_area.sum(('lat','lon'))
+def area_average_mask(dataset, land_ocean_all, lat_range=None):
+    """Returns the mask (1 inside, 0 outside) for one of the named area-average options, or None if the option is not known."""
 
+    if(land_ocean_all == 'land'):
+        return dataset['land']
     elif(land_ocean_all == 'ocean'):
-        scaled_grid_area=grid_area*(1.-dataset['land'])
-
-        multiplied=scaled_grid_area*data_to_average
-        average=multiplied.sum(('lat','lon'))/scaled_grid_area.sum(('lat','lon'))
-
+        return 1.-dataset['land']
     elif(land_ocean_all == 'ocean_non_ice'):
-        scaled_grid_area=grid_area*(1.-dataset['land_ice_mask'])
-
-        multiplied=scaled_grid_area*data_to_average
-        average=multiplied.sum(('lat','lon'))/scaled_grid_area.sum(('lat','lon'))
-
+        return 1.-dataset['land_ice_mask']
     elif(land_ocean_all == 'all'):
-        multiplied=grid_area*data_to_average
-        average=multiplied.sum(('lat','lon'))/grid_area.sum(('lat','lon'))
-
+        return xar.ones_like(dataset['lat'])*xar.ones_like(dataset['lon'])
     elif(land_ocean_all == 'qflux_area'):
-        scaled_grid_area=grid_area*(dataset['qflux_area'])
-
-        multiplied=scaled_grid_area*data_to_average
-        average=multiplied.sum(('lat','lon'))/scaled_grid_area.sum(('lat','lon'))
-
+        return dataset['qflux_area']
     elif(land_ocean_all[3:] == 'eur'):
-        scaled_grid_area=grid_area*(dataset[land_ocean_all])
-
-        multiplied=scaled_grid_area*data_to_average
-        average=multiplied.sum(('lat','lon'))/scaled_grid_area.sum(('lat','lon'))
-
+        return dataset[land_ocean_all]
     elif(land_ocean_all == 'lat_range'):
-        scaled_grid_area = grid_area.where((dataset.lat > lat_range[0]) & (dataset.lat < lat_range[1]))
-        
-        multiplied = scaled_grid_area * data_to_average
-        average=multiplied.sum(('lat','lon'))/scaled_grid_area.sum(('lat','lon'))      
+        return ((dataset.lat > lat_range[0]) & (dataset.lat < lat_range[1]))*xar.ones_like(dataset['lon'])
     else:
-        print('invalid area-average option: ',land_ocean_all)
-        return
+        return None
 
-    new_var_name=variable_name+'_area_av_'+land_ocean_all
-    dataset[new_var_name]=((axis_in), average)
-    
-def european_area_av(dataset, model_params, eur_area_av_input):
+def mask_weights(dataset, model_params, masks, lat_range=None):
+    """Returns grid_area*mask for every mask, stacked along a new 'mask' dimension, together with the
+    sum of the weights over lat and lon. masks is a list of names understood by area_average_mask,
+    or a dict of {name: mask DataArray} for any other region."""
 
-    variables_list=eur_area_av_input['variables_list']
-    try:
-            levels_list  = eur_area_av_input['levels_list']
-    except KeyError:
-        levels_list  = None
+    grid_area=get_grid_area(dataset, model_params)
 
-    lats=dataset.lat
-    lons=dataset.lon
+    if not hasattr(masks, 'items'):
+        masks={name: area_average_mask(dataset, name, lat_range) for name in masks}
 
-    lon_array, lat_array = np.meshgrid(lons,lats)
+    invalid_masks=[name for name, mask in masks.items() if mask is None]
+    if invalid_masks:
+        raise ValueError('invalid area-average options: '+', '.join(invalid_masks))
 
-    idx_nw_eur =     (45. <= lat_array) & (lat_array < 60.) & (-5. < lon_array) & (lon_array < 27.5)
-    idx_nw_eur_neg = (45. <= lat_array) & (lat_array < 60.) & (np.mod(-5.,360.) < lon_array)
+    names=list(masks.keys())
+    # masks can have different dimensions, e.g. a land_ice_mask varying in time, so broadcast before stacking
+    weights=xar.concat(xar.broadcast(*[grid_area*masks[name] for name in names]), dim='mask')
+    weights.coords['mask']=('mask', names)
 
-    idx_sw_eur =     (30. <= lat_array) & (lat_array < 45.) & (-5. < lon_array) & (lon_array < 27.5)
-    idx_sw_eur_neg = (30. <= lat_array) & (lat_array < 45.) & (np.mod(-5.,360.) < lon_array)
+    return weights, weights.sum(('lat','lon'))
 
-    idx_ne_eur = (45. <= lat_array) & (lat_array < 60.) & (27.5 < lon_array) & (lon_array < 60.)
-    idx_se_eur = (30. <= lat_array) & (lat_array < 45.) & (27.5 < lon_array) & (lon_array < 60.)
+def multi_area_average(dataset, variables_list, model_params, masks=('all',), levels_list=None, lat_range=None):
+    """Computes the area average of every variable over every mask, with the mask weights and their
+    sums computed only once. Returns a Dataset with one variable per entry in variables_list and a
+    'mask' dimension. Nothing is computed until the result is loaded, and loading the whole Dataset
+    at once reads each chunk of input data only once."""
 
-    idx_all_eur =     (35. <= lat_array) & (lat_array < 60.) & (-10. < lon_array) & (lon_array < 40.)
-    idx_all_eur_neg = (35. <= lat_array) & (lat_array < 60.) & (np.mod(-10.,360.) < lon_array)
+    weights, weights_sum=mask_weights(dataset, model_params, masks, lat_range)
 
+    averages=xar.Dataset(coords={'mask': weights.coords['mask']})
 
-    land_nw_eur=np.zeros_like(dataset.land)
-    land_sw_eur=np.zeros_like(dataset.land)
+    for i, var_name in enumerate(variables_list):
+        level_in=None if levels_list is None else levels_list[i]
+        data_in=data_to_average(dataset, var_name, model_params, level=level_in)
+        # dot reduces over lat and lon for every mask without building a (mask, ...) copy of the data, and
+        # NaNs are filled with zero so they are skipped, as sum does
+        average=xar.dot(data_in.fillna(0.), weights, dim=('lat','lon'))/weights_sum
+        averages[var_name]=average.reset_coords(drop=True)
 
-    land_ne_eur=np.zeros_like(dataset.land)
-    land_se_eur=np.zeros_like(dataset.land)
-    
-    land_all_eur=np.zeros_like(dataset.land)
-    
-    land_nw_eur[idx_nw_eur]=1.0
-    land_nw_eur[idx_nw_eur_neg]=1.0
+    return averages
 
-    land_sw_eur[idx_sw_eur]=1.0
-    land_sw_eur[idx_sw_eur_neg]=1.0
+def add_area_averages(dataset, variables_list, model_params, masks=('all',), levels_list=None, lat_range=None):
+    """Computes all the area averages in one go with multi_area_average, and then adds each to dataset under the
+    same name area_average would use, e.g. flux_sw_area_av_ocean."""
 
-    land_ne_eur[idx_ne_eur]=1.0
-    land_se_eur[idx_se_eur]=1.0
+    print('performing area average on ',variables_list, 'of type ', list(masks))
 
-    land_all_eur[idx_all_eur]=1.0
-    land_all_eur[idx_all_eur_neg]=1.0
+    averages=multi_area_average(dataset, variables_list, model_params, masks=masks, levels_list=levels_list, lat_range=lat_range).load()
 
-    dataset['nw_eur']=(('lat','lon'), land_nw_eur)
-    dataset['sw_eur']=(('lat','lon'), land_sw_eur)
-    dataset['ne_eur']=(('lat','lon'), land_ne_eur)
-    dataset['se_eur']=(('lat','lon'), land_se_eur)
+    for var_name in variables_list:
+        for mask_name in averages.mask.values:
+            average=averages[var_name].sel(mask=mask_name, drop=True)
+            dataset[var_name+'_area_av_'+str(mask_name)]=(average.dims, average.data)
 
-    dataset['al_eur']=(('lat','lon'), land_all_eur)
-    
+    return averages
+
+def area_average(dataset, variable_name, model_params, land_ocean_all='all', level=None, axis_in='time', lat_range = None):
 
-    for i in range(np.shape(variables_list)[0]):
-        var_name=variables_list[i]
-        if levels_list!=None:
-            level_in=levels_list[i]
-        else:
-            level_in=None
+    print('performing area average on ',variable_name, 'of type ', land_ocean_all)
 
-        area_average(dataset, var_name, model_params, land_ocean_all='nw_eur',level=level_in)
-        area_average(dataset, var_name, model_params, land_ocean_all='sw_eur',level=level_in)
-        area_average(dataset, var_name, model_params, land_ocean_all='ne_eur',level=level_in)
-        area_average(dataset, var_name, model_params, land_ocean_all='se_eur',level=level_in)
-        area_average(dataset, var_name, model_params, land_ocean_all='al_eur',level=level_in)
+    mask=area_average_mask(dataset, land_ocean_all, lat_range)
 
-def qflux_area_av(dataset, model_params, qflux_area_av_input):
+    if mask is None:
+        print('invalid area-average option: ',land_ocean_all)
+        return
 
-    qflux_area=np.zeros_like(dataset.land)
+    averages=multi_area_average(dataset, [variable_name], model_params, masks={land_ocean_all: mask}, levels_list=[level], lat_range=lat_range)
+    average=averages[variable_name].sel(mask=land_ocean_all, drop=True)
 
-    variables_list     = qflux_area_av_input['variables_list']
+    new_var_name=variable_name+'_area_av_'+land_ocean_all
+    dataset[new_var_name]=((axis_in), average.data)
+    
+EUROPEAN_REGIONS = {
+    'nw_eur': Box(lat_range=[45., 60.], lon_range=[-5., 27.5]),
+    'sw_eur': Box(lat_range=[30., 45.], lon_range=[-5., 27.5]),
+    'ne_eur': Box(lat_range=[45., 60.], lon_range=[27.5, 60.]),
+    'se_eur': Box(lat_range=[30., 45.], lon_range=[27.5, 60.]),
+    'al_eur': Box(lat_range=[35., 60.], lon_range=[-10., 40.]),
+}
+
+def european_area_av(dataset, model_params, eur_area_av_input):
+
+    variables_list=eur_area_av_input['variables_list']
+    try:
+            levels_list  = eur_area_av_input['levels_list']
+    except KeyError:
+        levels_list  = None
 
-    warmpool_lat_centre= qflux_area_av_input['lat_centre']
-    warmpool_lon_centre= qflux_area_av_input['lon_centre']
+    masks=region_masks(EUROPEAN_REGIONS, dataset.lon.values, dataset.lat.values)
 
-    warmpool_width     = qflux_area_av_input['width']
-    warmpool_width_lon = qflux_area_av_input['width_lon']
+    for name, mask in masks.items():
+        dataset[name]=(('lat','lon'), mask.astype(dataset.land.dtype))
 
-    lats=dataset.lat
-    lons=dataset.lon
+    add_area_averages(dataset, variables_list, model_params, masks=list(EUROPEAN_REGIONS.keys()), levels_list=levels_list)
 
-    latbs=dataset.latb
-    lonbs=dataset.lonb
+def qflux_area_av(dataset, model_params, qflux_area_av_input):
 
+    variables_list     = qflux_area_av_input['variables_list']
 
-    for j in np.arange(len(lats)):
-         lat = 0.5*(latbs[j+1] + latbs[j])
-         lat = (lat-warmpool_lat_centre)/warmpool_width
-         for i in np.arange(len(lons)):
-              lon = 0.5*(lonbs[i+1] + lonbs[i])
-              lon = (lon-warmpool_lon_centre)/warmpool_width_lon
-              if( lat**2.+lon**2. <= 1.0 ):
-                  qflux_area[j,i]=1.0
+    warmpool = Ellipse(centre=[qflux_area_av_input['lat_centre'], qflux_area_av_input['lon_centre']],
+                       widths=[qflux_area_av_input['width'], qflux_area_av_input['width_lon']])
 
-    dataset['qflux_area']=(('lat','lon'), qflux_area)
+    #The mask is evaluated at the centres of the grid cells, as given by the cell bounds
+    latbs=dataset.latb.values
+    lonbs=dataset.lonb.values
+    qflux_area=warmpool.mask(0.5*(lonbs[1:]+lonbs[:-1]), 0.5*(latbs[1:]+latbs[:-1]))
 
-    for i in range(np.shape(variables_list)[0]):
-        var_name=variables_list[i]
-        original_axes_of_data = dataset[var_name].dims
-        list_of_dims = list(original_axes_of_data)
-        try:
-            list_of_dims.remove('lat')        
-            list_of_dims.remove('lon')            
-        except:
-            print('original data doesnt have lat lon as dimension - problem!')
-        tuple_of_dims = tuple(list_of_dims)
-        
-        area_average(dataset, var_name, model_params, land_ocean_all='qflux_area', axis_in = tuple_of_dims)
+    dataset['qflux_area']=(('lat','lon'), qflux_area.astype(dataset.land.dtype))
 
+    add_area_averages(dataset, variables_list, model_params, masks=['qflux_area'])
 
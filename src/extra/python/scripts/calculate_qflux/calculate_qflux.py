@@ -47,11 +47,19 @@ def qflux_calc(dataset, model_params, output_file_name, ice_file_name=None, grou
         
     io.output_nc_file(dataset,'masked_ocean_transport', model_params, output_dict)
 
-def time_gradient(data_in, delta_t):
+def time_gradient(data_in, delta_t, axis=0):
+    """Centred-difference time derivative along `axis`. Works on numpy or dask arrays, so
+    whole (time, lat, lon) fields are differentiated in one call, chunk by chunk for dask."""
 
-    data_out=np.gradient(data_in, delta_t)
+    data_out=np.gradient(data_in, delta_t, axis=axis)
 
     return data_out
+
+def combine_land_and_ice(land_array, ice_array):
+    """Land-ice mask is 1 wherever there is land or ice, keeping the dtype of the ice mask. Broadcasts
+    a (lat, lon) land mask against an ice mask that may have a leading time axis."""
+
+    return np.minimum(land_array + ice_array, 1.0).astype(ice_array.dtype, copy=False)
     
 def ice_mask_calculation(dataset, land_array, ice_file_name, dayofyear_or_months='months'):
 
@@ -78,25 +86,14 @@ def ice_mask_calculation(dataset, land_array, ice_file_name, dayofyear_or_months
             time_varying_ice = False
             print('no ice climatology')
 
-    land_ice_mask=np.zeros_like(ice_array)
-
     if time_varying_ice:
         dataset['ice_mask']=((dayofyear_or_months+'_ax','lat','lon'),ice_array)
-
-        for month_tick in range(12):
-            land_ice_mask_temp=land_array.values+dataset['ice_mask'].values[month_tick,:,:]
-            two_idx=land_ice_mask_temp>1.
-            land_ice_mask_temp[two_idx]=1.0
-            land_ice_mask[month_tick,:,:]=land_ice_mask_temp
-
+        land_ice_mask=combine_land_and_ice(np.asarray(land_array)[np.newaxis,...], dataset['ice_mask'].values)
         dataset['land_ice_mask']=((dayofyear_or_months+'_ax','lat','lon'),land_ice_mask)
 
     else:
         dataset['ice_mask']=(('lat','lon'),ice_array)
-        land_ice_mask_temp=land_array.values+dataset['ice_mask'].values
-        two_idx=land_ice_mask_temp>1.
-        land_ice_mask_temp[two_idx]=1.0
-        land_ice_mask[:,:]=land_ice_mask_temp
+        land_ice_mask=combine_land_and_ice(np.asarray(land_array), dataset['ice_mask'].values)
         dataset['land_ice_mask']=(('lat','lon'),land_ice_mask)
 
     return time_varying_ice
@@ -123,27 +120,18 @@ def upper_ocean_heat_content(dataset, model_params, time_varying_ice, dayofyear_
 #    weighted_sst_data=model_params['ocean_rho']*model_params['ocean_cp']*model_params['ml_depth']*sst_data*(1.0-dataset['land'])
     weighted_sst_data=model_params['ocean_rho']*model_params['ocean_cp']*model_params['ml_depth']*sst_clim*(1.0-dataset['land'])
 
-    shape1=np.shape(weighted_sst_data)
-
-    ny=shape1[1]
-    nx=shape1[2]
-    d_weighted_sst_data_dt=np.zeros_like(weighted_sst_data)
-
     if dayofyear_or_months=='dayofyear':
         delta_t=model_params['day_length']
     elif dayofyear_or_months=='months':
         delta_t=model_params['day_length']*30.
 
     if dayofyear_or_months!='all_time':
-        for x in range(nx):
-            for y in range(ny):
-                d_weighted_sst_data_dt[:,y,x]=time_gradient(weighted_sst_data[:,y,x], delta_t)
+        d_weighted_sst_data_dt=time_gradient(weighted_sst_data.data, delta_t, axis=0)
+    else:
+        d_weighted_sst_data_dt=np.zeros(weighted_sst_data.shape, dtype=weighted_sst_data.dtype)
 
-    for time_tick in range(shape1[0]):
-        if time_varying_ice:
-            d_weighted_sst_data_dt[time_tick,:,:]=d_weighted_sst_data_dt[time_tick,:,:]*(1.0-dataset['land_ice_mask'].values[time_tick,:,:])
-        else:
-            d_weighted_sst_data_dt[time_tick,:,:]=d_weighted_sst_data_dt[time_tick,:,:]*(1.0-dataset['land_ice_mask'].values)
+    # land_ice_mask is either (time, lat, lon) or (lat, lon), and broadcasts against the time axis either way.
+    d_weighted_sst_data_dt=(d_weighted_sst_data_dt*(1.0-dataset['land_ice_mask'].values)).astype(d_weighted_sst_data_dt.dtype, copy=False)
 
 
     if dayofyear_or_months=='dayofyear':
@@ -179,11 +167,7 @@ def net_surf_energy_flux(dataset, model_params, dayofyear_or_months='months'):
     dataset['flux_lhe_clim']=((dayofyear_or_months+'_ax','lat','lon'),flux_lhe_data)
 
 
-    aav.area_average(dataset, 'flux_sw_clim', model_params, land_ocean_all='ocean_non_ice', axis_in=dayofyear_or_months+'_ax')
-    aav.area_average(dataset, 'flux_lw_clim', model_params, land_ocean_all='ocean_non_ice', axis_in=dayofyear_or_months+'_ax')
-    aav.area_average(dataset, 'sigma_sb_sst_clim', model_params, land_ocean_all='ocean_non_ice', axis_in=dayofyear_or_months+'_ax')
-    aav.area_average(dataset, 'flux_t_clim', model_params, land_ocean_all='ocean_non_ice', axis_in=dayofyear_or_months+'_ax')
-    aav.area_average(dataset, 'flux_lhe_clim', model_params, land_ocean_all='ocean_non_ice', axis_in=dayofyear_or_months+'_ax')
+    aav.add_area_averages(dataset, ['flux_sw_clim', 'flux_lw_clim', 'sigma_sb_sst_clim', 'flux_t_clim', 'flux_lhe_clim'], model_params, masks=['ocean_non_ice'])
 
     scaling_factor_old=(((dataset['sigma_sb_sst_clim_area_av_ocean_non_ice']+dataset['flux_t_clim_area_av_ocean_non_ice']+dataset['flux_lhe_clim_area_av_ocean_non_ice']-dataset['flux_lw_clim_area_av_ocean_non_ice'])/dataset['flux_sw_clim_area_av_ocean_non_ice'])).mean(dayofyear_or_months+'_ax')
 
@@ -224,12 +208,10 @@ def regrid_in_time(dataset, groupby_name):
 
     if ocean_heat_flux_shape[0]!=12 and groupby_name=='all_time':
     
-        dataset_to_repeat = dataset['masked_ocean_transport'].load()
+        dataset_to_repeat = dataset['masked_ocean_transport'].values
         
         dataset_to_output = np.zeros((12, ocean_heat_flux_shape[1], ocean_heat_flux_shape[2]))
-        
-        for i in range(12):
-            dataset_to_output[i,...] = dataset_to_repeat
+        dataset_to_output[...] = dataset_to_repeat
         
         dataset['masked_ocean_transport'] = (('months_ax','lat','lon'), dataset_to_output)
 
@@ -10,7 +10,7 @@ from scipy import stats
 
 __author__='Stephen Thomson'
 
-def read_data( base_dir, exp_name, start_file, end_file, avg_or_daily, use_interpolated_pressure_level_data, model='fms13', file_name=None):
+def read_data( base_dir, exp_name, start_file, end_file, avg_or_daily, use_interpolated_pressure_level_data, model='fms13', file_name=None, grouping_coord_names=None):
 
     if model=='fms13':
 
@@ -91,38 +91,12 @@ def read_data( base_dir, exp_name, start_file, end_file, avg_or_daily, use_inter
         time_arr = da_3d.time
         date_arr = cal.day_number_to_date(time_arr)
 
-    da_3d.coords['dayofyear_ax'] = (('dayofyear_ax'),np.unique(date_arr.dayofyear))
-    da_3d.coords['months_ax'] = (('months_ax'),np.unique(date_arr.month))
-    da_3d.coords['seasons_ax'] = (('seasons_ax'),np.arange(4))
-    da_3d.coords['years_ax'] = (('years_ax'),date_arr.year)
-    da_3d.coords['all_time_ax'] = (('all_time_ax'),np.arange(1))
-
-    da_3d.coords['dayofyear'] = (('time'),date_arr.dayofyear)
-    da_3d.coords['months'] = (('time'),date_arr.month)
-    da_3d.coords['years'] = (('time'),date_arr.year)
-
-    seasons_arr = cal.month_to_season(date_arr.month, avg_or_daily)
-
-    da_3d.coords['seasons'] = (('time'), seasons_arr)
-
-    two_months_arr = cal.month_to_two_months(date_arr.month, avg_or_daily)
-    
-    da_3d.coords['two_months'] = (('time'),two_months_arr)
-    da_3d.coords['two_months_ax'] = (('two_months_ax'),np.unique(two_months_arr))
-
-
-
-    da_3d.coords['all_time'] = (('time'),time_arr/time_arr)
-
-    da_3d.coords['seq_months'] = (('time'),date_arr.month+12.*((date_arr.year-np.min(date_arr.year))))
-
-    da_3d.coords['seq_seasons'] = (('time'),cal.recurring_to_sequential(seasons_arr))
-    
-    da_3d.coords['seq_all_time'] = (('time'),list(range(len(time_arr))))    
-
-    da_3d.coords['seq_days'] = (('time'),cal.recurring_to_sequential(date_arr.dayofyear))
-
-    da_3d.coords['seq_seasons_ax'] = (('seq_seasons_ax'),np.mod(np.min(da_3d.seq_seasons.values),4)+np.arange(len(np.unique(da_3d.seq_seasons.values))))
+    #grouping_coord_names selects which of cal.GROUPING_COORDS to add, all of them by default
+    for name, values in cal.grouping_coords(date_arr, grouping_coord_names).items():
+        if name.endswith('_ax'):
+            da_3d.coords[name] = ((name), values)
+        else:
+            da_3d.coords[name] = (('time'), values)
 
     da_3d.attrs['exp_name']=exp_name
     da_3d.attrs['start_file']=start_file
@@ -251,7 +225,7 @@ def output_nc_file(dataset, field_name, model_params, output_dict):
         nlatb = latbs.shape[0]
         nlonb = lonbs.shape[0]
     except:
-        lons,lats,lonbs,latbs,nlon,nlat,nlonb,nlatb=cts.create_grid(output_dict['manual_grid_option'])
+        lons,lats,lonbs,latbs,nlon,nlat,nlonb,nlatb=cts.create_grid(output_dict['manual_grid_option'], model_params['res'])
 
     if output_dict['is_thd']:
         p_full,p_half,npfull,nphalf=cts.create_pressures()
@@ -1,6 +1,7 @@
 from cftime import utime
 from datetime import  datetime
 from cmip_time import FakeDT
+from isca.calendars import decode_times
 import numpy as np
 import pdb
 
@@ -14,14 +15,68 @@ def day_number_to_datetime_array(time_in, calendar_type, units_in):
 
     return date_out
 
+class CalendarDates(FakeDT):
+    """
+    Behaves like FakeDT, but the year, month, day, hour, minute and dayofyear arrays
+    are decoded directly from the numeric times with isca.calendars, rather than read
+    from one datetime object at a time. The datetime objects in .dates are only created
+    if something asks for them, e.g. by indexing with an integer.
+    """
+
+    def __init__(self, times, units='days since 0001-01-01 00:00:00', calendar='360_day', fields=None):
+
+        self.times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+        self.units = units
+        self.calendar = calendar
+        self.ndates = len(self.times)
+
+        if fields is None:
+            fields = decode_times(self.times, units, calendar)
+        self.fields = fields
+
+        self.year = fields.year
+        self.month = fields.month
+        self.day = fields.day
+        self.hour = fields.hour
+        self.minute = fields.minute
+        self.dayofyear = fields.dayofyear
+
+        self._dates = None
+
+    @property
+    def dates(self):
+        if self._dates is None:
+            self._dates = np.array(day_number_to_datetime_array(self.times, self.calendar, self.units))
+        return self._dates
+
+    @property
+    def dtype(self):
+        return type(self.dates[0])
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (list, np.ma.MaskedArray, np.ndarray)):
+            fields = type(self.fields)(*[field[idx] for field in self.fields])
+            return CalendarDates(self.times[idx], self.units, self.calendar, fields)
+        else:
+            return self.dates[idx]
+
+    def __reduce__(self):
+        return (self.__class__, (self.times, self.units, self.calendar))
+
 def day_number_to_date(time_in, calendar_type = '360_day', units_in = 'days since 0001-01-01 00:00:00'):
     """
     Aim is to make the time array have attributes like .month, or .year etc. This doesn't work with
-    normal datetime objects, so Mike's FakeDT does this for you. First step is to turn input times
-    into an array of datetime objects, and then FakeDT makes the array have the attributes of the
-    elements themselves.
+    normal datetime objects, so Mike's FakeDT does this for you. For the calendars Isca uses, the
+    attributes are calculated directly from the day numbers by CalendarDates, which is much faster
+    than making the datetime objects. Any other calendar falls back to making the array of
+    datetime objects, and then FakeDT makes the array have the attributes of the elements themselves.
     """
 
+    try:
+        return CalendarDates(time_in, units=units_in, calendar=calendar_type)
+    except ValueError:
+        pass
+
     time_in = day_number_to_datetime_array(time_in, calendar_type, units_in)
 
     cdftime = FakeDT( time_in, units=units_in,
@@ -29,53 +84,75 @@ def day_number_to_date(time_in, calendar_type = '360_day', units_in = 'days sinc
 
     return cdftime
 
-def month_to_season(months_in, avg_or_daily):
-
-    seasons=np.zeros(len(months_in))
-    idx_djf=(months_in==1)|(months_in==2)|(months_in==12)    
-    idx_mam=(months_in==3)|(months_in==4)|(months_in==5)
-    idx_jja=(months_in==6)|(months_in==7)|(months_in==8)
-    idx_son=(months_in==9)|(months_in==10)|(months_in==11)
+#Lookup tables from month (1-12) to season (DJF=0, MAM=1, JJA=2, SON=3) and two-month period (JF=0, ..., ND=5)
+SEASON_OF_MONTH = np.array([0., 0., 1., 1., 1., 2., 2., 2., 3., 3., 3., 0.])
+TWO_MONTHS_OF_MONTH = np.array([0., 0., 1., 1., 2., 2., 3., 3., 4., 4., 5., 5.])
 
-    seasons[idx_djf]=0
-    seasons[idx_mam]=1
-    seasons[idx_jja]=2
-    seasons[idx_son]=3
+def month_to_season(months_in, avg_or_daily):
 
-    return seasons
+    return SEASON_OF_MONTH[np.asarray(months_in, dtype=int)-1]
 
 
 def month_to_two_months(months_in, avg_or_daily):
 
-    two_months=np.zeros(len(months_in))
-    idx_jf=(months_in==1)|(months_in==2)
-    idx_ma=(months_in==3)|(months_in==4)
-    idx_mj=(months_in==5)|(months_in==6)
-    idx_ja=(months_in==7)|(months_in==8)
-    idx_so=(months_in==9)|(months_in==10)
-    idx_nd=(months_in==11)|(months_in==12)
-        
-    two_months[idx_jf]=0
-    two_months[idx_ma]=1
-    two_months[idx_mj]=2
-    two_months[idx_ja]=3
-    two_months[idx_so]=4
-    two_months[idx_nd]=5    
-
-    return two_months
+    return TWO_MONTHS_OF_MONTH[np.asarray(months_in, dtype=int)-1]
 
 def recurring_to_sequential(time_in):
+    """Numbers the runs of equal consecutive values in time_in 0, 1, 2..., e.g. to turn
+    the recurring day of year into a sequential day number."""
 
-    seq_time=np.zeros_like(time_in)
+    time_in = np.asarray(time_in)
+    seq_time = np.zeros_like(time_in)
 
-    for time in np.arange(len(seq_time)-1)+1:        
-        if time_in[time]!=time_in[time-1]:
-            seq_time[time]=seq_time[time-1]+1
-        else:
-            seq_time[time]=seq_time[time-1]
+    seq_time[1:] = np.cumsum(time_in[1:] != time_in[:-1])
 
     return seq_time
-        
+
+#How to make each grouping coordinate from the dates, and the coordinates already made.
+#Names ending in _ax are axes for the grouped data, all other coordinates lie along time.
+GROUPING_COORDS = {
+    'dayofyear':      lambda dates, get: dates.dayofyear,
+    'months':         lambda dates, get: dates.month,
+    'years':          lambda dates, get: dates.year,
+    'seasons':        lambda dates, get: month_to_season(get('months'), None),
+    'two_months':     lambda dates, get: month_to_two_months(get('months'), None),
+    'all_time':       lambda dates, get: np.ones(len(dates.month)),
+    'seq_months':     lambda dates, get: get('months')+12.*(get('years')-np.min(get('years'))),
+    'seq_seasons':    lambda dates, get: recurring_to_sequential(get('seasons')),
+    'seq_all_time':   lambda dates, get: np.arange(len(dates.month)),
+    'seq_days':       lambda dates, get: recurring_to_sequential(get('dayofyear')),
+    'dayofyear_ax':   lambda dates, get: np.unique(get('dayofyear')),
+    'months_ax':      lambda dates, get: np.unique(get('months')),
+    'seasons_ax':     lambda dates, get: np.arange(4),
+    'years_ax':       lambda dates, get: get('years'),
+    'all_time_ax':    lambda dates, get: np.arange(1),
+    'two_months_ax':  lambda dates, get: np.unique(get('two_months')),
+    'seq_seasons_ax': lambda dates, get: np.mod(np.min(get('seq_seasons')),4)+np.arange(len(np.unique(get('seq_seasons')))),
+}
+
+def grouping_coords(date_arr, names=None):
+    """
+    Returns a dict of {name: array} of the requested grouping coordinates (all of
+    GROUPING_COORDS by default) for date_arr, the output of day_number_to_date.
+    Each coordinate is only calculated if it is asked for, or another requested
+    coordinate needs it, and then only once.
+    """
+
+    if names is None:
+        names = list(GROUPING_COORDS.keys())
+
+    unknown = [name for name in names if name not in GROUPING_COORDS]
+    if unknown:
+        raise ValueError('unknown grouping coordinates '+', '.join(unknown))
+
+    coords = {}
+
+    def get(name):
+        if name not in coords:
+            coords[name] = GROUPING_COORDS[name](date_arr, get)
+        return coords[name]
+
+    return {name: get(name) for name in names}
 
 
 if __name__ == "__main__":
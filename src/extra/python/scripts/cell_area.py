@@ -1,44 +1,31 @@
 import numpy as np
-from netCDF4 import Dataset
 
-def cell_area_all(t_res,base_dir, radius=6376.0e3):
-    """read in grid from approriate file, and return 2D array of grid cell areas in metres**2."""
-    resolution_file = Dataset(base_dir+'src/extra/python/scripts/gfdl_grid_files/t'+str(t_res)+'.nc', 'r', format='NETCDF3_CLASSIC')
+from isca.grid import grid_metrics, cell_metrics
 
-    lons = resolution_file.variables['lon'][:]
-    lats = resolution_file.variables['lat'][:]
+def cell_area_all(t_res,base_dir=None, radius=6376.0e3):
+    """return 2D arrays of grid cell areas, x sizes and y sizes in metres for the Gaussian grid at truncation t_res.
+    base_dir is no longer needed, as the grid is calculated rather than read from gfdl_grid_files, and is kept for backwards compatibility."""
+    metrics = grid_metrics(t_res, radius)
 
-    lonb = resolution_file.variables['lonb'][:]
-    latb = resolution_file.variables['latb'][:]
+    return metrics.area.copy(), metrics.xsize.copy(), metrics.ysize.copy()
 
-    area_array,xsize_array,ysize_array = cell_area_calculate(lons, lats, lonb, latb, radius)
-
-
-    return area_array,xsize_array,ysize_array
-
-def cell_area(t_res,base_dir):
+def cell_area(t_res,base_dir=None):
     """wrapper for cell_area_all, such that cell_area only returns area array, and not xsize_array and y_size_array too."""
     area_array,xsize_array,ysize_array = cell_area_all(t_res,base_dir)
     return area_array
 
 def cell_area_calculate(lons, lats, lonb, latb, radius):
+    """return 2D (lat, lon) arrays of area, xsize and ysize in metres given the grid cell centres and bounds in degrees."""
 
-    nlon=lons.shape[0]
-    nlat=lats.shape[0]
+    area_array,xsize_array,ysize_array = cell_metrics(lons, lats, lonb, latb, radius)
 
-    area_array = np.zeros((nlat,nlon))
-    area_array_2 = np.zeros((nlat,nlon))
-    xsize_array = np.zeros((nlat,nlon))
-    ysize_array = np.zeros((nlat,nlon))
-
-    for i in np.arange(len(lons)):
-        for j in np.arange(len(lats)):
-            xsize_array[j,i] = radius*np.absolute(np.radians(lonb[i+1]-lonb[i])*np.cos(np.radians(lats[j])))
-            ysize_array[j,i] = radius*np.absolute(np.radians(latb[j+1]-latb[j]))
-            area_array[j,i] = xsize_array[j,i]*ysize_array[j,i]
-            area_array_2[j,i] = (radius**2.)*np.absolute(np.radians(lonb[i+1]-lonb[i]))*np.absolute(np.sin(np.radians(latb[j+1]))-np.sin(np.radians(latb[j])))
+    return area_array,xsize_array,ysize_array
 
-    return area_array_2,xsize_array,ysize_array
+def evenly_spaced_bounds(points):
+    """return the bounds of an evenly spaced axis, or None if the axis is not evenly spaced."""
+    delta=(points[1]-points[0])
+    if np.all((points[1:10]-points[0:9]) == delta):
+        return np.append(points - delta / 2., points[-1] + delta / 2.)
 
 def cell_area_from_xar(dataset, lat_name='lat', lon_name = 'lon', latb_name='latb', lonb_name='lonb', radius=6376.0e3):
 
@@ -49,23 +36,8 @@ def cell_area_from_xar(dataset, lat_name='lat', lon_name = 'lon', latb_name='lat
         latb = dataset[latb_name].values
         lonb = dataset[lonb_name].values
     except KeyError:
-        delta_lat=(lats[1]-lats[0])
-        if np.all((lats[1:10]-lats[0:9]) == delta_lat):
-            latb = np.zeros((len(lats)+1))
-
-            for latb_idx in range(len(lats)):
-                latb[latb_idx] = lats[latb_idx]-delta_lat / 2.
-            latb[-1] = lats[-1] + delta_lat / 2.
-
-        delta_lon=(lons[1]-lons[0])
-        if np.all((lons[1:10]-lons[0:9]) == delta_lon):
-            lonb = np.zeros((len(lons)+1))
-
-            for lonb_idx in range(len(lons)):
-                lonb[lonb_idx] = lons[lonb_idx]-delta_lon / 2.
-            lonb[-1] = lons[-1] + delta_lon / 2.  
-            
-            
+        latb = evenly_spaced_bounds(lats)
+        lonb = evenly_spaced_bounds(lons)
 
     area_array,xsize_array,ysize_array = cell_area_calculate(lons, lats, lonb, latb, radius)
 
@@ -79,8 +51,6 @@ if __name__ == "__main__":
 
     # specify resolution
     t_res = 42
-    # specify base dir
-    base_dir= '/scratch/sit204/FMS2013/GFDLmoistModel/'
     #return area_array
-    area_array=cell_area(t_res,base_dir)
+    area_array=cell_area(t_res)
 
@@ -5,6 +5,7 @@ from netCDF4 import Dataset, date2num
 import pdb
 import create_timeseries as cts
 import xarray as xar
+from isca.regions import TaperedBox
 from mpl_toolkits.basemap import shiftgrid
 import matplotlib.pyplot as plt
 
@@ -63,61 +64,17 @@ def add_sst_anomaly(sst_in, anomaly_type=None):
     return sst_with_anomaly, lons
 
 def apply_lat_lon_mask( unmasked_input, lat_range, lon_range_in, taper_length, power = 5):
+    """Multiplies unmasked_input by a box that is 1 inside lat_range and lon_range_in
+    and tapers to zero over taper_length degrees outside it. The box is centred directly
+    on lon_range_in, wrapping around the edge of the longitude grid if necessary."""
 
-    width         = np.abs(lon_range_in[1]-lon_range_in[0])
-    central_point = (lon_range_in[1]+lon_range_in[0])/2.
-    
-    lon_range = [-width/2., width/2.]
-
-    zeros_mask = xar.DataArray(np.zeros_like(unmasked_input.values), coords=unmasked_input.coords, dims=unmasked_input.dims)
-    untapered_mask = xar.DataArray(np.zeros_like(unmasked_input.values), coords=unmasked_input.coords, dims=unmasked_input.dims)
-
-    lat_array = unmasked_input.lat.values
-    lon_array = unmasked_input.lon.values
+    region = TaperedBox(lat_range, lon_range_in, taper_length, power=power)
 
-
-    for lat_tick in range(len(lat_array)):
-        
-        lat_value = lat_array[lat_tick]
-        
-        for lon_tick in range(len(lon_array)):
-            
-            lon_value = lon_array[lon_tick]
-            
-            if (lat_value < lat_range[1] and lat_value > lat_range[0]) and (lon_value < lon_range[1] and lon_value > lon_range[0]):
-                zeros_mask[:,lat_tick, lon_tick] = 1.
-                untapered_mask[:,lat_tick, lon_tick] = 1.
-                #All of those points inside the un-tapered box have the mask set to 1.
-                
-            elif (lat_value < lat_range[1]+taper_length and lat_value > lat_range[0]-taper_length) and (lon_value < lon_range[1]+taper_length and lon_value > lon_range[0]-taper_length) and not (lat_value < lat_range[1] and lat_value > lat_range[0]):    
-             
-                min_distance = np.min([np.abs(lat_value-lat_range[1]), np.abs(lat_value - lat_range[0])])
-                zeros_mask[:,lat_tick, lon_tick] = (1. -((min_distance)/(taper_length)))**power
-                #This are the points that are within the larger tapered box, but in a latitude band outside of the untapered box.
-
-                if not (lon_value < lon_range[1] and lon_value > lon_range[0]) and not (lat_value < lat_range[1] and lat_value > lat_range[0]) :
-                    min_distance = np.min([np.abs(lon_value-lon_range[1]), np.abs(lon_value - lon_range[0])])
-                    zeros_mask[:,lat_tick, lon_tick] = zeros_mask[:,lat_tick, lon_tick] * (1. -((min_distance)/(taper_length)))**power
-                    #These are the corners - so a more longitudinally restricted version of the above
-
-            elif (lon_value < lon_range[1]+taper_length and lon_value > lon_range[0]-taper_length) and (lat_value < lat_range[1] and lat_value > lat_range[0]):    
-             
-                min_distance = np.min([np.abs(lon_value-lon_range[1]), np.abs(lon_value - lon_range[0])])
-                zeros_mask[:,lat_tick, lon_tick] = (1. -((min_distance)/(taper_length)))**power
-                #The final set of points is within the larger box, but within the latitude range of the original box.
-
-
-        #Added a little extra so that it doesn't start the grid at -0.5, but rather starts it at +0.5, as in the bcs data.
-     
-    zeros_mask_shifted,lons = shiftgrid(-180.-central_point+0.5, zeros_mask, zeros_mask.lon.values)                    
-    untapered_mask_shifted ,lons = shiftgrid(-180.-central_point+0.5, untapered_mask, untapered_mask.lon.values)                    
- 
-    final_mask = xar.DataArray(zeros_mask_shifted, coords=unmasked_input.coords, dims=unmasked_input.dims)
-    final_untapered_mask = xar.DataArray(untapered_mask_shifted, coords=unmasked_input.coords, dims=unmasked_input.dims)
+    mask = region.mask(unmasked_input.lon.values, unmasked_input.lat.values)
+    final_mask = xar.DataArray(mask, coords=[unmasked_input.lat, unmasked_input.lon], dims=['lat', 'lon'])
 
     masked_sst = unmasked_input * final_mask
 
-
     return masked_sst
 
 
@@ -15,11 +15,12 @@ num_years=100
 time_spacing=num_years
 
 time_arr,day_number,ntime,time_units, time_bounds=cts.create_time_arr(num_years,is_climatology, time_spacing)
-#create time series based on times
-co2 = np.zeros((ntime, npfull, nlat, nlon))
-
-for tick in np.arange(0,len(day_number)):
-    co2[tick,...] = 300.*(1.01**(day_number[tick]/360.)) #Some scenario in dimensionless units. 1.e-6 is to convert from ppmv. 
+#create time series based on times, one time at a time so that the whole array is never held in memory
+def co2_slabs():
+    for tick in np.arange(0,len(day_number)):
+        co2 = np.zeros((1, npfull, nlat, nlon))
+        co2[0,...] = 300.*(1.01**(day_number[tick]/360.)) #Some scenario in dimensionless units. 1.e-6 is to convert from ppmv. 
+        yield co2
 
 #Output it to a netcdf file. 
 file_name='co2_test_new_routine_2.nc'
@@ -34,7 +35,7 @@ number_dict['npfull']=npfull
 number_dict['nphalf']=nphalf
 number_dict['ntime']=ntime
 
-cts.output_to_file(co2,lats,lons,latbs,lonbs,p_full,p_half,time_arr,time_units,file_name,variable_name,number_dict)
+cts.output_to_file(co2_slabs(),lats,lons,latbs,lonbs,p_full,p_half,time_arr,time_units,file_name,variable_name,number_dict)
 
 
 
@@ -2,13 +2,15 @@
 import numpy as np
 from calendar_calc import day_number_to_date
 from netCDF4 import Dataset, date2num
+from isca.calendars import parse_units
+from isca.grid import gaussian_grid
 import sys
 import pdb
 import os
 
 __author__='Stephen Thomson'
 
-def create_grid(manual_grid_option):
+def create_grid(manual_grid_option, t_res=42):
 
     if(manual_grid_option):
 
@@ -25,21 +27,7 @@ def create_grid(manual_grid_option):
         nlatb=len(latbs)
 
     else:
-        t_res=42
-
-        try:
-            GFDL_BASE        = os.environ['GFDL_BASE']
-        except Exception as e:
-            print('Environment variable GFDL_BASE must be set')
-            exit(0)
-
-        resolution_file = Dataset(GFDL_BASE+'/src/extra/python/scripts/gfdl_grid_files/t'+str(t_res)+'.nc', 'r', format='NETCDF3_CLASSIC')
-
-        lons = resolution_file.variables['lon'][:]
-        lats = resolution_file.variables['lat'][:]
-
-        lonbs = resolution_file.variables['lonb'][:]
-        latbs = resolution_file.variables['latb'][:]
+        lons, lats, lonbs, latbs = gaussian_grid(t_res)
 
         nlon=lons.shape[0]
         nlat=lats.shape[0]
@@ -107,9 +95,53 @@ def create_time_arr(num_years,is_climatology,time_spacing):
     return time_arr,day_number,ntime,time_units,time_bounds
 
 
-def output_to_file(data,lats,lons,latbs,lonbs,p_full,p_half,time_arr,time_units,file_name,variable_name,number_dict, time_bounds=None):
+#Names of the calendars in the calendar attribute that FMS reads from input files
+FMS_CALENDAR_NAMES = {'360_day': 'THIRTY_DAY_MONTHS', 'thirty_day': 'THIRTY_DAY_MONTHS',
+                      'noleap': 'NOLEAP', 'no_leap': 'NOLEAP', '365_day': 'NOLEAP',
+                      'julian': 'JULIAN', 'gregorian': 'GREGORIAN', 'standard': 'GREGORIAN',
+                      'proleptic_gregorian': 'GREGORIAN'}
+
+
+def time_slabs(data, slab_length=1):
+    """Yields data in slabs of slab_length along the first (time) axis. Works for
+    memory-mapped netcdf variables and dask arrays, as only one slab is read at a time."""
+
+    for start in range(0, data.shape[0], slab_length):
+        yield data[start:start+slab_length]
+
+
+def time_values(time_arr, calendar='360_day'):
+    """Returns the numeric times to write to file for time_arr, which can be numbers,
+    the output of day_number_to_date, or an array of datetime objects."""
+
+    units='days since 0001-01-01 00:00:00.0'
+
+    if hasattr(time_arr, 'times') and time_arr.calendar==calendar and parse_units(time_arr.units)==parse_units(units):
+        #day_number_to_date output already holds the day numbers, so there is no need to convert its dates back
+        return time_arr.times
+    elif type(time_arr[0])!=np.float64 and type(time_arr[0])!=np.int64 :
+        return date2num(getattr(time_arr, 'dates', time_arr),units=units,calendar=calendar)
+    else:
+        return np.asarray(time_arr)
 
-    output_file = Dataset(file_name, 'w', format='NETCDF3_CLASSIC')
+
+def output_to_file(data,lats,lons,latbs,lonbs,p_full,p_half,time_arr,time_units,file_name,variable_name,number_dict, time_bounds=None,
+                   calendar='360_day', file_format='NETCDF3_CLASSIC', zlib=False, complevel=4, chunksizes=None):
+    """
+    Writes variable_name to a forcing file that Isca can read. data can be the whole
+    (time, [pfull,] lat, lon) array, or any iterable of slabs of consecutive times, e.g.
+    a generator, or time_slabs(data). Each slab is appended along the unlimited time
+    dimension as it arrives, so only one slab need be held in memory at once.
+
+    zlib, complevel and chunksizes are passed to netCDF4 to compress the variable, and
+    need a NETCDF4 file_format. calendar is used to set the calendar attribute of the
+    time axis, and to convert time_arr if it is an array of datetime objects.
+    """
+
+    if (zlib or chunksizes is not None) and not file_format.startswith('NETCDF4'):
+        raise ValueError('compression and chunking need a NETCDF4 file_format, not '+file_format)
+
+    output_file = Dataset(file_name, 'w', format=file_format)
 
     if p_full is None:
         is_thd=False
@@ -181,8 +213,8 @@ def output_to_file(data,lats,lons,latbs,lonbs,p_full,p_half,time_arr,time_units,
 
 
     times.units = time_units
-    times.calendar = 'THIRTY_DAY_MONTHS'
-    times.calendar_type = 'THIRTY_DAY_MONTHS'
+    times.calendar = FMS_CALENDAR_NAMES.get(calendar.lower(), calendar.upper())
+    times.calendar_type = times.calendar
     times.cartesian_axis = 'T'
 
     if time_bounds is not None:
@@ -194,15 +226,15 @@ def output_to_file(data,lats,lons,latbs,lonbs,p_full,p_half,time_arr,time_units,
 
         time_bounds_file.long_name = 'time axis boundaries'
         time_bounds_file.units     = time_units
-        time_bounds_file[:] = time_bounds
 
         times.bounds = 'time_bounds'
 
-
     if is_thd:
-        output_array_netcdf = output_file.createVariable(variable_name,'f4',('time','pfull', 'lat','lon',))
+        dimensions = ('time','pfull', 'lat','lon',)
     else:
-        output_array_netcdf = output_file.createVariable(variable_name,'f4',('time','lat','lon',))
+        dimensions = ('time','lat','lon',)
+
+    output_array_netcdf = output_file.createVariable(variable_name,'f4',dimensions, zlib=zlib, complevel=complevel, chunksizes=chunksizes)
 
     latitudes[:] = lats
     longitudes[:] = lons
@@ -216,14 +248,31 @@ def output_to_file(data,lats,lons,latbs,lonbs,p_full,p_half,time_arr,time_units,
         pfulls[:]     = p_full
         phalfs[:]     = p_half
 
-    if type(time_arr[0])!=np.float64 and type(time_arr[0])!=np.int64 :
-        times[:]     = date2num(time_arr,units='days since 0001-01-01 00:00:00.0',calendar='360_day')
-    else:
-        times[:]     = time_arr
-
-    output_array_netcdf[:] = data
-
-    output_file.close()
-
-
+    all_times = time_values(time_arr, calendar)
+
+    if isinstance(data, np.ndarray):
+        data = [data]
+    elif hasattr(data, 'shape'):
+        #e.g. dask arrays or netcdf variables, which are read one time at a time
+        data = time_slabs(data)
+
+    time_index = 0
+    try:
+        for slab in data:
+            slab_length = slab.shape[0]
+            end_index = time_index+slab_length
+            if end_index > len(all_times):
+                raise ValueError('more time slabs of data than the %d times in time_arr' % len(all_times))
+
+            times[time_index:end_index] = all_times[time_index:end_index]
+            if time_bounds is not None:
+                time_bounds_file[time_index:end_index] = time_bounds[time_index:end_index]
+            output_array_netcdf[time_index:end_index] = np.asarray(slab)
+
+            time_index = end_index
+    finally:
+        output_file.close()
+
+    if time_index != len(all_times):
+        print('Warning: only %d of the %d times in time_arr were written to %s' % (time_index, len(all_times), file_name))
 
@@ -5,6 +5,33 @@ import matplotlib.pyplot as plt
 import create_timeseries as cts
 
 
+#The matrix A in Ax=b with recurring entries of 0.125, 0.75, 0.125, wrapping around from December to January
+MONTHLY_MEANS_MATRIX = 0.75*np.eye(12) + 0.125*np.roll(np.eye(12), 1, axis=1) + 0.125*np.roll(np.eye(12), -1, axis=1)
+
+#A is the same for every column of data, so it only needs inverting once
+MONTHLY_MEANS_INVERSE = np.linalg.inv(MONTHLY_MEANS_MATRIX)
+
+def preserve_monthly_means(data, axis=0):
+	"""
+	Returns the mid-month values x, which when linearly interpolated reproduce the monthly means b in data,
+	by solving Ax=b for every column of data along axis, which must have length 12. data can have any other
+	dimensions, and can be a numpy array, a dask array, or an xarray DataArray, in which case axis can also be
+	the name of the dimension. All the columns are solved at once with a single matrix multiplication, and
+	dask arrays are solved chunk by chunk.
+	"""
+
+	if isinstance(data, xar.DataArray):
+		dim = axis if isinstance(axis, str) else data.dims[axis]
+		return xar.apply_ufunc(preserve_monthly_means, data, input_core_dims=[[dim]], output_core_dims=[[dim]],
+		                       kwargs={'axis': -1}, dask='allowed', keep_attrs=True).transpose(*data.dims)
+
+	if data.shape[axis] != 12:
+		raise ValueError('monthly means must have 12 months along axis %d, not %d' % (axis, data.shape[axis]))
+
+	solution = np.moveaxis(data, axis, -1) @ MONTHLY_MEANS_INVERSE.T
+
+	return np.moveaxis(solution, -1, axis)
+
 def adjust_data(input_data):
 	""" 
 	adjust_data solves the matrix problem Ax=b, where A is a matrix with recurring entries of 0.125, 0.75, 0.125,
@@ -14,45 +41,16 @@ def adjust_data(input_data):
 	http://www-pcmdi.llnl.gov/projects/amip/AMIP2EXPDSN/BCS/amip2bcs.php.
 	"""
 
-	multiply_matrix=np.asarray([
-	[0.75, 0.125, 0.,   0.,   0.,   0.,   0.,   0.,   0.,   0.,   0.,   0.125],
-	[0.125,0.75,  0.125,0.,   0.,   0.,   0.,   0.,   0.,   0.,   0.,   0.   ],
-	[0.,   0.125, 0.75, 0.125,0.,   0.,   0.,   0.,   0.,   0.,   0.,   0.   ],
-	[0.,   0.,    0.125,0.75, 0.125,0.,   0.,   0.,   0.,   0.,   0.,   0.   ],
-	[0.,   0.,    0.,   0.125,0.75, 0.125,0.,   0.,   0.,   0.,   0.,   0.   ],
-	[0.,   0.,    0.,   0.,   0.125,0.75, 0.125,0.,   0.,   0.,   0.,   0.   ],
-	[0.,   0.,    0.,   0.,   0.,   0.125,0.75, 0.125,0.,   0.,   0.,   0.   ],
-	[0.,   0.,    0.,   0.,   0.,   0.,   0.125,0.75, 0.125,0.,   0.,   0.   ],
-	[0.,   0.,    0.,   0.,   0.,   0.,   0.,   0.125,0.75, 0.125,0.,   0.   ],
-	[0.,   0.,    0.,   0.,   0.,   0.,   0.,   0.,   0.125,0.75, 0.125,0.   ],
-	[0.,   0.,    0.,   0.,   0.,   0.,   0.,   0.,   0.,   0.125,0.75, 0.125],
-	[0.125,0.,    0.,   0.,   0.,   0.,   0.,   0.,   0.,   0.,   0.125,0.75 ]
-	])
-
-	real_monthly_means = input_data
-
-	solution = np.linalg.solve(multiply_matrix, real_monthly_means)
-
-	return solution
+	return preserve_monthly_means(np.asarray(input_data), axis=0)
 
 def perform_adj(data_array):
 	"""
-	Function for looping over spatial points in data array.
+	Function for adjusting every spatial point in data array, with time as the first axis.
 	"""
 
-	output_array=np.zeros_like(data_array)
-
-	nt, ny, nx = np.shape(data_array)
-
-	for j in range(ny):
-		print(j)
-
-		for i in range(nx):
-			output_array[:,j,i] = adjust_data(data_array[:,j,i])
-
-	return output_array
+	return preserve_monthly_means(data_array, axis=0)
 
-def output_to_file(dataset, output_array, output_filename, variable_name):
+def output_to_file(dataset, output_array, output_file_name, variable_name):
 	"""
 	Simple function for outputting adjusted data as a netcdf file.
 	"""
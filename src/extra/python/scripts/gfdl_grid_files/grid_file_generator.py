@@ -1,43 +1,51 @@
-import numpy as np
+"""Write a grid file (lon, lat, lonb, latb) for any triangular truncation.
+
+The grid is generated from the Gaussian latitudes by `isca.grid.gaussian_grid`,
+so no model output is needed, e.g.
+    $ python grid_file_generator.py 85
+writes t85.nc. Note that the isca python tools no longer need these files."""
+import sys
 from netCDF4 import Dataset
-import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
 
-# specify resolution
-t_res = 42
+from isca.grid import gaussian_grid
+
+def write_grid_file(t_res, file_name=None):
+
+    if file_name is None:
+        file_name = 't'+str(t_res)+'.nc'
 
-#read in grid from approriate file
-resolution_file = Dataset('t'+str(t_res)+'_atmos_daily.nc', 'r', format='NETCDF3_CLASSIC')
+    lons, lats, lonsb, latsb = gaussian_grid(t_res)
 
-lons = resolution_file.variables['lon'][:]
-lats = resolution_file.variables['lat'][:]
+    nlon=lons.shape[0]
+    nlat=lats.shape[0]
 
-lonsb = resolution_file.variables['lonb'][:]
-latsb = resolution_file.variables['latb'][:]
+    nlonb=lonsb.shape[0]
+    nlatb=latsb.shape[0]
 
-nlon=lons.shape[0]
-nlat=lats.shape[0]
+    output_file = Dataset(file_name, 'w', format='NETCDF3_CLASSIC')
 
-nlonb=lonsb.shape[0]
-nlatb=latsb.shape[0]
+    lat = output_file.createDimension('lat', nlat)
+    lon = output_file.createDimension('lon', nlon)
+    latb = output_file.createDimension('latb', nlatb)
+    lonb = output_file.createDimension('lonb', nlonb)
 
+    latitudes = output_file.createVariable('lat','f4',('lat',))
+    longitudes = output_file.createVariable('lon','f4',('lon',))
+    latitudesb = output_file.createVariable('latb','f4',('latb',))
+    longitudesb = output_file.createVariable('lonb','f4',('lonb',))
 
-output_file = Dataset('t'+str(t_res)+'.nc', 'w', format='NETCDF3_CLASSIC')
+    latitudes[:] = lats
+    longitudes[:] = lons
+    latitudesb[:] = latsb
+    longitudesb[:] = lonsb
 
-lat = output_file.createDimension('lat', nlat)
-lon = output_file.createDimension('lon', nlon)
-latb = output_file.createDimension('latb', nlatb)
-lonb = output_file.createDimension('lonb', nlonb)
+    output_file.close()
 
-latitudes = output_file.createVariable('lat','f4',('lat',))
-longitudes = output_file.createVariable('lon','f4',('lon',))
-latitudesb = output_file.createVariable('latb','f4',('latb',))
-longitudesb = output_file.createVariable('lonb','f4',('lonb',))
+    return file_name
 
-latitudes[:] = lats
-longitudes[:] = lons
-latitudesb[:] = latsb
-longitudesb[:] = lonsb
+if __name__ == "__main__":
 
+    # specify resolution
+    t_res = int(sys.argv[1]) if len(sys.argv) > 1 else 42
 
-output_file.close()
+    write_grid_file(t_res)
@@ -1,7 +1,8 @@
-import sh
 import os
 import pdb
 
+from isca.retention import RetentionPolicy, remove_files, format_bytes
+
 P = os.path.join
 
 class temporary_exp_object(object):
@@ -10,6 +11,8 @@ class temporary_exp_object(object):
         self.workdir = workdir
         self.datadir = datadir
         self.expname = exp_name
+        self.restartdir = P(datadir, exp_name, 'restarts')
+        self.restartfmt = 'res%04d.tar.gz'
 
 
 def create_exp_object(exp_name):
@@ -24,76 +27,28 @@ def create_exp_object(exp_name):
     return exp_object
 
 
-def keep_only_certain_restart_files(exp_object, max_num_files, interval=12):
-
-    #        sh.ls(sh.glob(P(self.workdir,'restarts','res_*.cpio'))) #TODO get max_num_files calculated in line, rather than a variable to pass.
-
-            #First defines a list of ALL the restart file numbers
-        files_to_remove=list(range(0,max_num_files))
+def remove_run_files(exp_object, max_num_files, interval, path_fn):
+    """Of runs 0 to max_num_files-1, remove the file path_fn(run) of every run except every `interval`th one.
+    If interval is None the files of all the runs are removed."""
 
-            #Then defines a list of the ones we want to KEEP
-        files_to_keep  =list(range(0,max_num_files,interval)) 
+    policy = RetentionPolicy(every=interval, keep_latest=False)
+    runs_to_remove = policy.runs_to_delete(range(max_num_files))
+    paths = [path_fn(run) for run in runs_to_remove]
+    freed = remove_files(paths)
+    print('Removed up to %d files from %s, freeing %s' % (len(paths), exp_object.expname, format_bytes(freed)))
 
-            #Then we remove the files we want to keep from the list of all files, giving a list of those we wish to remove
-        for x in files_to_keep:
-               files_to_remove.remove(x) 
 
-            #Then we remove them.
-        for entry in files_to_remove:
-            try:
-                sh.rm(P(exp_object.workdir,exp_object.expname,'restarts','res_'+str(entry)+'.cpio'))
-#                 print P(exp_object.workdir,exp_object.expname,'restarts','res_'+str(entry)+'.cpio')
+def keep_only_certain_restart_files(exp_object, max_num_files, interval=12):
 
-            except sh.ErrorReturnCode_1:
-                pass
-#                 print 'Tried to remove some restart files, but number '+str(entry)+' does not exist'
+    remove_run_files(exp_object, max_num_files, interval, lambda run: P(exp_object.restartdir, exp_object.restartfmt % run))
                 
 def keep_only_certain_restart_files_data_dir(exp_object, max_num_files, interval=12):
 
-    #        sh.ls(sh.glob(P(self.workdir,'restarts','res_*.cpio'))) #TODO get max_num_files calculated in line, rather than a variable to pass.
-
-            #First defines a list of ALL the restart file numbers
-        files_to_remove=list(range(0,max_num_files))
-
-            #Then defines a list of the ones we want to KEEP
-        files_to_keep  =list(range(0,max_num_files,interval)) 
-
-            #Then we remove the files we want to keep from the list of all files, giving a list of those we wish to remove
-        for x in files_to_keep:
-               files_to_remove.remove(x) 
-
-            #Then we remove them.
-        for entry in files_to_remove:
-            try:
-                sh.rm(P(exp_object.datadir,exp_object.expname,'run%03d' % entry,'INPUT','res'))
-#                 print 'would be removing ' + P(exp_object.datadir,exp_object.expname,'run'+str(entry),'INPUT','res')
-            except sh.ErrorReturnCode_1:
-                pass
-#                 print 'Tried to remove some restart files, but number '+str(entry)+' does not exist'                
+    remove_run_files(exp_object, max_num_files, interval, lambda run: P(exp_object.datadir,exp_object.expname,'run%03d' % run,'INPUT','res'))
 
 def keep_only_certain_daily_data_uninterp(exp_object, max_num_files, interval=None, file_name = 'atmos_daily.nc'):
 
-    #        sh.ls(sh.glob(P(self.workdir,'restarts','res_*.cpio'))) #TODO get max_num_files calculated in line, rather than a variable to pass.
-
-            #First defines a list of ALL the restart file numbers
-        files_to_remove=list(range(0,max_num_files))
-
-        if interval is not None:
-            #Then defines a list of the ones we want to KEEP
-            files_to_keep  =list(range(0,max_num_files,interval)) 
-            #Then we remove the files we want to keep from the list of all files, giving a list of those we wish to remove
-            for x in files_to_keep:
-                   files_to_remove.remove(x) 
-
-            #Then we remove them.
-        for entry in files_to_remove:           
-            try:
-                sh.rm(P(exp_object.datadir,exp_object.expname,'run%03d' % entry,file_name))
-                print(('Removed '+P(exp_object.datadir,exp_object.expname,'run%03d' % entry,file_name)))        
-            except sh.ErrorReturnCode_1:
-                pass
-#                 print 'Tried to remove some atmos_daily files, but number '+str(entry)+' does not exist'
-
+    remove_run_files(exp_object, max_num_files, interval, lambda run: P(exp_object.datadir,exp_object.expname,'run%03d' % run,file_name))
 
             
 if __name__=="__main__":
@@ -23,6 +23,7 @@ setup(name='Isca',
         'f90nml',
         'numpy',
         'pandas',
-        'xarray'
+        'xarray',
+        'netCDF4'
       ]
      )
\ No newline at end of file
@@ -0,0 +1,67 @@
+import os
+
+from isca.diagtable import DiagTable, tokenize
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), '..', 'exp', 'run_isca', 'input', 'diag_table')
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_round_trip(tmp_path):
+    dt = DiagTable.from_file(EXAMPLE)
+    assert dt.title == 'FMS Model results'
+    assert dt.has_calendar()
+    assert list(dt.files) == ['atmos_monthly']
+    fields = dt.files['atmos_monthly']['fields']
+    assert len(fields) == 11
+    assert fields[0] == {'module': 'dynamics', 'name': 'ps', 'output_name': 'ps', 'time_sampling': 'all',
+                         'time_avg': True, 'other_opts': 'none', 'precision': 2}
+
+    outfile = str(tmp_path / 'diag_table')
+    dt.write(outfile)
+    assert read_bytes(outfile) == read_bytes(EXAMPLE)
+
+
+def test_round_trip_with_change(tmp_path):
+    dt = DiagTable.from_file(EXAMPLE)
+    dt.files['atmos_monthly']['fields'][1]['precision'] = 1
+    outfile = str(tmp_path / 'diag_table')
+    dt.write(outfile)
+
+    with open(EXAMPLE) as f:
+        expected = f.read().splitlines()
+    with open(outfile) as f:
+        written = f.read().splitlines()
+    changed = [i for i, (a, b) in enumerate(zip(expected, written)) if a != b]
+    assert len(written) == len(expected)
+    assert len(changed) == 1
+    assert tokenize(written[changed[0]]) == ['dynamics', 'bk', 'bk', 'atmos_monthly', 'all', False, 'none', 1]
+
+
+def test_quoted_commas(tmp_path):
+    dt = DiagTable()
+    dt.title = 'Held-Suarez, T42, 25 levels'
+    dt.add_file('atmos_daily', 1, 'days', time_units='days', time_name='time, in days')
+    dt.add_field('dynamics', 'ucomp', time_avg=True)
+    dt.add_field('dynamics', 'temp', time_avg=True, output_name='temp_tropics', region=(0, 360, -30, 30))
+    dt.files['atmos_daily']['fields'][0]['other_opts'] = 'units=m/s, long_name=zonal wind'
+    generated = str(tmp_path / 'diag_table')
+    dt.write(generated)
+
+    assert tokenize('"dynamics", "ucomp", "ucomp", "atmos_daily", "all", .true., "a, b", 2, # "c, d"') == \
+        ['dynamics', 'ucomp', 'ucomp', 'atmos_daily', 'all', True, 'a, b', 2]
+
+    read = DiagTable.from_file(generated)
+    assert read.title == 'Held-Suarez, T42, 25 levels'
+    assert read.files['atmos_daily']['time_name'] == 'time, in days'
+    ucomp, temp = read.files['atmos_daily']['fields']
+    assert ucomp['other_opts'] == 'units=m/s, long_name=zonal wind'
+    assert temp['output_name'] == 'temp_tropics'
+    assert temp['other_opts'] == '0 360 -30 30 -1 -1'
+
+    rewritten = str(tmp_path / 'diag_table_rewritten')
+    read.write(rewritten)
+    assert read_bytes(rewritten) == read_bytes(generated)
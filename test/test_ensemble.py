@@ -0,0 +1,68 @@
+import os
+import stat
+
+from netCDF4 import Dataset
+import numpy as np
+import pytest
+
+from isca.ensemble import make_ensemble
+from isca.restart import edit_restart, edit_dataset
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def restart_dir(tmp_path):
+    d = tmp_path / 'restart'
+    d.mkdir()
+    with Dataset(str(d / 'atmosphere.res.nc'), 'w') as ds:
+        ds.createDimension('lat', 4)
+        ds.createDimension('lon', 8)
+        ds.createVariable('t_surf', 'f8', ('lat', 'lon'))[:] = np.full((4, 8), 280.0)
+    with Dataset(str(d / 'mixed_layer.res.nc'), 'w') as ds:
+        ds.createDimension('lat', 4)
+        ds.createDimension('lon', 8)
+        ds.createVariable('sst', 'f8', ('lat', 'lon'))[:] = np.full((4, 8), 290.0)
+    return str(d)
+
+
+def test_members_are_perturbed(tmp_path, restart_dir):
+    members = make_ensemble(restart_dir, str(tmp_path / 'ens'), seeds=[1, 2],
+                            perturbations={'t_surf': 0.1}, processes=1)
+    values = []
+    for member in members:
+        with Dataset(os.path.join(member, 'atmosphere.res.nc')) as ds:
+            values.append(ds['t_surf'][:])
+    assert not np.array_equal(values[0], values[1])
+    assert not np.array_equal(values[0], np.full((4, 8), 280.0))
+
+
+def test_editing_a_member_leaves_the_others(tmp_path, restart_dir):
+    source = os.path.join(restart_dir, 'mixed_layer.res.nc')
+    original = read_bytes(source)
+    members = make_ensemble(restart_dir, str(tmp_path / 'ens'), seeds=[1, 2, 3],
+                            perturbations={'t_surf': 0.1}, processes=1)
+    shared = [os.path.join(member, 'mixed_layer.res.nc') for member in members]
+
+    # the unperturbed file is shared read-only, and never linked to the user's own
+    assert os.stat(source).st_nlink == 1
+    assert all(os.path.samefile(shared[0], f) for f in shared[1:])
+    assert not os.stat(shared[0]).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+
+    with edit_restart(members[0]) as res:
+        with res.open_dataset('mixed_layer.res.nc') as ds:
+            ds['sst'][:] = 300.0
+    with edit_dataset(shared[1], variables=['sst']) as ds:
+        ds['sst'].values[0, 0] = 310.0
+
+    with Dataset(shared[0]) as ds:
+        assert (ds['sst'][:] == 300.0).all()
+    with Dataset(shared[1]) as ds:
+        sst = ds['sst'][:]
+        assert sst[0, 0] == 310.0
+        assert (sst.ravel()[1:] == 290.0).all()
+    assert read_bytes(shared[2]) == original
+    assert read_bytes(source) == original
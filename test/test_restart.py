@@ -0,0 +1,147 @@
+import os
+import tarfile
+
+from netCDF4 import Dataset
+import numpy as np
+import pytest
+
+from isca.restart import RestartArchive, edit_restart, edit_dataset
+
+
+def write_restart_file(path, value):
+    with Dataset(path, 'w') as ds:
+        ds.createDimension('lat', 4)
+        ds.createDimension('lon', 8)
+        var = ds.createVariable('t', 'f8', ('lat', 'lon'))
+        var.units = 'K'
+        var[:] = np.full((4, 8), value)
+        other = ds.createVariable('ps', 'f8', ('lat', 'lon'))
+        other[:] = np.full((4, 8), 1e5)
+
+
+@pytest.fixture
+def restart_dir(tmp_path):
+    d = tmp_path / 'restart'
+    d.mkdir()
+    write_restart_file(str(d / 'atmosphere.res.nc'), 280.0)
+    write_restart_file(str(d / 'spectral_dynamics.res.nc'), 290.0)
+    return str(d)
+
+
+@pytest.fixture
+def restart_archive(tmp_path, restart_dir):
+    archive = str(tmp_path / 'res0001.tar.gz')
+    with tarfile.open(archive, 'w:gz') as tar:
+        tar.add(restart_dir, arcname='.')
+    return archive
+
+
+def read_members(archive):
+    with tarfile.open(archive, 'r:gz') as tar:
+        return {os.path.basename(ti.name): tar.extractfile(ti).read()
+                for ti in tar.getmembers() if ti.isfile()}
+
+
+def test_edit_archive_member(tmp_path, restart_archive):
+    before = read_members(restart_archive)
+    outfile = str(tmp_path / 'res_perturbed.tar.gz')
+    with edit_restart(restart_archive, outfile) as res:
+        assert sorted(res) == ['atmosphere.res.nc', 'spectral_dynamics.res.nc']
+        with res.open_dataset('atmosphere.res.nc') as ds:
+            ds['t'][0, 0] += 1.0
+        assert res.modified() == ['atmosphere.res.nc']
+
+    after = read_members(outfile)
+    assert sorted(after) == sorted(before)
+    assert after['spectral_dynamics.res.nc'] == before['spectral_dynamics.res.nc']
+    assert after['atmosphere.res.nc'] != before['atmosphere.res.nc']
+    # the original archive is left alone
+    assert read_members(restart_archive) == before
+
+    with RestartArchive(outfile) as res:
+        with res.open_dataset('atmosphere.res.nc', 'r') as ds:
+            t = ds['t'][:]
+            assert t[0, 0] == 281.0
+            assert (t.ravel()[1:] == 280.0).all()
+
+
+def test_edit_archive_in_place(restart_archive):
+    before = read_members(restart_archive)
+    with edit_restart(restart_archive) as res:
+        with res.open_dataset('spectral_dynamics.res.nc') as ds:
+            ds['ps'][:] = 9e4
+    after = read_members(restart_archive)
+    assert after['atmosphere.res.nc'] == before['atmosphere.res.nc']
+    assert after['spectral_dynamics.res.nc'] != before['spectral_dynamics.res.nc']
+
+
+def test_unmodified_archive_is_copied(tmp_path, restart_archive):
+    outfile = str(tmp_path / 'copy.tar.gz')
+    with edit_restart(restart_archive, outfile) as res:
+        res['atmosphere.res.nc']
+        assert res.modified() == []
+    with open(restart_archive, 'rb') as a, open(outfile, 'rb') as b:
+        assert a.read() == b.read()
+
+
+def test_edit_restart_directory(tmp_path, restart_dir):
+    path = os.path.join(restart_dir, 'atmosphere.res.nc')
+    with open(os.path.join(restart_dir, 'spectral_dynamics.res.nc'), 'rb') as f:
+        untouched = f.read()
+    outfile = str(tmp_path / 'res_from_dir.tar.gz')
+    with edit_restart(restart_dir, outfile) as res:
+        assert res['atmosphere.res.nc'] == path
+        with res.open_dataset('atmosphere.res.nc') as ds:
+            ds['t'][:] = 300.0
+        assert res.modified() == ['atmosphere.res.nc']
+
+    # a directory is edited in place, and written as an archive when asked to
+    with Dataset(path) as ds:
+        assert (ds['t'][:] == 300.0).all()
+    with open(os.path.join(restart_dir, 'spectral_dynamics.res.nc'), 'rb') as f:
+        assert f.read() == untouched
+    members = read_members(outfile)
+    assert sorted(members) == ['atmosphere.res.nc', 'spectral_dynamics.res.nc']
+    with open(path, 'rb') as f:
+        assert members['atmosphere.res.nc'] == f.read()
+
+
+def test_edit_dataset_in_place(restart_dir):
+    path = os.path.join(restart_dir, 'atmosphere.res.nc')
+    inode = os.stat(path).st_ino
+    with edit_dataset(path, variables=['t']) as ds:
+        ds['t'].values[1, :] = 270.0
+    # values are written into the existing file rather than a new one
+    assert os.stat(path).st_ino == inode
+    with Dataset(path) as ds:
+        t = ds['t'][:]
+        assert (t[1] == 270.0).all()
+        assert (t[0] == 280.0).all()
+        assert ds['t'].units == 'K'
+        assert (ds['ps'][:] == 1e5).all()
+
+
+def test_edit_dataset_replaced_variable(restart_dir):
+    path = os.path.join(restart_dir, 'atmosphere.res.nc')
+    inode = os.stat(path).st_ino
+    with edit_dataset(path, variables=[]) as ds:
+        ds['ps'] = ds['ps'] * 0.5
+    assert os.stat(path).st_ino == inode
+    with Dataset(path) as ds:
+        assert (ds['ps'][:] == 5e4).all()
+
+
+def test_edit_dataset_rewrite(restart_dir):
+    path = os.path.join(restart_dir, 'atmosphere.res.nc')
+    inode = os.stat(path).st_ino
+    with edit_dataset(path) as ds:
+        ds['q'] = ds['t'] * 0.0
+        ds.attrs['title'] = 'perturbed'
+    # a change of structure rewrites the whole file
+    assert os.stat(path).st_ino != inode
+    assert not os.path.exists(path + '.swp')
+    with Dataset(path) as ds:
+        assert 'q' in ds.variables
+        assert ds.title == 'perturbed'
+        assert (ds['t'][:] == 280.0).all()
+        assert (ds['ps'][:] == 1e5).all()
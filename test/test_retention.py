@@ -0,0 +1,108 @@
+import logging
+import os
+
+import pytest
+
+from isca.retention import RetentionPolicy, apply_retention_policy, restart_files
+
+
+class FakeExperiment(object):
+    """Just enough of an Experiment for the retention functions."""
+    def __init__(self, restartdir, days=30, calendar='thirty_day', policy=None):
+        self.name = 'retention_test'
+        self.restartdir = restartdir
+        self.restartfmt = 'res%04d.tar.gz'
+        self.namelist = {'main_nml': {'days': days, 'calendar': calendar}}
+        self.restart_policy = policy
+        self.log = logging.getLogger('retention_test')
+
+    def get_calendar(self):
+        return self.namelist['main_nml']['calendar']
+
+
+def make_restarts(restartdir, runs):
+    os.makedirs(restartdir, exist_ok=True)
+    for r in runs:
+        with open(os.path.join(restartdir, 'res%04d.tar.gz' % r), 'wb') as f:
+            f.write(b'\0' * 100)
+
+
+RUNS = list(range(1, 31))
+
+
+def test_every():
+    keep = RetentionPolicy(every=12, keep_latest=False).runs_to_keep(RUNS)
+    assert keep == {12, 24}
+
+
+def test_last():
+    keep = RetentionPolicy(last=3, keep_latest=False).runs_to_keep(RUNS)
+    assert keep == {28, 29, 30}
+
+
+def test_years():
+    policy = RetentionPolicy(years=[1, 2], keep_latest=False)
+    assert policy.runs_to_keep(RUNS, runs_per_year=12) == {12, 24}
+    # the policy's own runs_per_year takes precedence
+    policy = RetentionPolicy(years=[1, 2], runs_per_year=6, keep_latest=False)
+    assert policy.runs_to_keep(RUNS, runs_per_year=12) == {6, 12}
+    with pytest.raises(ValueError):
+        RetentionPolicy(years=[1]).runs_to_keep(RUNS)
+
+
+def test_keep():
+    keep = RetentionPolicy(keep=[5, 7, 100], keep_latest=False).runs_to_keep(RUNS)
+    assert keep == {5, 7}
+
+
+def test_keep_latest():
+    assert RetentionPolicy(every=12).runs_to_keep(RUNS) == {12, 24, 30}
+    assert RetentionPolicy(every=12, keep_latest=False).runs_to_keep(RUNS) == {12, 24}
+    assert RetentionPolicy().runs_to_keep([]) == set()
+
+
+def test_combined():
+    policy = RetentionPolicy(every=10, last=2, keep=[3])
+    assert policy.runs_to_keep(RUNS) == {3, 10, 20, 29, 30}
+    assert policy.runs_to_delete([1, 3, 10, 11]) == [1]
+
+
+def test_restart_files_match_restartfmt(tmp_path):
+    restartdir = str(tmp_path / 'restarts')
+    make_restarts(restartdir, [1, 2, 12])
+    for other in ('res0003.tar.gz.tmp', 'res12.tar', 'notes.txt', 'res00x4.tar.gz'):
+        with open(os.path.join(restartdir, other), 'w') as f:
+            f.write('not a restart')
+    restarts = restart_files(FakeExperiment(restartdir))
+    assert restarts == {r: os.path.join(restartdir, 'res%04d.tar.gz' % r) for r in (1, 2, 12)}
+
+
+def test_apply_retention_policy(tmp_path):
+    restartdir = str(tmp_path / 'restarts')
+    make_restarts(restartdir, range(1, 25))
+    with open(os.path.join(restartdir, 'notes.txt'), 'w') as f:
+        f.write('not a restart')
+    # 30 day runs in a 360 day calendar are 12 runs a year
+    exp = FakeExperiment(restartdir, policy=RetentionPolicy(years=[1], last=1, keep_latest=False))
+
+    deleted, freed = apply_retention_policy(exp, current=5)
+    assert deleted == [r for r in range(1, 24) if r not in (5, 12)]
+    assert freed == 100 * len(deleted)
+    assert sorted(restart_files(exp)) == [5, 12, 24]
+    assert os.path.exists(os.path.join(restartdir, 'notes.txt'))
+
+
+def test_apply_retention_policy_keeps_current(tmp_path):
+    restartdir = str(tmp_path / 'restarts')
+    make_restarts(restartdir, range(1, 11))
+    exp = FakeExperiment(restartdir)
+
+    # run 6 has just finished, though later restarts exist from an earlier attempt
+    deleted, _ = apply_retention_policy(exp, RetentionPolicy(every=5), current=6)
+    assert 6 not in deleted
+    assert sorted(restart_files(exp)) == [5, 6, 10]
+
+    policy = RetentionPolicy(every=5, keep_latest=False)
+    deleted, _ = apply_retention_policy(exp, policy, runs=[5, 6], current=5)
+    assert deleted == [6]
+    assert sorted(restart_files(exp)) == [5, 10]